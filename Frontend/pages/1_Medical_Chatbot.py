@@ -74,6 +74,9 @@ for m in st.session_state["rag_messages"]:
                     page = (ref or {}).get("page", "N/A")
                     link = (ref or {}).get("link") or (ref or {}).get("url") or "#"
                     st.markdown(f"- Page **{page}** — [{link}]({link})")
+                    snapshot = (ref or {}).get("snapshot_url")
+                    if snapshot:
+                        st.image(f"{API_BASE}{snapshot}", caption=f"Page {page}", width=320)
 
 # Actions
 c1, c2, _ = st.columns([1,1,4])
@@ -69,6 +69,9 @@ def _render_structured(payload):
                     page = (ref or {}).get("page", "N/A")
                     link = (ref or {}).get("link") or (ref or {}).get("url") or "#"
                     st.markdown(f"- Page **{page}** — [{link}]({link})")
+                    snapshot = (ref or {}).get("snapshot_url")
+                    if snapshot:
+                        st.image(f"{API_BASE}{snapshot}", caption=f"Page {page}", width=320)
         return
 
     # --- Register patient ---
@@ -1,10 +1,13 @@
 # Src/api/fastapi_app.py
 import os
+import time
 from datetime import datetime
 
-from fastapi import FastAPI, Query, Header
+from fastapi import FastAPI, Query, Header, Path
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, FileResponse
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
 from sqlalchemy import text, select
 
 # DB and services
@@ -18,12 +21,18 @@ from ..services.doctor_service import release_stale_doctors
 from ..services.doctor_assignment import assign_doctor_with_gemma
 from ..services.summarizer import summarize_patient_case
 # RAG
-from ..rag.rag_pipeline import rag_query_multimodal
+from ..rag.rag_pipeline import rag_query_multimodal, get_answer_cache, ANSWER_CACHE_ENABLED
+from ..rag.retriever import retriever, retrieve_top_k_batch, shard_set, SHARDED, UnsupportedModeError
+from ..rag.snapshots import get_snapshot_cache, SNAPSHOT_TIERS, MEDIA_TYPES
 # Agent system
 from ..agent.orchestrator import orchestrate_query
 from ..agent.agent_executor import get_agent_executor
 
 app = FastAPI(title="Medical Agentic Bot Backend FastAPI", version="1.0.0")
+APP_STARTED_AT = time.time()
+
+# Load the RAG index/model in a background thread at startup (set to 0 to load on first /query)
+RAG_WARMUP = os.getenv("RAG_WARMUP", "1") == "1"
 
 # ----------------------------
 # CORS (Streamlit Space + local dev)
@@ -42,12 +51,52 @@ app.add_middleware(
 )
 
 # ----------------------------
-# On Startup: DB Init + Seed
+# On Startup: DB Init + Seed + RAG warm-up
 # ----------------------------
 @app.on_event("startup")
 def startup_event():
     init_db()
     seed_data()
+    if RAG_WARMUP:
+        retriever.warm_up(background=True)
+
+@app.on_event("shutdown")
+def shutdown_event():
+    # Persist the query-embedding cache so repeated questions survive restarts
+    retriever.save_caches()
+
+# ----------------------------
+# Health (liveness / readiness)
+# ----------------------------
+@app.get("/health/live", tags=["Health"])
+def health_live():
+    """Process is up and serving requests."""
+    return {"status": "alive", "uptime_seconds": round(time.time() - APP_STARTED_AT, 3)}
+
+@app.get("/health/ready", tags=["Health"])
+def health_ready():
+    """
+    Reports which RAG components (index, metadata, embedding model) are loaded
+    and how long each took. Returns 503 until all of them are ready.
+    """
+    status = retriever.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.get("/rag/stats", tags=["Health"])
+def rag_stats():
+    """Cache hit/miss counters for the RAG pipeline."""
+    stats = retriever.cache_stats()
+    stats["answer_cache"] = get_answer_cache().stats() if ANSWER_CACHE_ENABLED else None
+    stats["snapshot_cache"] = get_snapshot_cache().stats()
+    return stats
+
+@app.get("/rag/shards", tags=["Health"])
+def rag_shards():
+    """Registered corpus shards and whether this worker has them loaded (sharded corpus only)."""
+    if not SHARDED:
+        return {"sharded": False, "shards": {}}
+    shard_set.sync()
+    return {"sharded": True, "shards": shard_set.status()}
 
 # ----------------------------
 # Root
@@ -78,11 +127,77 @@ def read_root():
 # ----------------------------
 # 1. Medical RAG Chatbot
 # ----------------------------
+RetrievalMode = Literal["dense", "hybrid", "lexical", "rerank"]
+
+def _page_range(page_from: Optional[int], page_to: Optional[int]):
+    if page_from is None and page_to is None:
+        return None
+    return (page_from or 1, page_to or 10**9)
+
 @app.get("/query")
-def query_bot(q: str = Query(...), authorization: str = Header(...)):
+def query_bot(q: str = Query(...),
+              mode: Optional[RetrievalMode] = Query(None, description="dense | hybrid | lexical | rerank"),
+              section: Optional[str] = Query(None, description="Definition | Causes | Diagnosis | Treatment"),
+              page_from: Optional[int] = Query(None), page_to: Optional[int] = Query(None),
+              document: Optional[str] = Query(None, description="source pdf file, e.g. medical_book.pdf"),
+              authorization: str = Header(...)):
     hf_token = authorization.replace("Bearer ", "")
-    answer, references = rag_query_multimodal(q, k=10, hf_token=hf_token)
-    return {"answer": answer, "references": references}
+    try:
+        answer, references, meta = rag_query_multimodal(q, k=10, hf_token=hf_token, mode=mode,
+                                                        return_meta=True, section=section,
+                                                        pages=_page_range(page_from, page_to),
+                                                        document=document)
+    except UnsupportedModeError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    return {"answer": answer, "references": references, "cache": meta["cache"]}
+
+# ----------------------------
+# 1b. Batched retrieval (no LLM call)
+# ----------------------------
+class RetrieveBatchRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=256)
+    k: int = Field(5, ge=1, le=50)
+    similarity_threshold: float = 0
+    mode: Optional[RetrievalMode] = None
+    section: Optional[str] = None
+    page_from: Optional[int] = None
+    page_to: Optional[int] = None
+    document: Optional[str] = None
+
+@app.post("/retrieve_batch")
+def retrieve_batch_api(data: RetrieveBatchRequest, authorization: str = Header(...)):
+    """
+    Retrieve the top-k pages for many queries in one request (one encoder pass,
+    one index search). `results[i]` holds the page-grouped hits for `queries[i]`.
+    """
+    try:
+        results = retrieve_top_k_batch(data.queries, k=data.k,
+                                       similarity_threshold=data.similarity_threshold, mode=data.mode,
+                                       section=data.section, pages=_page_range(data.page_from, data.page_to),
+                                       document=data.document)
+    except UnsupportedModeError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    return {"results": results}
+
+# ----------------------------
+# 1c. Page snapshots (rendered on first request, cached on disk)
+# ----------------------------
+@app.get("/snapshot/{pdf_file}/{page_num}")
+def page_snapshot(pdf_file: str, page_num: int = Path(..., ge=1),
+                  tier: str = Query("preview", description="thumbnail | preview | full")):
+    """
+    Snapshot image of one page of a source PDF. Public (no auth header, so it
+    works as an <img> src); unknown documents, pages outside the document and
+    unreadable PDFs are a 404, not a render.
+    """
+    if tier not in SNAPSHOT_TIERS:
+        return JSONResponse(status_code=400, content={"error": f"tier must be one of {sorted(SNAPSHOT_TIERS)}"})
+    path = get_snapshot_cache().get(pdf_file, page_num, tier)
+    if path is None:
+        return JSONResponse(status_code=404, content={"error": "snapshot not available"})
+    ext = os.path.splitext(path)[1].lstrip(".")
+    return FileResponse(path, media_type=MEDIA_TYPES.get(ext, "application/octet-stream"),
+                        headers={"Cache-Control": "public, max-age=86400"})
 
 # ----------------------------
 # 2. Register Patient + Assign Doctor
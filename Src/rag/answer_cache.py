@@ -0,0 +1,124 @@
+# Src/rag/answer_cache.py
+"""
+Semantic answer cache in front of the LLM call of rag_query_multimodal.
+
+An answer is reused when a new query
+  - retrieved exactly the same chunk-id set (same context), and
+  - has a query embedding with cosine >= threshold to the cached query,
+  - and the entry is younger than the TTL.
+
+Entries live in SQLite (WAL mode), so every uvicorn worker shares the same
+cache and it survives restarts. Size is bounded by evicting the least
+recently hit entries.
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chunk_key TEXT NOT NULL,
+    query TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    answer TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_hit_at REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_answers_chunk_key ON answers (chunk_key);
+CREATE INDEX IF NOT EXISTS idx_answers_last_hit ON answers (last_hit_at);
+"""
+
+
+def chunk_set_key(chunk_ids, namespace=""):
+    """Stable key for an unordered set of retrieved chunk ids (+ corpus/model namespace)."""
+    ids = ",".join(str(c) for c in sorted(set(chunk_ids)))
+    return hashlib.sha1(f"{namespace}|{ids}".encode("utf-8")).hexdigest()
+
+
+class SemanticAnswerCache:
+    def __init__(self, db_path, threshold=0.92, ttl_seconds=7 * 24 * 3600, max_entries=5000):
+        self.db_path = db_path
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def lookup(self, query_vec, chunk_key):
+        """Return the cached answer for this chunk set + similar query, or None."""
+        query_vec = np.asarray(query_vec, dtype=np.float32)
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, embedding, answer FROM answers WHERE chunk_key = ? AND created_at >= ?",
+                (chunk_key, now - self.ttl_seconds),
+            ).fetchall()
+
+            best_id, best_answer, best_sim = None, None, -1.0
+            for row_id, blob, answer in rows:
+                emb = np.frombuffer(blob, dtype=np.float32)
+                sim = float(np.dot(query_vec, emb) /
+                            ((np.linalg.norm(query_vec) * np.linalg.norm(emb)) or 1.0))
+                if sim > best_sim:
+                    best_id, best_answer, best_sim = row_id, answer, sim
+
+            if best_id is None or best_sim < self.threshold:
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE answers SET hits = hits + 1, last_hit_at = ? WHERE id = ?", (now, best_id)
+            )
+            self._conn.commit()
+            self.hits += 1
+            return best_answer
+
+    def store(self, query, query_vec, chunk_key, answer):
+        now = time.time()
+        blob = np.asarray(query_vec, dtype=np.float32).tobytes()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO answers (chunk_key, query, embedding, answer, created_at, last_hit_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (chunk_key, query, blob, answer, now, now),
+            )
+            # TTL + size eviction (least recently hit first)
+            self._conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._conn.execute(
+                "DELETE FROM answers WHERE id IN ("
+                " SELECT id FROM answers ORDER BY last_hit_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+            "db_path": self.db_path,
+        }
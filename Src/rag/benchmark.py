@@ -0,0 +1,497 @@
+# Src/rag/benchmark.py
+"""
+Retrieval benchmark and regression suite.
+
+    python -m Src.rag.benchmark retrieval --modes dense hybrid rerank --k 5
+    python -m Src.rag.benchmark synthetic --chunks 20000 --index-types flat hnsw sq8
+    python -m Src.rag.benchmark retrieval --baseline Artifacts/benchmark/results/retrieval-<time>.json
+    python -m Src.rag.benchmark clean_text --pdf Artifacts/raw_pdf/medical_book.pdf
+    python -m Src.rag.benchmark captions
+
+`retrieval` runs the fixed query set (Artifacts/benchmark/queries.json)
+through retriever.retrieve_top_k on the built index, per retrieval mode.
+`synthetic` generates a corpus of the requested size, builds it with
+embed_store for each index type (in a fresh process, so peak memory is per
+build) and runs generated queries whose relevant page is known.
+`clean_text` runs pdf_utils.clean_text and clean_text_fast over every page of
+a PDF, checks that they return the same text and reports both throughputs.
+`captions` checks a preprocess -> embed_store run end to end: the chunk file
+carries image captions and the caption index in Artifacts/embeddings holds
+one entry per embeddable caption.
+
+Reported per run: recall@k / hit@k / MRR over labeled relevant pages,
+page recall against an exact search over the stored chunk vectors,
+p50/p95/p99 latency, QPS (one query at a time and batched), index build
+time and size, and peak RSS. Results are written as JSON to
+Artifacts/benchmark/results/; `--baseline` compares against an earlier
+result file and exits with status 1 on a regression.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import argparse
+import platform
+import resource
+import subprocess
+import multiprocessing
+import faiss
+import numpy as np
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+DATA_DIR = os.path.join(BASE_DIR, "Artifacts")
+RAW_PDF_DIR = os.path.join(DATA_DIR, "raw_pdf")
+BENCHMARK_DIR = os.path.join(DATA_DIR, "benchmark")
+QUERIES_PATH = os.path.join(BENCHMARK_DIR, "queries.json")
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+SYNTHETIC_DIR = os.path.join(BENCHMARK_DIR, "synthetic")
+
+# Regression thresholds for --baseline
+MAX_RECALL_DROP = 0.02        # absolute
+MAX_LATENCY_INCREASE = 0.25   # relative p95
+
+
+# ---------------- METRICS ----------------
+def _percentiles(latencies_ms):
+    latencies_ms = np.asarray(latencies_ms, dtype=np.float64)
+    return {
+        "latency_ms_p50": round(float(np.percentile(latencies_ms, 50)), 3),
+        "latency_ms_p95": round(float(np.percentile(latencies_ms, 95)), 3),
+        "latency_ms_p99": round(float(np.percentile(latencies_ms, 99)), 3),
+    }
+
+
+def _peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def quality_metrics(results, queries, k):
+    """
+    recall@k, hit@k and MRR over the labeled queries. `results` are the
+    page-grouped outputs of retrieve_top_k; pages are ranked by their best chunk.
+    """
+    recalls, hits, reciprocal_ranks = [], [], []
+    for result, q in zip(results, queries):
+        relevant = q.get("relevant_pages")
+        if not relevant:
+            continue
+        # Pages are matched by number, and also by document when the query names one
+        document = q.get("document")
+        relevant = {(int(page), document) for page in relevant}
+        ranked = sorted(result, key=lambda r: r.get("rank", 0))
+        retrieved = [(int(r["page_num"]), r.get("pdf_file") if document else None) for r in ranked]
+        found = relevant & set(retrieved)
+        recalls.append(len(found) / len(relevant))
+        hits.append(1.0 if found else 0.0)
+        first = next((i for i, page in enumerate(retrieved, start=1) if page in relevant), None)
+        reciprocal_ranks.append(1.0 / first if first else 0.0)
+    if not recalls:
+        return {"labeled_queries": 0}
+    return {
+        "labeled_queries": len(recalls),
+        f"recall@{k}": round(float(np.mean(recalls)), 4),
+        f"hit@{k}": round(float(np.mean(hits)), 4),
+        "mrr": round(float(np.mean(reciprocal_ranks)), 4),
+    }
+
+
+def exact_page_recall(source, query_vecs, results, k):
+    """
+    Share of the pages of the exact top-k chunks (brute force over the stored
+    chunk vectors) that the retriever also returned. None without chunk vectors.
+    """
+    vectors = source.chunk_vectors
+    if vectors is None:
+        return None
+    # Tombstone rows of incremental builds are all-zero: keep them out of the top-k
+    live = np.flatnonzero(np.any(np.asarray(vectors) != 0, axis=1))
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(np.ascontiguousarray(vectors[live], dtype=np.float32))
+    _, top = exact.search(np.ascontiguousarray(query_vecs, dtype=np.float32), k)
+
+    recalls = []
+    for rows, result in zip(top, results):
+        exact_pages = set()
+        for row in live[rows[rows >= 0]]:
+            chunk = source.metadata[int(row)]
+            exact_pages.add((chunk["page_num"], chunk["pdf_file"]))
+        retrieved = {(r["page_num"], r["pdf_file"]) for r in result}
+        recalls.append(len(exact_pages & retrieved) / max(1, len(exact_pages)))
+    return round(float(np.mean(recalls)), 4)
+
+
+# ---------------- RETRIEVAL RUN ----------------
+def load_queries(path=QUERIES_PATH):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data["queries"] if isinstance(data, dict) else data
+
+
+def benchmark_retrieval(queries, modes=("dense",), k=5, rounds=3):
+    """
+    Run `queries` through retriever.retrieve_top_k for each mode. The query
+    embedding cache is cleared before each mode, so round 1 includes encoding
+    and later rounds show the cached path.
+    """
+    # Imported here: loading the retriever module reads the index config and shard registry
+    from Src.rag import retriever as retriever_module
+
+    source = retriever_module.retriever
+    texts = [q["query"] for q in queries]
+    start = time.perf_counter()
+    source.load_all()
+    load_seconds = time.perf_counter() - start
+
+    report = {
+        "n_queries": len(queries),
+        "k": k,
+        "rounds": rounds,
+        "load_seconds": round(load_seconds, 3),
+        "index": {key: (source.index_config or {}).get(key) for key in
+                  ("index_type", "factory", "params", "ntotal", "index_bytes", "encoder", "build",
+                   "train_seconds", "build_seconds")},
+        "modes": {},
+    }
+    query_vecs = retriever_module.encode_queries(texts)
+    for mode in modes:
+        source.query_cache.clear()
+        latencies, first_round = [], []
+        results = None
+        for round_num in range(rounds):
+            round_results = []
+            for text in texts:
+                t0 = time.perf_counter()
+                round_results.append(retriever_module.retrieve_top_k(text, k=k, mode=mode))
+                elapsed = (time.perf_counter() - t0) * 1000
+                latencies.append(elapsed)
+                if round_num == 0:
+                    first_round.append(elapsed)
+            results = results or round_results
+
+        t0 = time.perf_counter()
+        retriever_module.retrieve_top_k_batch(texts, k=k, mode=mode)
+        batch_seconds = time.perf_counter() - t0
+
+        mode_report = {
+            **quality_metrics(results, queries, k),
+            f"exact_page_recall@{k}": exact_page_recall(source, query_vecs, results, k) if mode == "dense" else None,
+            **_percentiles(latencies),
+            "uncached_latency_ms_p50": round(float(np.percentile(first_round, 50)), 3),
+            "qps": round(len(latencies) / (sum(latencies) / 1000), 1),
+            "batch_qps": round(len(texts) / batch_seconds, 1),
+        }
+        report["modes"][mode] = mode_report
+        print(f"[benchmark] {mode}: {mode_report}")
+
+    report["peak_rss_mb"] = _peak_rss_mb()
+    return report
+
+
+# ---------------- SYNTHETIC CORPUS ----------------
+_SYLLABLES = ("ab", "ar", "ca", "cor", "de", "der", "gen", "hem", "ia", "io", "lo", "ma", "my", "neu",
+              "os", "pa", "pul", "ra", "ren", "sis", "ta", "ther", "to", "um", "vas", "xi")
+_FILLER = ("the", "patient", "may", "with", "of", "and", "is", "treatment", "symptoms", "include",
+           "doctor", "can", "be", "in", "a", "to", "disease", "test", "cause", "often")
+
+
+def synthetic_corpus(n_chunks, chunks_per_page=4, words_per_chunk=60, n_queries=200, seed=0):
+    """
+    (chunks, queries) for scale tests. Every page has its own topic terms
+    (made-up words); its chunks mix them with common filler words, and each
+    query is a few topic terms of one page, which is its relevant page.
+    """
+    rng = random.Random(seed)
+    n_pages = max(1, n_chunks // chunks_per_page)
+    vocabulary = sorted({"".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4)))
+                         for _ in range(max(2000, n_pages * 3))})
+    topics = [rng.sample(vocabulary, 6) for _ in range(n_pages)]
+
+    chunks = []
+    for i in range(n_chunks):
+        page = i // chunks_per_page % n_pages + 1
+        words = [rng.choice(topics[page - 1]) if rng.random() < 0.3 else rng.choice(_FILLER)
+                 for _ in range(words_per_chunk)]
+        chunks.append({
+            "chunk_id": f"{page}_{i % chunks_per_page + 1}",
+            "page_num": page,
+            "content": " ".join(words) + ".",
+            "pdf_file": "synthetic.pdf",
+            "images": [],
+            "page_snapshot": None,
+            "captions": [],
+        })
+
+    queries = []
+    for page in rng.sample(range(1, n_pages + 1), min(n_queries, n_pages)):
+        queries.append({"query": " ".join(rng.sample(topics[page - 1], 3)), "relevant_pages": [page]})
+    return chunks, queries
+
+
+def _synthetic_worker(index_type, params, chunks_path, output_dir, queries, k, rounds, workers):
+    """One build + query run (executed in a fresh process so peak RSS is per index type)."""
+    from Src.rag.embed_store import create_faiss_index
+    from Src.rag.index_factory import load_index_config
+    from Src.rag import retriever as retriever_module
+
+    rss_before = _peak_rss_mb()
+    start = time.perf_counter()
+    create_faiss_index(index_type=index_type, chunks_path=chunks_path, output_dir=output_dir,
+                       full=True, workers=workers, **params)
+    build_seconds = time.perf_counter() - start
+    config = load_index_config(os.path.join(output_dir, "faiss_index.bin"))
+
+    # Point the module-level retriever (used by retrieve_top_k) at the synthetic build
+    retriever_module.SHARDED = False
+    retriever_module.retriever = retriever_module.Retriever.for_directory(output_dir, warm_components=None)
+    report = benchmark_retrieval(queries, modes=("dense",), k=k, rounds=rounds)
+    return {
+        "index_type": index_type,
+        "params": config["params"],
+        "build_seconds": round(build_seconds, 3),
+        "embed": {key: config["build"].get(key) for key in ("embedded", "chunks_per_second", "embed_workers")},
+        "index_bytes": config.get("index_bytes"),
+        "bytes_per_vector": config.get("bytes_per_vector"),
+        "index_report": config.get("report"),
+        "peak_rss_mb_before_build": rss_before,
+        "peak_rss_mb": _peak_rss_mb(),
+        **report["modes"]["dense"],
+    }
+
+
+def benchmark_synthetic(n_chunks, index_specs, k=10, rounds=2, n_queries=200, workers=None, seed=0):
+    """
+    Build the synthetic corpus once per (index_type, params) spec and query it.
+    Embeddings are computed by the first build and reused (content-hash store)
+    by the next ones, so later build times are index time only.
+    """
+    chunks, queries = synthetic_corpus(n_chunks, n_queries=n_queries, seed=seed)
+    corpus_dir = os.path.join(SYNTHETIC_DIR, f"{n_chunks}")
+    os.makedirs(corpus_dir, exist_ok=True)
+    chunks_path = os.path.join(corpus_dir, "chunks.json")
+    with open(chunks_path, "w", encoding="utf-8") as f:
+        json.dump(chunks, f)
+
+    runs = []
+    vector_store = None
+    context = multiprocessing.get_context("spawn")
+    for index_type, params in index_specs:
+        name = index_type + "".join(f"_{key}{value}" for key, value in sorted(params.items()))
+        output_dir = os.path.join(corpus_dir, name)
+        if vector_store and not os.path.exists(os.path.join(output_dir, "vector_store")):
+            shutil.copytree(vector_store, os.path.join(output_dir, "vector_store"))
+        print(f"[benchmark] synthetic {n_chunks} chunks: building {name}")
+        with context.Pool(1) as pool:
+            run = pool.apply(_synthetic_worker, (index_type, params, chunks_path, output_dir,
+                                                 queries, k, rounds, workers))
+        run["name"] = name
+        runs.append(run)
+        vector_store = vector_store or os.path.join(output_dir, "vector_store")
+        print(f"[benchmark] {name}: build {run['build_seconds']}s, recall@{k}={run.get(f'recall@{k}')}, "
+              f"p95={run['latency_ms_p95']}ms, peak RSS {run['peak_rss_mb']} MB")
+    return {"n_chunks": n_chunks, "n_queries": len(queries), "k": k, "runs": runs}
+
+
+# ---------------- CLEAN TEXT ----------------
+def benchmark_clean_text(pdf_path, rounds=3):
+    """
+    Throughput of clean_text (reference, with change log) vs. clean_text_fast
+    on the raw page texts of `pdf_path`. Pages whose outputs differ are listed
+    in "mismatched_pages"; the run exits with status 1 when there are any.
+    """
+    from pypdf import PdfReader
+    from Src.rag.pdf_utils import clean_text, clean_text_fast
+
+    texts = [page.extract_text() for page in PdfReader(pdf_path).pages]
+    mismatched = [page_num for page_num, text in enumerate(texts, start=1)
+                  if clean_text(text)[0] != clean_text_fast(text)]
+
+    seconds = {}
+    for name, fn in (("clean_text", clean_text), ("clean_text_fast", clean_text_fast)):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for text in texts:
+                fn(text)
+        seconds[name] = time.perf_counter() - start
+
+    report = {
+        "pdf": os.path.basename(pdf_path),
+        "pages": len(texts),
+        "rounds": rounds,
+        "mismatched_pages": mismatched,
+        "pages_per_second": {name: round(len(texts) * rounds / s, 1) for name, s in seconds.items()},
+        "speedup": round(seconds["clean_text"] / seconds["clean_text_fast"], 2),
+    }
+    print(f"[benchmark] clean_text: {report['pages_per_second']}, speedup {report['speedup']}x, "
+          f"{len(mismatched)} mismatched pages")
+    return report
+
+
+# ---------------- CAPTIONS ----------------
+def check_caption_index(chunks_path=None, embeddings_dir=None):
+    """
+    Captions on the chunks of `chunks_path` vs. the caption index built from
+    them. "problems" lists what is missing; the run exits with status 1 when
+    there is anything (e.g. chunks with images but no captions, or no index).
+    """
+    from Src.rag.embed_store import iter_chunks, PROCESSED_TEXT_PATH, CAPTION_INDEX_DIR
+    from Src.rag.caption_index import CaptionIndex, caption_index_exists, caption_records
+
+    chunks_path = chunks_path or PROCESSED_TEXT_PATH
+    index_dir = (CAPTION_INDEX_DIR if embeddings_dir is None
+                 else os.path.join(embeddings_dir, os.path.basename(CAPTION_INDEX_DIR)))
+    chunks = list(iter_chunks(chunks_path))
+    with_images = sum(1 for c in chunks if c.get("images"))
+    with_captions = sum(1 for c in chunks if c.get("captions"))
+    expected = len(caption_records(chunks))
+    indexed = len(CaptionIndex(index_dir)) if caption_index_exists(index_dir) else 0
+
+    problems = []
+    if with_images and not with_captions:
+        problems.append(f"{with_images} chunks have images but none carries captions (re-run preprocess.py)")
+    if expected and indexed == 0:
+        problems.append(f"{expected} captions but no caption index at {index_dir} (re-run embed_store)")
+    elif indexed != expected:
+        problems.append(f"caption index holds {indexed} captions, the chunks {expected} (rebuild the index)")
+
+    report = {
+        "chunks": len(chunks),
+        "chunks_with_images": with_images,
+        "chunks_with_captions": with_captions,
+        "embeddable_captions": expected,
+        "indexed_captions": indexed,
+        "problems": problems,
+    }
+    print(f"[benchmark] captions: {with_captions}/{with_images} chunks with images carry captions, "
+          f"{indexed}/{expected} captions indexed ({index_dir})")
+    return report
+
+
+# ---------------- RESULTS ----------------
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_result(kind, report, output=None):
+    result = {
+        "kind": kind,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "env": {name: os.getenv(name) for name in ("EMBED_BACKEND", "RETRIEVAL_MODE", "FAISS_NPROBE",
+                                                   "FAISS_EF_SEARCH", "EMBED_SERVICE_SOCKET")},
+        "report": report,
+    }
+    output = output or os.path.join(RESULTS_DIR, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"[benchmark] results written to {output}")
+    return output
+
+
+def _comparable_runs(report):
+    """{name: metrics} for a retrieval (per mode) or synthetic (per index) report."""
+    if "modes" in report:
+        return report["modes"]
+    return {run["name"]: run for run in report.get("runs", [])}
+
+
+def compare_to_baseline(report, baseline_path, max_recall_drop=MAX_RECALL_DROP,
+                        max_latency_increase=MAX_LATENCY_INCREASE):
+    """Print metric deltas vs. a previous result file; returns the list of regressions."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = _comparable_runs(json.load(f)["report"])
+    regressions = []
+    for name, current in _comparable_runs(report).items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        for metric, value in current.items():
+            old = before.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)):
+                continue
+            print(f"[benchmark] {name} {metric}: {old} -> {value}")
+            if metric.startswith(("recall@", "hit@", "exact_page_recall@", "mrr")) and value < old - max_recall_drop:
+                regressions.append(f"{name} {metric} dropped {old} -> {value}")
+            if metric == "latency_ms_p95" and old and value > old * (1 + max_latency_increase):
+                regressions.append(f"{name} p95 latency rose {old} -> {value} ms")
+    return regressions
+
+
+def _parse_spec(value):
+    """'hnsw' or 'ivf_pq:nlist=256,m=16' -> (index_type, params)."""
+    index_type, _, raw = value.partition(":")
+    params = {}
+    for item in filter(None, raw.split(",")):
+        key, _, v = item.partition("=")
+        params[key] = int(v) if v.isdigit() else v
+    return index_type, params
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retrieval benchmark / regression suite")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    retrieval_parser = sub.add_parser("retrieval", help="fixed query set against the built index")
+    retrieval_parser.add_argument("--queries", default=QUERIES_PATH)
+    retrieval_parser.add_argument("--modes", nargs="+", default=["dense"])
+    retrieval_parser.add_argument("--k", type=int, default=5)
+    retrieval_parser.add_argument("--rounds", type=int, default=3)
+
+    synthetic_parser = sub.add_parser("synthetic", help="generated corpus, one build per index type")
+    synthetic_parser.add_argument("--chunks", type=int, default=20000)
+    synthetic_parser.add_argument("--index-types", nargs="+", default=["flat", "hnsw", "sq8"],
+                                  metavar="TYPE[:NAME=VALUE,...]")
+    synthetic_parser.add_argument("--k", type=int, default=10)
+    synthetic_parser.add_argument("--rounds", type=int, default=2)
+    synthetic_parser.add_argument("--n-queries", type=int, default=200)
+    synthetic_parser.add_argument("--workers", type=int, default=None, help="encoder processes for the build")
+
+    clean_parser = sub.add_parser("clean_text", help="clean_text vs. clean_text_fast on a PDF's pages")
+    clean_parser.add_argument("--pdf", default=os.path.join(RAW_PDF_DIR, "medical_book.pdf"))
+    clean_parser.add_argument("--rounds", type=int, default=3)
+
+    captions_parser = sub.add_parser("captions", help="chunk captions vs. the built caption index")
+    captions_parser.add_argument("--chunks", default=None, help="chunk file (default chunks_metadata.json)")
+    captions_parser.add_argument("--embeddings-dir", default=None,
+                                 help="build directory (default Artifacts/embeddings; a shard's directory)")
+
+    for p in (retrieval_parser, synthetic_parser, clean_parser, captions_parser):
+        p.add_argument("--output", help="result file (default Artifacts/benchmark/results/<kind>-<time>.json)")
+        p.add_argument("--baseline", help="earlier result file; exit 1 on a recall / p95 latency regression")
+    args = parser.parse_args()
+
+    # Measure the encoder, not embeddings persisted by an earlier API run
+    os.environ.setdefault("QUERY_CACHE_PERSIST", "0")
+
+    if args.command == "retrieval":
+        report = benchmark_retrieval(load_queries(args.queries), modes=args.modes, k=args.k, rounds=args.rounds)
+    elif args.command == "clean_text":
+        report = benchmark_clean_text(args.pdf, rounds=args.rounds)
+    elif args.command == "captions":
+        report = check_caption_index(args.chunks, args.embeddings_dir)
+    else:
+        report = benchmark_synthetic(args.chunks, [_parse_spec(s) for s in args.index_types], k=args.k,
+                                     rounds=args.rounds, n_queries=args.n_queries, workers=args.workers)
+    write_result(args.command, report, args.output)
+
+    if args.command == "clean_text" and report["mismatched_pages"]:
+        sys.exit(1)
+    if args.command == "captions" and report["problems"]:
+        for problem in report["problems"]:
+            print(f"[benchmark] CAPTIONS: {problem}")
+        sys.exit(1)
+    if args.baseline:
+        regressions = compare_to_baseline(report, args.baseline)
+        for regression in regressions:
+            print(f"[benchmark] REGRESSION: {regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,139 @@
+# Src/rag/caption_index.py
+"""
+Normalized vector index over image captions.
+
+Captions are batch-encoded at build time and stored in a float16
+inner-product index (cosine on normalized vectors). Finding the images
+relevant to a query is one `range_search` with the similarity threshold as
+radius, optionally restricted to the captions of the retrieved chunks.
+
+Layout of the index directory:
+    captions.faiss   IndexScalarQuantizer (fp16, inner product), row = caption id
+    captions.json    caption id -> {image_path, caption_text, chunk_row, page_num, pdf_file}
+    chunk_row.npy    int32 chunk row per caption id (vectorized restriction)
+"""
+import os
+import json
+import shutil
+import faiss
+import numpy as np
+
+INDEX_NAME = "captions.faiss"
+MAP_NAME = "captions.json"
+CHUNK_ROW_NAME = "chunk_row.npy"
+
+NO_CAPTION = "no caption detected"
+
+
+def chunk_caption_records(row, chunk, first_id=0):
+    """
+    Embeddable captions of the chunk at `row`, numbered from `first_id`; the
+    `caption_id` is written back onto each caption (None when it has no text).
+    """
+    records = []
+    for caption in chunk.get("captions") or []:
+        caption.pop("embedding", None)
+        text = caption.get("caption_text")
+        if not text or text.lower() == NO_CAPTION:
+            caption["caption_id"] = None
+            continue
+        caption["caption_id"] = first_id + len(records)
+        records.append({
+            "image_path": caption["image_path"],
+            "caption_text": text,
+            "chunk_row": row,
+            "page_num": chunk.get("page_num"),
+            "pdf_file": chunk.get("pdf_file"),
+        })
+    return records
+
+
+def caption_records(chunks):
+    """
+    Collect embeddable captions from chunk dicts, assigning each a `caption_id`
+    (written back onto the caption). Returns the records in caption-id order.
+    """
+    records = []
+    for row, chunk in enumerate(chunks):
+        records.extend(chunk_caption_records(row, chunk, len(records)))
+    return records
+
+
+def build_caption_index(records, embeddings, index_dir):
+    """Write the caption index for `records` and their (n, dim) `embeddings`."""
+    vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    index = faiss.index_factory(vectors.shape[1], "SQfp16", faiss.METRIC_INNER_PRODUCT)
+    index.train(vectors)
+    index.add(vectors)
+
+    tmp_dir = index_dir.rstrip("/\\") + ".tmp"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    faiss.write_index(index, os.path.join(tmp_dir, INDEX_NAME))
+    np.save(os.path.join(tmp_dir, CHUNK_ROW_NAME),
+            np.asarray([r["chunk_row"] for r in records], dtype=np.int32))
+    with open(os.path.join(tmp_dir, MAP_NAME), "w", encoding="utf-8") as f:
+        json.dump(records, f, ensure_ascii=False)
+
+    if os.path.exists(index_dir):
+        shutil.rmtree(index_dir)
+    os.replace(tmp_dir, index_dir)
+    return index_dir
+
+
+def caption_index_exists(index_dir):
+    return os.path.exists(os.path.join(index_dir, INDEX_NAME))
+
+
+class CaptionIndex:
+    """Read-only caption index; `search` returns the relevant image paths per query."""
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        path = os.path.join(index_dir, INDEX_NAME)
+        try:
+            self.index = faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            self.index = faiss.read_index(path)
+        with open(os.path.join(index_dir, MAP_NAME), "r", encoding="utf-8") as f:
+            self.records = json.load(f)
+        self.image_pages = {r["image_path"]: r["page_num"] for r in self.records}
+        self.chunk_rows = np.load(os.path.join(index_dir, CHUNK_ROW_NAME), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.records)
+
+    def caption_ids_for_rows(self, rows):
+        """Caption ids belonging to the given chunk rows."""
+        return np.flatnonzero(np.isin(self.chunk_rows, np.asarray(list(rows), dtype=np.int32)))
+
+    def search(self, query_vecs, threshold=0.4, caption_ids=None):
+        """
+        Captions with cosine >= threshold for each query, as lists of
+        (image_path, similarity) best first (one entry per image).
+        `caption_ids` restricts the search to those captions.
+        """
+        # normalize_L2 works in place: normalize a copy, not the caller's (possibly cached) vector
+        query_vecs = np.array(np.atleast_2d(query_vecs), dtype=np.float32, copy=True, order="C")
+        faiss.normalize_L2(query_vecs)
+        if caption_ids is not None:
+            caption_ids = np.asarray(caption_ids, dtype=np.int64)
+            if caption_ids.size == 0:
+                return [[] for _ in query_vecs]
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(caption_ids))
+            lims, sims, ids = self.index.range_search(query_vecs, threshold, params=params)
+        else:
+            lims, sims, ids = self.index.range_search(query_vecs, threshold)
+
+        results = []
+        for q in range(len(query_vecs)):
+            start, end = lims[q], lims[q + 1]
+            best = {}
+            for cid, sim in zip(ids[start:end], sims[start:end]):
+                path = self.records[cid]["image_path"]
+                if sim > best.get(path, -1.0):
+                    best[path] = float(sim)
+            results.append(sorted(best.items(), key=lambda x: -x[1]))
+        return results
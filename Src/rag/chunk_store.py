@@ -0,0 +1,275 @@
+# Src/rag/chunk_store.py
+"""
+Columnar, memory-mappable store for chunk metadata.
+
+Replaces unpickling a list of dicts in every worker: the chunk text lives in
+one UTF-8 blob addressed by an offsets array, numeric columns are .npy files,
+and repeated strings (pdf names, image paths, snapshot paths) are interned
+into a small string table. Everything is opened with mmap, so all uvicorn
+workers share the same page-cache pages and a row is only decoded when read.
+
+Layout of a store directory:
+    manifest.json          row count + column list
+    strings.json           interned string table
+    content.bin / content_offsets.npy     chunk text
+    chunk_id.bin / chunk_id_offsets.npy   chunk ids
+    captions.bin / captions_offsets.npy   JSON list of {image_path, caption_text, caption_id} per row
+    page_num.npy           int32 per row
+    pdf_file.npy           int32 string id per row
+    page_snapshot.npy      int32 string id per row (-1 = None)
+    section.npy            int32 string id per row (-1 = None)
+    images_offsets.npy / images_ids.npy   CSR list of string ids per row
+    bitmaps/               packed row bitmaps per attribute value (section, pdf_file)
+                           in FAISS IDSelectorBitmap bit order (little-endian)
+"""
+import os
+import json
+import shutil
+import numpy as np
+
+STORE_VERSION = 3
+MANIFEST_NAME = "manifest.json"
+STRINGS_NAME = "strings.json"
+BITMAPS_DIR = "bitmaps"
+
+# Columns that get a precomputed bitmap per distinct value
+BITMAP_ATTRIBUTES = ("section", "pdf_file")
+
+
+def pack_mask(mask):
+    """bool mask over rows -> packed bitmap usable by faiss.IDSelectorBitmap."""
+    return np.packbits(np.asarray(mask, dtype=bool), bitorder="little")
+
+
+def unpack_bitmap(bitmap, n_rows):
+    return np.unpackbits(bitmap, count=n_rows, bitorder="little").astype(bool)
+
+
+# ---------------- WRITER ----------------
+class ChunkStoreWriter:
+    """
+    Append chunks one at a time and write the columnar store on close().
+    Text blobs are streamed to disk; only integer columns are kept in memory.
+    The store is written to a temp dir and swapped in atomically.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.tmp_dir = store_dir.rstrip("/\\") + ".tmp"
+        if os.path.exists(self.tmp_dir):
+            shutil.rmtree(self.tmp_dir)
+        os.makedirs(self.tmp_dir)
+
+        self._blobs = {
+            name: open(os.path.join(self.tmp_dir, f"{name}.bin"), "wb")
+            for name in ("content", "chunk_id", "captions")
+        }
+        self._blob_offsets = {name: [0] for name in self._blobs}
+        self._strings = []
+        self._string_ids = {}
+        self.page_num = []
+        self.pdf_file = []
+        self.page_snapshot = []
+        self.section = []
+        self.images_offsets = [0]
+        self.images_ids = []
+
+    def _intern(self, value):
+        if value is None:
+            return -1
+        value = str(value)
+        sid = self._string_ids.get(value)
+        if sid is None:
+            sid = len(self._strings)
+            self._strings.append(value)
+            self._string_ids[value] = sid
+        return sid
+
+    def _append_blob(self, name, text):
+        data = (text or "").encode("utf-8")
+        self._blobs[name].write(data)
+        self._blob_offsets[name].append(self._blob_offsets[name][-1] + len(data))
+
+    def add(self, chunk):
+        """Append one chunk dict (same shape as chunks_metadata.json entries). Returns its row id."""
+        row = len(self.page_num)
+        self._append_blob("content", chunk.get("content"))
+        self._append_blob("chunk_id", chunk.get("chunk_id"))
+        captions = chunk.get("captions")
+        self._append_blob("captions", json.dumps(captions, ensure_ascii=False) if captions else "")
+        self.page_num.append(int(chunk.get("page_num") or 0))
+        self.pdf_file.append(self._intern(chunk.get("pdf_file")))
+        self.page_snapshot.append(self._intern(chunk.get("page_snapshot")))
+        self.section.append(self._intern(chunk.get("section")))
+        for path in chunk.get("images") or []:
+            self.images_ids.append(self._intern(path))
+        self.images_offsets.append(len(self.images_ids))
+        return row
+
+    def close(self):
+        for name, f in self._blobs.items():
+            f.close()
+            np.save(os.path.join(self.tmp_dir, f"{name}_offsets.npy"),
+                    np.asarray(self._blob_offsets[name], dtype=np.int64))
+
+        np.save(os.path.join(self.tmp_dir, "page_num.npy"), np.asarray(self.page_num, dtype=np.int32))
+        np.save(os.path.join(self.tmp_dir, "pdf_file.npy"), np.asarray(self.pdf_file, dtype=np.int32))
+        np.save(os.path.join(self.tmp_dir, "page_snapshot.npy"), np.asarray(self.page_snapshot, dtype=np.int32))
+        np.save(os.path.join(self.tmp_dir, "section.npy"), np.asarray(self.section, dtype=np.int32))
+        np.save(os.path.join(self.tmp_dir, "images_offsets.npy"), np.asarray(self.images_offsets, dtype=np.int64))
+        np.save(os.path.join(self.tmp_dir, "images_ids.npy"), np.asarray(self.images_ids, dtype=np.int32))
+        self._write_bitmaps()
+
+        with open(os.path.join(self.tmp_dir, STRINGS_NAME), "w", encoding="utf-8") as f:
+            json.dump(self._strings, f, ensure_ascii=False)
+        with open(os.path.join(self.tmp_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+            json.dump({"version": STORE_VERSION, "n_rows": len(self.page_num)}, f)
+
+        if os.path.exists(self.store_dir):
+            shutil.rmtree(self.store_dir)
+        os.replace(self.tmp_dir, self.store_dir)
+        return self.store_dir
+
+    def _write_bitmaps(self):
+        """One packed bitmap per (attribute, value), named by the value's string id."""
+        os.makedirs(os.path.join(self.tmp_dir, BITMAPS_DIR))
+        index = {}
+        for attribute in BITMAP_ATTRIBUTES:
+            column = np.asarray(getattr(self, attribute), dtype=np.int32)
+            index[attribute] = {}
+            for sid in np.unique(column[column >= 0]):
+                name = f"{attribute}_{int(sid)}.npy"
+                np.save(os.path.join(self.tmp_dir, BITMAPS_DIR, name), pack_mask(column == sid))
+                index[attribute][self._strings[sid]] = name
+        with open(os.path.join(self.tmp_dir, BITMAPS_DIR, "index.json"), "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+
+
+def write_chunk_store(chunks, store_dir):
+    """Write an iterable of chunk dicts to a columnar store at `store_dir`."""
+    writer = ChunkStoreWriter(store_dir)
+    for chunk in chunks:
+        writer.add(chunk)
+    return writer.close()
+
+
+def chunk_store_exists(store_dir):
+    return os.path.exists(os.path.join(store_dir, MANIFEST_NAME))
+
+
+# ---------------- READER ----------------
+def _open_blob(path):
+    # np.memmap refuses zero-length files
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode="r")
+
+
+class ChunkStore:
+    """
+    Read-only, mmap-backed view over a chunk store. Rows are decoded lazily:
+    `store[row]` returns the same dict shape as the old pickled metadata.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(store_dir, STRINGS_NAME), "r", encoding="utf-8") as f:
+            self.strings = json.load(f)
+
+        self.n_rows = self.manifest["n_rows"]
+        self._bitmap_index = None
+        self._content = _open_blob(self._path("content.bin"))
+        self._content_offsets = self._load("content_offsets.npy")
+        self._chunk_id = _open_blob(self._path("chunk_id.bin"))
+        self._chunk_id_offsets = self._load("chunk_id_offsets.npy")
+        # Stores written before version 3 have no captions column
+        self._captions = None
+        if os.path.exists(self._path("captions.bin")):
+            self._captions = _open_blob(self._path("captions.bin"))
+            self._captions_offsets = self._load("captions_offsets.npy")
+        self.page_num = self._load("page_num.npy")
+        self.pdf_file_ids = self._load("pdf_file.npy")
+        self.page_snapshot_ids = self._load("page_snapshot.npy")
+        self.section_ids = self._load("section.npy")
+        self._images_offsets = self._load("images_offsets.npy")
+        self._images_ids = self._load("images_ids.npy")
+
+    def _path(self, name):
+        return os.path.join(self.store_dir, name)
+
+    def _load(self, name):
+        return np.load(self._path(name), mmap_mode="r")
+
+    def _load_bitmap_index(self):
+        if self._bitmap_index is None:
+            with open(self._path(os.path.join(BITMAPS_DIR, "index.json")), "r", encoding="utf-8") as f:
+                self._bitmap_index = json.load(f)
+        return self._bitmap_index
+
+    def bitmap(self, attribute, value):
+        """Packed bitmap of rows where `attribute == value` (all zeros if the value is unknown)."""
+        name = self._load_bitmap_index().get(attribute, {}).get(value)
+        if name is None:
+            return np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+        return np.load(self._path(os.path.join(BITMAPS_DIR, name)), mmap_mode="r")
+
+    def filter_bitmap(self, section=None, pages=None, document=None):
+        """
+        Packed bitmap of rows matching all given filters, or None when no filter is set.
+        pages is an inclusive (first, last) page range.
+        """
+        bitmap = None
+        for attribute, value in (("section", section), ("pdf_file", document)):
+            if value is not None:
+                part = self.bitmap(attribute, value)
+                bitmap = part.copy() if bitmap is None else bitmap & part
+        if pages is not None:
+            first, last = pages
+            part = pack_mask((self.page_num >= first) & (self.page_num <= last))
+            bitmap = part if bitmap is None else bitmap & part
+        return bitmap
+
+    def _string(self, sid):
+        return self.strings[sid] if sid >= 0 else None
+
+    def __len__(self):
+        return self.n_rows
+
+    def content(self, row):
+        start, end = self._content_offsets[row], self._content_offsets[row + 1]
+        return bytes(self._content[start:end]).decode("utf-8")
+
+    def chunk_id(self, row):
+        start, end = self._chunk_id_offsets[row], self._chunk_id_offsets[row + 1]
+        return bytes(self._chunk_id[start:end]).decode("utf-8")
+
+    def captions(self, row):
+        if self._captions is None:
+            return []
+        start, end = self._captions_offsets[row], self._captions_offsets[row + 1]
+        return json.loads(bytes(self._captions[start:end]).decode("utf-8")) if end > start else []
+
+    def images(self, row):
+        start, end = self._images_offsets[row], self._images_offsets[row + 1]
+        return [self.strings[sid] for sid in self._images_ids[start:end]]
+
+    def __getitem__(self, row):
+        row = int(row)
+        if row < 0 or row >= self.n_rows:
+            raise IndexError(f"chunk row {row} out of range (0..{self.n_rows - 1})")
+        return {
+            "chunk_id": self.chunk_id(row),
+            "page_num": int(self.page_num[row]),
+            "content": self.content(row),
+            "pdf_file": self._string(int(self.pdf_file_ids[row])),
+            "images": self.images(row),
+            "captions": self.captions(row),
+            "page_snapshot": self._string(int(self.page_snapshot_ids[row])),
+            "section": self._string(int(self.section_ids[row])),
+        }
+
+    def __iter__(self):
+        for row in range(self.n_rows):
+            yield self[row]
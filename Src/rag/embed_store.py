@@ -1,9 +1,22 @@
 import os
 import json
-import pickle
+import time
+import shutil
+import argparse
 import faiss
-from sentence_transformers import SentenceTransformer
 import numpy as np
+from Src.rag.chunk_store import ChunkStoreWriter
+from Src.rag.index_factory import (INDEX_TYPES, build_index, save_index, evaluate_index, compare_index_types,
+                                   update_index, load_index_config, index_size,
+                                   apply_search_params)
+from Src.rag.lexical_index import BM25Writer
+from Src.rag.encoders import ENCODER_BACKENDS, EMBED_BACKEND, EMBED_MODEL_PATH, load_encoder
+from Src.rag.parallel_embed import embed_texts
+from Src.rag.embedding_cache import model_fingerprint
+from Src.rag.vector_store import HashVectorStore
+from Src.rag.rerank import build_binary_index
+from Src.rag.caption_index import chunk_caption_records, build_caption_index
+from Src.rag.shards import ShardRegistry, SHARDS_DIR
 
 # Get project root dynamically (3 levels up from current file)
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
@@ -16,43 +29,368 @@ PAGE_IMAGES_DIR = os.path.join(DATA_DIR, "page_images")
 PROCESSED_TEXT_PATH = os.path.join(PROCESSED_TEXT_DIR, "chunks_metadata.json")
 FAISS_INDEX_PATH = os.path.join(EMBEDDINGS_DIR, "faiss_index.bin")
 METADATA_PATH = os.path.join(EMBEDDINGS_DIR, "metadata.pkl")
+CHUNK_STORE_DIR = os.path.join(EMBEDDINGS_DIR, "chunk_store")
+BM25_INDEX_DIR = os.path.join(EMBEDDINGS_DIR, "bm25")
+CAPTION_INDEX_DIR = os.path.join(EMBEDDINGS_DIR, "captions")
+INDEX_COMPARE_PATH = os.path.join(EMBEDDINGS_DIR, "index_compare.json")
+CHUNK_VECTORS_PATH = os.path.join(EMBEDDINGS_DIR, "chunk_vectors.npy")
+BINARY_INDEX_PATH = os.path.join(EMBEDDINGS_DIR, "binary_index.bin")
+VECTOR_STORE_DIR = os.path.join(EMBEDDINGS_DIR, "vector_store")
+ROW_HASHES_PATH = os.path.join(EMBEDDINGS_DIR, "row_hashes.json")
+# Chunks and vectors are spooled here during a build, then written out row by row
+BUILD_SPOOL_DIR = "build.tmp"
+SPOOL_BATCH_SIZE = 65536
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+# Incremental builds compact (re-layout rows, no re-embedding) once this share of rows are tombstones
+INDEX_COMPACT_DEAD_RATIO = float(os.getenv("INDEX_COMPACT_DEAD_RATIO", "0.25"))
 
 
-def create_faiss_index():
-    os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
+def iter_chunks(chunks_path, read_size=1 << 20):
+    """
+    Yield chunk dicts one at a time from a JSON array file (chunks_metadata.json)
+    or a JSON-lines file, without parsing the whole file first.
+    """
+    with open(chunks_path, "r", encoding="utf-8") as f:
+        if chunks_path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        decoder = json.JSONDecoder()
+        buffer, pos, eof = "", 0, False
+        while True:
+            # Skip whitespace, the opening "[" and separating commas
+            while True:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,[":
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    break
+                data = f.read(read_size)
+                buffer, pos, eof = buffer[pos:] + data, 0, not data
+            if pos >= len(buffer) or buffer[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                data = f.read(read_size)
+                buffer, pos, eof = buffer[pos:] + data, 0, not data
+                continue
+            yield item
+            pos = end
+
+
+def assign_rows(previous_row_hashes, hashes):
+    """
+    Stable row per chunk for an incremental build: a chunk whose content hash
+    was live before keeps its row, new or changed chunks get appended rows and
+    rows of removed chunks become tombstones (hash None).
+
+    Returns (rows, row_hashes, removed_rows, added) where rows[i] is the row of
+    chunk i and `added` lists the chunk positions that got a new row.
+    """
+    free = {}
+    for row, h in enumerate(previous_row_hashes):
+        if h is not None:
+            free.setdefault(h, []).append(row)
+    row_hashes = list(previous_row_hashes)
+    rows, added = [], []
+    for i, h in enumerate(hashes):
+        if free.get(h):
+            rows.append(free[h].pop(0))
+        else:
+            rows.append(len(row_hashes))
+            row_hashes.append(h)
+            added.append(i)
+    removed = sorted(r for leftover in free.values() for r in leftover)
+    for row in removed:
+        row_hashes[row] = None
+    return rows, row_hashes, removed, added
+
+
+def _previous_build(faiss_index_path, row_hashes_path, index_type, backend, index_params):
+    """(index, config, row_hashes) of a previous ID-mapped build with the same settings, else None."""
+    config = load_index_config(faiss_index_path)
+    if not (config and config.get("id_map") and os.path.exists(row_hashes_path)):
+        return None
+    if config["index_type"] != index_type or config.get("encoder", "torch") != backend:
+        return None
+    if any(config["params"].get(k) != v for k, v in index_params.items()):
+        return None
+    with open(row_hashes_path, "r", encoding="utf-8") as f:
+        row_hashes = json.load(f)
+    index = faiss.read_index(faiss_index_path)
+    # nprobe / efSearch / k_factor are not serialized with the index
+    apply_search_params(index, config)
+    return index, config, row_hashes
+
+
+def create_faiss_index(index_type=FAISS_INDEX_TYPE, eval_k=10, backend=EMBED_BACKEND,
+                       chunks_path=PROCESSED_TEXT_PATH, output_dir=EMBEDDINGS_DIR, full=False, workers=None,
+                       chunks=None, **index_params):
+    """
+    Embed chunks with the `backend` encoder (see encoders.ENCODER_BACKENDS), build a
+    FAISS index of `index_type` (see index_factory.INDEX_TYPES) and save it with its
+    config and a recall@k / latency report against the exact index.
+
+    Builds are incremental: embeddings are kept in a content-hash store, so only
+    new or changed chunks are encoded, and an ID-mapped index from a previous
+    build with the same settings is updated in place (removed chunks deleted,
+    new ones added; rows stay stable, removed rows become empty tombstones).
+    `full=True`, a settings change or too many tombstones re-lay the rows out
+    from scratch, still without re-encoding known chunks.
+
+    Encoding runs on `workers` processes (default EMBED_WORKERS / one per CPU,
+    see parallel_embed) while the chunk file is still being read. `chunks` (an
+    iterable of chunk dicts, e.g. preprocess.py's streaming pipeline) is used
+    instead of reading `chunks_path`, so encoding starts while the PDF is
+    still being extracted.
+
+    Memory stays bounded by the FAISS index itself: chunks are spooled to disk
+    as they arrive and their vectors to a memmap, and the chunk store, BM25
+    postings and chunk_vectors.npy are then written one row at a time. Only
+    per-chunk hashes / row numbers and the caption records are kept as lists.
+
+    All artifacts are written to `output_dir` under the same file names as
+    Artifacts/embeddings (a corpus shard uses its own directory).
+    Returns a small summary (chunk count, documents, index config).
+    """
+    start = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    faiss_index_path = os.path.join(output_dir, os.path.basename(FAISS_INDEX_PATH))
+    metadata_path = os.path.join(output_dir, os.path.basename(METADATA_PATH))
+    chunk_store_dir = os.path.join(output_dir, os.path.basename(CHUNK_STORE_DIR))
+    bm25_index_dir = os.path.join(output_dir, os.path.basename(BM25_INDEX_DIR))
+    caption_index_dir = os.path.join(output_dir, os.path.basename(CAPTION_INDEX_DIR))
+    binary_index_path = os.path.join(output_dir, os.path.basename(BINARY_INDEX_PATH))
+    chunk_vectors_path = os.path.join(output_dir, os.path.basename(CHUNK_VECTORS_PATH))
+    vector_store_dir = os.path.join(output_dir, os.path.basename(VECTOR_STORE_DIR))
+    row_hashes_path = os.path.join(output_dir, os.path.basename(ROW_HASHES_PATH))
+    spool_dir = os.path.join(output_dir, BUILD_SPOOL_DIR)
+    if os.path.exists(spool_dir):
+        shutil.rmtree(spool_dir)
+    os.makedirs(spool_dir)
+    spool_path = os.path.join(spool_dir, "chunks.jsonl")
+
+    store = HashVectorStore(vector_store_dir, model_fingerprint(EMBED_MODEL_PATH, backend))
+
+    # Chunks stream from the file into the encoder pool and, one JSON line each, into the spool;
+    # only unseen content hashes are encoded, and checkpoints in the store let an interrupted build resume
+    offsets = []
+    documents = set()
+
+    def chunk_texts(spool):
+        position = 0
+        for chunk in iter_chunks(chunks_path) if chunks is None else chunks:
+            data = json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n"
+            spool.write(data)
+            offsets.append(position)
+            position += len(data)
+            if chunk.get("pdf_file"):
+                documents.add(chunk["pdf_file"])
+            yield chunk["content"]
+
+    with open(spool_path, "wb") as spool:
+        hashes, embed_stats = embed_texts(store, chunk_texts(spool), backend, EMBED_MODEL_PATH,
+                                          workers=workers, label="chunks")
+    if not hashes:
+        raise ValueError(f"No chunks to index in {chunks_path if chunks is None else 'the chunk stream'}")
 
-    with open(PROCESSED_TEXT_PATH, "r", encoding="utf-8") as f:
-        chunks_data = json.load(f)
+    # Chunk-order float32 copy on disk: index build and evaluation read it in batches
+    text_embeddings = np.lib.format.open_memmap(os.path.join(spool_dir, "vectors.npy"), mode="w+",
+                                                dtype=np.float32, shape=(len(hashes), store.dimension))
+    for batch_start in range(0, len(hashes), SPOOL_BATCH_SIZE):
+        batch = hashes[batch_start:batch_start + SPOOL_BATCH_SIZE]
+        text_embeddings[batch_start:batch_start + len(batch)] = store.get_many(batch)
+    text_embeddings.flush()
 
-    model = SentenceTransformer("/app/models/all-MiniLM-L6-v2")
-    # model = SentenceTransformer("models/all-MiniLM-L6-v2")
+    previous = None if full else _previous_build(faiss_index_path, row_hashes_path,
+                                                 index_type, backend, index_params)
+    mode = "full"
+    if previous is not None:
+        index, index_config, previous_row_hashes = previous
+        rows, row_hashes, removed, added = assign_rows(previous_row_hashes, hashes)
+        dead = sum(h is None for h in row_hashes)
+        if dead > INDEX_COMPACT_DEAD_RATIO * len(row_hashes):
+            print(f"{dead}/{len(row_hashes)} tombstone rows: compacting")
+            previous = None
+        elif update_index(index, removed, text_embeddings[added], [rows[i] for i in added]):
+            mode = "incremental"
+        else:
+            # Index type cannot delete in place (HNSW, refine): rebuild from stored vectors
+            index, index_config = build_index(text_embeddings, index_type=index_type, ids=rows,
+                                              **index_config["params"])
+            mode = "rebuilt"
+    if previous is None:
+        rows, row_hashes, removed, added = list(range(len(hashes))), list(hashes), [], list(range(len(hashes)))
+        index, index_config = build_index(text_embeddings, index_type=index_type, ids=rows, **index_params)
 
-    # Embed text chunks
-    texts = [chunk["content"] for chunk in chunks_data]
-    text_embeddings = model.encode(texts, convert_to_numpy=True, show_progress_bar=True)
+    # Write the chunk store, BM25 postings and float16 chunk vectors one row at a time, reading
+    # each chunk back from the spool; tombstone rows are empty chunks that the index never returns
+    position = np.full(len(row_hashes), -1, dtype=np.int64)
+    position[rows] = np.arange(len(rows))
+    chunk_writer = ChunkStoreWriter(chunk_store_dir)
+    bm25_writer = BM25Writer(bm25_index_dir)
+    chunk_vectors_tmp = os.path.join(spool_dir, os.path.basename(CHUNK_VECTORS_PATH))
+    chunk_vectors = np.lib.format.open_memmap(chunk_vectors_tmp, mode="w+", dtype=np.float16,
+                                              shape=(len(row_hashes), store.dimension))
+    captions = []
+    with open(spool_path, "rb") as spool:
+        for row, chunk_pos in enumerate(position):
+            chunk = {}
+            if chunk_pos >= 0:
+                spool.seek(offsets[chunk_pos])
+                chunk = json.loads(spool.readline())
+                chunk_vectors[row] = text_embeddings[chunk_pos]
+            # Caption ids are written back onto the chunk's captions before it is stored
+            captions.extend(chunk_caption_records(row, chunk, len(captions)))
+            chunk_writer.add(chunk)
+            bm25_writer.add(chunk.get("content", ""))
+    chunk_vectors.flush()
+    del chunk_vectors
 
-    # Embed captions
-    for chunk in chunks_data:
-        for caption in chunk.get("captions", []):
-            if caption["caption_text"] and caption["caption_text"].lower() != "no caption detected":
-                caption_emb = model.encode(caption["caption_text"], convert_to_numpy=True)
-                caption["embedding"] = caption_emb.tolist()
-            else:
-                caption["embedding"] = None
+    # Columnar chunk store read lazily (mmap) by the retriever
+    chunk_writer.close()
+    # BM25 inverted index over the same rows (hybrid / lexical retrieval)
+    bm25_writer.close()
 
-    # Build FAISS index
-    dimension = text_embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(text_embeddings)
-    
-    print(f"FAISS index size: {index.ntotal}")
+    # Embed captions into their own normalized index (caption id -> image path)
+    caption_hashes = []
+    if captions:
+        caption_hashes, _ = embed_texts(store, (c["caption_text"] for c in captions), backend,
+                                        EMBED_MODEL_PATH, workers=workers, label="captions")
+        caption_embeddings = store.get_many(caption_hashes)
+        build_caption_index(captions, caption_embeddings, caption_index_dir)
+        print(f"Caption index saved to {caption_index_dir} ({len(captions)} captions)")
 
-    faiss.write_index(index, FAISS_INDEX_PATH)
-    with open(METADATA_PATH, "wb") as f:
-        pickle.dump(chunks_data, f)
+    index_config.update(index_size(index))
+    index_config["encoder"] = backend
+    index_config["report"] = evaluate_index(index, text_embeddings, k=eval_k, ids=rows)
+    index_config["build"] = {
+        "mode": mode,
+        "chunks": len(hashes),
+        "embedded": embed_stats["embedded"],
+        "embedded_captions": store.added - embed_stats["embedded"],
+        "resumed": store.resumed,
+        "embed_workers": embed_stats["workers"],
+        "chunks_per_second": embed_stats["texts_per_second"],
+        "added": len(added),
+        "removed": len(removed),
+        "tombstones": sum(h is None for h in row_hashes),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+    print(f"FAISS index size: {index.ntotal} ({index_config['factory']}, params={index_config['params']})")
+    print(f"Index bytes: {index_config['index_bytes']} "
+          f"({index_config['compression_vs_float32']}x smaller than float32 flat)")
+    print(f"Index report: {index_config['report']}")
+    print(f"Build: {index_config['build']}")
+
+    # Flat/HNSW codes are stored contiguously, so the retriever can mmap this file
+    save_index(index, index_config, faiss_index_path)
+    if os.path.exists(metadata_path):
+        # Pickled metadata of an older build: superseded by the chunk store, and its rows are stale
+        os.remove(metadata_path)
+
+    # Two-stage retrieval: sign-bit index for over-fetching + float16 vectors for exact re-scoring
+    build_binary_index(text_embeddings, binary_index_path, ids=rows)
+    os.replace(chunk_vectors_tmp, chunk_vectors_path)
+
+    # Only embeddings of live chunks / captions are kept for the next build
+    with open(row_hashes_path, "w", encoding="utf-8") as f:
+        json.dump(row_hashes, f)
+    store.save(keep=set(hashes) | set(caption_hashes))
+    del text_embeddings
+    shutil.rmtree(spool_dir)
+
+    print(f"FAISS index saved to {faiss_index_path}")
+    print(f"Chunk store saved to {chunk_store_dir}")
+    print(f"BM25 index saved to {bm25_index_dir}")
+    print(f"Binary index saved to {binary_index_path}, chunk vectors to {chunk_vectors_path}")
+    print(f"Embedding store saved to {vector_store_dir} ({len(store)} entries)")
+    return {
+        "n_chunks": len(hashes),
+        "documents": sorted(documents),
+        "index_type": index_config["index_type"],
+        "encoder": backend,
+    }
+
+
+# Candidate configurations for --compare (size vs. recall trade-off)
+COMPARE_SPECS = [
+    ("flat", {}),
+    ("sq_fp16", {}),
+    ("sq8", {}),
+    ("sq8", {"refine": "fp16"}),
+    ("pq", {}),
+    ("pq", {"refine": "fp16"}),
+    ("ivf_pq", {"refine": "fp16"}),
+    ("hnsw", {}),
+]
+
+
+def compare_indexes(eval_k=10, backend=EMBED_BACKEND, chunks_path=PROCESSED_TEXT_PATH):
+    """
+    Build every COMPARE_SPECS index over the chunk embeddings (same model path and
+    `backend` encoder as the index build) and print a size / recall table.
+    """
+    texts = [chunk["content"] for chunk in iter_chunks(chunks_path)]
+    model = load_encoder(backend, EMBED_MODEL_PATH)
+    embeddings = model.encode(texts, convert_to_numpy=True, show_progress_bar=True)
+
+    rows = compare_index_types(embeddings, COMPARE_SPECS, k=eval_k)
+    recall_key = next(key for key in rows[0] if key.startswith("recall"))
+    print(f"{'factory':<28}{'bytes':>12}{'x smaller':>11}{recall_key:>12}{'p50 ms':>10}")
+    for row in rows:
+        print(f"{row['factory']:<28}{row['index_bytes']:>12}{row['compression_vs_float32']:>11}"
+              f"{row[recall_key]:>12}{row['latency_ms_p50']:>10}")
+
+    os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
+    with open(INDEX_COMPARE_PATH, "w", encoding="utf-8") as f:
+        json.dump(rows, f, indent=2)
+    print(f"Comparison saved to {INDEX_COMPARE_PATH}")
+    return rows
+
+
+def _parse_param(value):
+    key, _, raw = value.partition("=")
+    try:
+        return key, int(raw)
+    except ValueError:
+        return key, raw
 
-    print(f"FAISS index saved to {FAISS_INDEX_PATH}")
-    print(f"Metadata saved to {METADATA_PATH}")
 
 if __name__ == "__main__":
-    create_faiss_index()
+    # Run from the project root: python -m Src.rag.embed_store --index-type hnsw --param efSearch=128
+    parser = argparse.ArgumentParser(description="Build the FAISS index + chunk store")
+    parser.add_argument("--index-type", default=FAISS_INDEX_TYPE, choices=INDEX_TYPES)
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="index parameter, e.g. nlist=64, nprobe=8, m=16, nbits=8, M=32, efSearch=64, refine=fp16")
+    parser.add_argument("--eval-k", type=int, default=10)
+    parser.add_argument("--backend", default=EMBED_BACKEND, choices=ENCODER_BACKENDS,
+                        help="encoder backend (export ONNX first: python -m Src.rag.encoders export)")
+    parser.add_argument("--compare", action="store_true",
+                        help="only print a size / recall table for the compressed index types")
+    parser.add_argument("--shard", metavar="NAME",
+                        help="build into Artifacts/corpus/shards/NAME and register it (sharded corpus)")
+    parser.add_argument("--chunks", default=PROCESSED_TEXT_PATH, help="chunks JSON (or .jsonl) file to embed")
+    parser.add_argument("--full", action="store_true",
+                        help="re-lay out all rows (drop tombstones) instead of updating the index in place")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="encoder processes (default EMBED_WORKERS or one per CPU, max 8; 1 = in-process)")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_indexes(eval_k=args.eval_k, backend=args.backend, chunks_path=args.chunks)
+    elif args.shard:
+        summary = create_faiss_index(index_type=args.index_type, eval_k=args.eval_k, backend=args.backend,
+                                     chunks_path=args.chunks, output_dir=os.path.join(SHARDS_DIR, args.shard),
+                                     full=args.full, workers=args.workers,
+                                     **dict(_parse_param(p) for p in args.param))
+        ShardRegistry().add(args.shard, summary)
+        print(f"Shard '{args.shard}' registered ({summary['n_chunks']} chunks, {summary['documents']})")
+    else:
+        create_faiss_index(index_type=args.index_type, eval_k=args.eval_k, backend=args.backend,
+                           chunks_path=args.chunks, full=args.full, workers=args.workers,
+                           **dict(_parse_param(p) for p in args.param))
@@ -0,0 +1,175 @@
+# Src/rag/embedding_cache.py
+"""
+Bounded LRU cache of query embeddings, optionally persisted to disk.
+
+Keys are normalized queries (lower-cased, whitespace collapsed). MiniLM's
+tokenizer is uncased and splits on whitespace, so the normalized form encodes
+to exactly the same vector as the original query. The on-disk file is keyed
+by a fingerprint of the embedding model, so a model change never serves stale
+vectors.
+"""
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def normalize_query(query):
+    return " ".join(str(query).lower().split())
+
+
+def model_fingerprint(model_path, extra=""):
+    """Short hash of the model's config files (falls back to the path if not on disk)."""
+    h = hashlib.sha1(os.path.basename(os.path.normpath(model_path)).encode("utf-8"))
+    for name in ("config.json", "modules.json", "sentence_bert_config.json", "1_Pooling/config.json"):
+        path = os.path.join(model_path, name)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                h.update(f.read())
+    h.update(extra.encode("utf-8"))
+    return h.hexdigest()[:12]
+
+
+class EmbeddingCache:
+    """
+    Thread-safe LRU of normalized query -> float32 embedding, evicting by
+    entry count and total bytes. Call `save()` to persist and the constructor
+    reloads it (when `persist_path` is set).
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024, persist_path=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.persist_path = persist_path
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if persist_path and os.path.exists(persist_path):
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _put_locked(self, key, vector):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old.nbytes
+        self._entries[key] = vector
+        self._bytes += vector.nbytes
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+            self.evictions += 1
+        self._dirty = True
+
+    def put(self, query, vector):
+        vector = np.array(vector, dtype=np.float32)
+        vector.setflags(write=False)
+        with self._lock:
+            self._put_locked(normalize_query(query), vector)
+
+    def get(self, query):
+        key = normalize_query(query)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def encode(self, queries, encode_fn):
+        """
+        Return embeddings for `queries`, calling `encode_fn(list_of_texts)` only
+        for queries that are not cached (deduplicated, in one call).
+        """
+        keys = [normalize_query(q) for q in queries]
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                if key in found or key in missing:
+                    continue
+                vector = self._entries.get(key)
+                if vector is None:
+                    missing.append(key)
+                else:
+                    self._entries.move_to_end(key)
+                    found[key] = vector
+            missing_set = set(missing)
+            n_missed = sum(1 for key in keys if key in missing_set)
+            self.misses += n_missed
+            self.hits += len(keys) - n_missed
+
+        if missing:
+            vectors = np.asarray(encode_fn(missing), dtype=np.float32)
+            with self._lock:
+                for key, vector in zip(missing, vectors):
+                    vector = vector.copy()
+                    vector.setflags(write=False)
+                    self._put_locked(key, vector)
+                    found[key] = vector
+
+        return np.vstack([found[key] for key in keys])
+
+    def clear(self):
+        """Drop every entry (e.g. to measure uncached latency); counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._dirty = True
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+            "evictions": self.evictions,
+            "persist_path": self.persist_path,
+        }
+
+    # ---- persistence ----
+    def save(self):
+        """Atomically write the cache (LRU order preserved) if it changed since the last save."""
+        if not self.persist_path or not self._dirty:
+            return False
+        with self._lock:
+            keys = list(self._entries.keys())
+            vectors = np.vstack(list(self._entries.values())) if keys else np.zeros((0, 0), np.float32)
+            self._dirty = False
+
+        os.makedirs(os.path.dirname(self.persist_path), exist_ok=True)
+        tmp_path = self.persist_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, keys=np.array(json.dumps(keys)), vectors=vectors)
+        os.replace(tmp_path, self.persist_path)
+        return True
+
+    def load(self):
+        try:
+            with np.load(self.persist_path) as data:
+                keys = json.loads(str(data["keys"]))
+                vectors = data["vectors"].astype(np.float32)
+        except Exception as e:
+            print(f"[embedding_cache] ignoring unreadable cache {self.persist_path}: {e}")
+            return 0
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                vector.setflags(write=False)
+                self._put_locked(key, vector)
+            self._dirty = False
+        return len(keys)
@@ -0,0 +1,252 @@
+# Src/rag/embedding_service.py
+"""
+Local embedding service shared by all API workers over a Unix socket.
+
+One process holds the encoder; uvicorn workers (and retriever.py) send texts
+to it instead of each loading their own model. Concurrent requests are
+coalesced: the batcher takes the first queued request, waits up to
+max_wait_ms for more, and encodes up to max_batch texts in a single call.
+
+Wire format (both directions): 4-byte big-endian length + JSON header,
+then for encode responses n * dim float32 bytes.
+    request   {"op": "encode", "texts": [...]}  |  {"op": "stats"}
+    response  {"shape": [n, dim]} + payload     |  {"stats": {...}}  |  {"error": "..."}
+
+Run it next to the API:
+    python -m Src.rag.embedding_service
+and start the API with EMBED_SERVICE_SOCKET pointing at the same path.
+"""
+import os
+import json
+import time
+import socket
+import struct
+import asyncio
+import argparse
+import threading
+import numpy as np
+from Src.rag.encoders import EMBED_BACKEND, EMBED_MODEL_PATH, load_encoder
+
+EMBED_SERVICE_SOCKET = os.getenv("EMBED_SERVICE_SOCKET", "")  # empty = encode in-process
+EMBED_SERVICE_DEFAULT_SOCKET = "/tmp/medical_bot_embed.sock"
+EMBED_SERVICE_MAX_BATCH = int(os.getenv("EMBED_SERVICE_MAX_BATCH", "64"))
+EMBED_SERVICE_MAX_WAIT_MS = float(os.getenv("EMBED_SERVICE_MAX_WAIT_MS", "5"))
+EMBED_SERVICE_TIMEOUT = float(os.getenv("EMBED_SERVICE_TIMEOUT", "30"))
+
+HEADER = struct.Struct(">I")
+
+
+def _pack(header, payload=b""):
+    data = json.dumps(header).encode("utf-8")
+    return HEADER.pack(len(data)) + data + payload
+
+
+# ---------------- SERVER ----------------
+class EmbeddingService:
+    """asyncio Unix-socket server with a single micro-batching encode loop."""
+
+    def __init__(self, socket_path, encoder, max_batch=EMBED_SERVICE_MAX_BATCH,
+                 max_wait_ms=EMBED_SERVICE_MAX_WAIT_MS):
+        self.socket_path = socket_path
+        self.encoder = encoder
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = None
+        self.started_at = time.time()
+        self.requests = 0
+        self.texts = 0
+        self.batches = 0
+        self.encode_seconds = 0.0
+        self.max_queue_depth = 0
+        self.batch_sizes = []  # last 1000 batch sizes (texts)
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self.queue.get()]
+            n_texts = len(pending[0][0])
+            deadline = loop.time() + self.max_wait
+            while n_texts < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                n_texts += len(item[0])
+
+            texts = [text for item_texts, _ in pending for text in item_texts]
+            start = time.perf_counter()
+            try:
+                # Encode off the event loop so new requests keep queueing meanwhile
+                vectors = await loop.run_in_executor(None, self._encode, texts)
+            except Exception as e:
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.encode_seconds += time.perf_counter() - start
+            self.batches += 1
+            self.batch_sizes = (self.batch_sizes + [len(texts)])[-1000:]
+
+            offset = 0
+            for item_texts, future in pending:
+                if not future.done():
+                    future.set_result(vectors[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+
+    def _encode(self, texts):
+        return np.asarray(self.encoder.encode(texts, convert_to_numpy=True,
+                                              batch_size=max(1, len(texts))), dtype=np.float32)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+                    request = json.loads(await reader.readexactly(length))
+                except asyncio.IncompleteReadError:
+                    break
+
+                if request.get("op") == "stats":
+                    writer.write(_pack({"stats": self.stats()}))
+                else:
+                    texts = [str(t) for t in request.get("texts", [])]
+                    self.requests += 1
+                    self.texts += len(texts)
+                    try:
+                        if texts:
+                            future = asyncio.get_running_loop().create_future()
+                            await self.queue.put((texts, future))
+                            self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+                            vectors = await future
+                        else:
+                            vectors = np.zeros((0, 0), dtype=np.float32)
+                        writer.write(_pack({"shape": list(vectors.shape)}, vectors.tobytes()))
+                    except Exception as e:
+                        writer.write(_pack({"error": str(e)}))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def stats(self):
+        sizes = self.batch_sizes
+        return {
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "requests": self.requests,
+            "texts": self.texts,
+            "batches": self.batches,
+            "avg_batch_size": round(float(np.mean(sizes)), 2) if sizes else None,
+            "max_batch_size_seen": max(sizes) if sizes else None,
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "max_queue_depth": self.max_queue_depth,
+            "encode_seconds": round(self.encode_seconds, 3),
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+    async def serve(self):
+        self.queue = asyncio.Queue()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        batcher = asyncio.create_task(self._batcher())
+        print(f"[embedding_service] listening on {self.socket_path} "
+              f"(max_batch={self.max_batch}, max_wait_ms={self.max_wait * 1000})")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+
+# ---------------- CLIENT ----------------
+class EmbeddingServiceClient:
+    """
+    SentenceTransformer-compatible `encode()` backed by the embedding service.
+    Keeps one connection per thread (FastAPI runs sync endpoints in a threadpool).
+    """
+
+    def __init__(self, socket_path, timeout=EMBED_SERVICE_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.settimeout(self.timeout)
+            conn.connect(self.socket_path)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _recv_exactly(conn, n):
+        chunks = []
+        while n:
+            chunk = conn.recv(min(n, 1 << 20))
+            if not chunk:
+                raise ConnectionError("embedding service closed the connection")
+            chunks.append(chunk)
+            n -= len(chunk)
+        return b"".join(chunks)
+
+    def _call(self, request):
+        for attempt in (1, 2):
+            try:
+                conn = self._connection()
+                conn.sendall(_pack(request))
+                (length,) = HEADER.unpack(self._recv_exactly(conn, HEADER.size))
+                header = json.loads(self._recv_exactly(conn, length))
+                payload = b""
+                if "shape" in header:
+                    n, dim = header["shape"]
+                    payload = self._recv_exactly(conn, n * dim * 4)
+                return header, payload
+            except (OSError, ConnectionError):
+                # Stale connection (service restarted): reconnect once
+                self.close()
+                if attempt == 2:
+                    raise
+
+    def encode(self, sentences, convert_to_numpy=True, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        header, payload = self._call({"op": "encode", "texts": texts})
+        if "error" in header:
+            raise RuntimeError(f"embedding service error: {header['error']}")
+        vectors = np.frombuffer(payload, dtype=np.float32).reshape(header["shape"])
+        return vectors[0] if single else vectors
+
+    def stats(self):
+        header, _ = self._call({"op": "stats"})
+        return header.get("stats")
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def service_available(socket_path):
+    return bool(socket_path) and os.path.exists(socket_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-batching embedding service over a Unix socket")
+    parser.add_argument("--socket", default=EMBED_SERVICE_SOCKET or EMBED_SERVICE_DEFAULT_SOCKET)
+    parser.add_argument("--backend", default=EMBED_BACKEND)
+    parser.add_argument("--model-path", default=EMBED_MODEL_PATH)
+    parser.add_argument("--max-batch", type=int, default=EMBED_SERVICE_MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=EMBED_SERVICE_MAX_WAIT_MS)
+    args = parser.parse_args()
+
+    service = EmbeddingService(args.socket, load_encoder(args.backend, args.model_path),
+                               max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
+    asyncio.run(service.serve())
@@ -0,0 +1,253 @@
+# Src/rag/encoders.py
+"""
+Sentence encoder backends for all-MiniLM-L6-v2.
+
+    torch      SentenceTransformer on PyTorch (reference)
+    onnx       the same transformer exported to ONNX, run with onnxruntime
+    onnx_int8  ONNX graph with dynamic int8 quantization of the weights
+
+The ONNX backends reproduce the SentenceTransformer pipeline (mean pooling over
+the attention mask + L2 normalization), so their vectors live in the same space
+as the existing FAISS index. `onnx` matches torch to ~1e-6; `onnx_int8` is
+close (cosine ~0.99) and can be used against a torch-built index, but building
+the index with the same backend gives the best retrieval agreement. Run the
+benchmark below before switching.
+
+Export once (writes <model>/onnx/model.onnx and model_int8.onnx):
+    python -m Src.rag.encoders export
+Compare latency, throughput and retrieval agreement against torch:
+    python -m Src.rag.encoders benchmark --backends torch onnx onnx_int8
+"""
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+DATA_DIR = os.path.join(BASE_DIR, "Artifacts")
+EMBEDDINGS_DIR = os.path.join(DATA_DIR, "embeddings")
+ENCODER_BENCHMARK_PATH = os.path.join(EMBEDDINGS_DIR, "encoder_benchmark.json")
+EMBED_MODEL_PATH = os.getenv("EMBED_MODEL_PATH", "/app/models/all-MiniLM-L6-v2")
+
+ENCODER_BACKENDS = ("torch", "onnx", "onnx_int8")
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR")  # default: <model_path>/onnx
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))  # 0 = onnxruntime default
+
+ONNX_FILES = {"onnx": "model.onnx", "onnx_int8": "model_int8.onnx"}
+
+
+def onnx_dir_for(model_path):
+    return ONNX_MODEL_DIR or os.path.join(model_path, "onnx")
+
+
+def _max_seq_length(model_path, default=256):
+    path = os.path.join(model_path, "sentence_bert_config.json")
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("max_seq_length", default)
+    return default
+
+
+# ---------------- EXPORT ----------------
+def export_onnx(model_path=EMBED_MODEL_PATH, output_dir=None, quantize=True, opset=14):
+    """
+    Export the transformer of `model_path` to ONNX (dynamic batch / sequence axes)
+    and, with `quantize`, write a dynamically int8-quantized copy next to it.
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    output_dir = output_dir or onnx_dir_for(model_path)
+    os.makedirs(output_dir, exist_ok=True)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = AutoModel.from_pretrained(model_path).eval()
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    fp32_path = os.path.join(output_dir, ONNX_FILES["onnx"])
+    with torch.no_grad():
+        torch.onnx.export(
+            model, tuple(sample[name] for name in input_names), fp32_path,
+            input_names=input_names, output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes, opset_version=opset, do_constant_folding=True,
+        )
+    tokenizer.save_pretrained(output_dir)
+    print(f"[encoders] ONNX model saved to {fp32_path}")
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        int8_path = os.path.join(output_dir, ONNX_FILES["onnx_int8"])
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        print(f"[encoders] int8 model saved to {int8_path} "
+              f"({os.path.getsize(int8_path) / 1e6:.1f} MB vs {os.path.getsize(fp32_path) / 1e6:.1f} MB)")
+    return output_dir
+
+
+# ---------------- BACKENDS ----------------
+class OnnxEncoder:
+    """
+    onnxruntime encoder with a SentenceTransformer-compatible `encode()`
+    (mean pooling + L2 normalization, float32 numpy output).
+    """
+
+    def __init__(self, model_path=EMBED_MODEL_PATH, backend="onnx_int8"):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.backend = backend
+        self.model_path = model_path
+        self.onnx_path = os.path.join(onnx_dir_for(model_path), ONNX_FILES[backend])
+        if not os.path.exists(self.onnx_path):
+            raise FileNotFoundError(
+                f"{self.onnx_path} not found; export it with `python -m Src.rag.encoders export`"
+            )
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if ONNX_THREADS:
+            options.intra_op_num_threads = ONNX_THREADS
+        self.session = ort.InferenceSession(self.onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self.max_seq_length = _max_seq_length(model_path)
+
+    def _encode_batch(self, texts):
+        tokens = self.tokenizer(texts, padding=True, truncation=True,
+                                max_length=self.max_seq_length, return_tensors="np")
+        feeds = {name: tokens[name].astype(np.int64) for name in self.input_names}
+        hidden = self.session.run(["last_hidden_state"], feeds)[0]
+        mask = tokens["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, show_progress_bar=False, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        # Sort by length so each batch pads to similar lengths (same trick as SentenceTransformer)
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        out = np.empty((len(texts), 0), dtype=np.float32)
+        batches = range(0, len(texts), batch_size)
+        if show_progress_bar:
+            from tqdm import tqdm
+            batches = tqdm(batches, desc="Batches")
+        for start in batches:
+            rows = order[start:start + batch_size]
+            vectors = self._encode_batch([texts[i] for i in rows]).astype(np.float32)
+            if out.shape[1] == 0:
+                out = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            out[rows] = vectors
+        return out[0] if single else out
+
+    def get_sentence_embedding_dimension(self):
+        return int(self.session.get_outputs()[0].shape[-1])
+
+
+def load_encoder(backend=EMBED_BACKEND, model_path=EMBED_MODEL_PATH):
+    """Encoder for `backend`; every backend exposes SentenceTransformer-style `encode()`."""
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Invalid encoder backend '{backend}'. Use one of {ENCODER_BACKENDS}.")
+    if backend == "torch":
+        # Imported here: torch + sentence_transformers dominate import time
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_path)
+    return OnnxEncoder(model_path, backend=backend)
+
+
+# ---------------- BENCHMARK ----------------
+def _percentiles(latencies_ms):
+    return {
+        "latency_ms_p50": round(float(np.percentile(latencies_ms, 50)), 3),
+        "latency_ms_p95": round(float(np.percentile(latencies_ms, 95)), 3),
+    }
+
+
+def benchmark_encoders(backends, queries, corpus_texts, index=None, k=10,
+                       model_path=EMBED_MODEL_PATH, batch_size=64):
+    """
+    Per backend: single-query latency, batch throughput on `corpus_texts`, cosine
+    agreement with torch and (given a FAISS `index`) top-k overlap with torch results.
+    """
+    reference = None
+    report = {}
+    for backend in backends:
+        start = time.perf_counter()
+        encoder = load_encoder(backend, model_path)
+        load_seconds = time.perf_counter() - start
+        encoder.encode(queries[:4], convert_to_numpy=True)  # warm-up
+
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            encoder.encode([query], convert_to_numpy=True)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        encoder.encode(corpus_texts, batch_size=batch_size, convert_to_numpy=True)
+        batch_seconds = time.perf_counter() - start
+
+        vectors = np.asarray(encoder.encode(queries, convert_to_numpy=True), dtype=np.float32)
+        row = {
+            "load_seconds": round(load_seconds, 2),
+            **_percentiles(latencies),
+            "throughput_texts_per_s": round(len(corpus_texts) / batch_seconds, 1),
+        }
+        if reference is None:
+            reference = {"backend": backend, "vectors": vectors}
+            if index is not None:
+                reference["ids"] = index.search(vectors, k)[1]
+        else:
+            cosines = np.sum(vectors * reference["vectors"], axis=1) / (
+                np.linalg.norm(vectors, axis=1) * np.linalg.norm(reference["vectors"], axis=1))
+            row[f"cosine_vs_{reference['backend']}_mean"] = round(float(cosines.mean()), 5)
+            row[f"cosine_vs_{reference['backend']}_min"] = round(float(cosines.min()), 5)
+            if index is not None:
+                ids = index.search(vectors, k)[1]
+                overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(ids, reference["ids"])])
+                row[f"top{k}_overlap_vs_{reference['backend']}"] = round(float(overlap), 4)
+        report[backend] = row
+        print(f"[encoders] {backend}: {row}")
+    return report
+
+
+def _benchmark_from_artifacts(backends, n_queries, k):
+    # Queries: the opening sentence of a sample of chunks; corpus: the chunks themselves
+    from Src.rag.retriever import retriever
+    metadata = retriever.metadata
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(metadata), size=min(n_queries, len(metadata)), replace=False)
+    corpus_texts = [metadata[int(r)]["content"] for r in rows]
+    queries = [text.split(". ")[0][:200] for text in corpus_texts]
+
+    report = benchmark_encoders(backends, queries, corpus_texts, index=retriever.index, k=k,
+                                model_path=retriever.model_path)
+    os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
+    with open(ENCODER_BENCHMARK_PATH, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark saved to {ENCODER_BENCHMARK_PATH}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export / benchmark encoder backends")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_parser = sub.add_parser("export", help="export the model to ONNX (+ int8)")
+    export_parser.add_argument("--model-path", default=EMBED_MODEL_PATH)
+    export_parser.add_argument("--no-quantize", action="store_true")
+    bench_parser = sub.add_parser("benchmark", help="latency / throughput / agreement vs. torch")
+    bench_parser.add_argument("--backends", nargs="+", default=list(ENCODER_BACKENDS), choices=ENCODER_BACKENDS)
+    bench_parser.add_argument("--n-queries", type=int, default=200)
+    bench_parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(args.model_path, quantize=not args.no_quantize)
+    else:
+        _benchmark_from_artifacts(args.backends, args.n_queries, args.k)
@@ -0,0 +1,346 @@
+# Src/rag/index_factory.py
+"""
+Configurable FAISS index construction for the chunk embeddings.
+
+Supported index types:
+    flat      exact brute-force L2 scan (IndexFlatL2)
+    ivf_flat  inverted file over k-means cells, full vectors     (nlist, nprobe)
+    ivf_pq    inverted file + product-quantized codes            (nlist, nprobe, m, nbits, refine)
+    hnsw      HNSW graph over full vectors                       (M, efConstruction, efSearch)
+    sq8       8-bit scalar quantization, 4x smaller than float32 (refine)
+    sq_fp16   float16 storage, 2x smaller, ~lossless
+    pq        product quantization, m bytes per vector           (m, nbits, refine)
+
+Compressed types accept refine="fp16" or "flat": the top k * k_factor
+candidates are re-scored exactly against float16 / float32 copies of the
+vectors before the final top-k is returned.
+
+The chosen type and its build/search parameters are written to a JSON file
+next to the index, so the retriever re-applies nprobe/efSearch on load.
+"""
+import os
+import json
+import math
+import time
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw", "sq8", "sq_fp16", "pq")
+
+DEFAULT_PARAMS = {
+    "flat": {},
+    "ivf_flat": {"nlist": None, "nprobe": 8},
+    "ivf_pq": {"nlist": None, "nprobe": 8, "m": 16, "nbits": 8, "refine": None, "k_factor": 4},
+    "hnsw": {"M": 32, "efConstruction": 80, "efSearch": 64},
+    "sq8": {"refine": None, "k_factor": 4},
+    "sq_fp16": {},
+    "pq": {"m": 16, "nbits": 8, "refine": None, "k_factor": 4},
+}
+
+REFINE_SPECS = {"flat": "RFlat", "fp16": "Refine(SQfp16)"}
+
+# Parameters that only affect search and can be changed without a rebuild
+SEARCH_PARAMS = ("nprobe", "efSearch", "k_factor")
+
+# Vectors are added / scanned this many rows at a time, so a memmap input is never fully loaded
+BUILD_BATCH_SIZE = int(os.getenv("INDEX_BUILD_BATCH_SIZE", "65536"))
+# Larger corpora are trained on a seeded sample (k-means subsamples to 256 points per cell anyway)
+MAX_TRAIN_VECTORS = int(os.getenv("INDEX_MAX_TRAIN_VECTORS", "262144"))
+
+
+def config_path_for(index_path):
+    """faiss_index.bin -> faiss_index.json"""
+    return os.path.splitext(index_path)[0] + ".json"
+
+
+def _auto_nlist(n):
+    # ~4*sqrt(n) cells, but keep >= 39 training points per centroid
+    return max(1, min(int(4 * math.sqrt(n)), n // 39 or 1))
+
+
+def resolve_params(index_type, n, dimension, **overrides):
+    """Fill defaults and derive data-dependent values (nlist, PQ sub-quantizers)."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Invalid index type '{index_type}'. Use one of {INDEX_TYPES}.")
+
+    params = dict(DEFAULT_PARAMS[index_type])
+    unknown = set(overrides) - set(params)
+    if unknown:
+        raise ValueError(f"Unknown parameters for {index_type}: {sorted(unknown)}")
+    params.update({k: v for k, v in overrides.items() if v is not None})
+
+    if "nlist" in params and not params["nlist"]:
+        params["nlist"] = _auto_nlist(n)
+
+    if params.get("refine") not in (None, *REFINE_SPECS):
+        raise ValueError(f"Invalid refine '{params['refine']}'. Use one of {tuple(REFINE_SPECS)} or None.")
+
+    if index_type in ("ivf_pq", "pq"):
+        if dimension % params["m"]:
+            raise ValueError(f"PQ m={params['m']} must divide the embedding dimension {dimension}")
+        # PQ training needs at least 2**nbits points per sub-quantizer
+        max_nbits = max(1, int(math.log2(max(n, 2))))
+        if params["nbits"] > max_nbits:
+            print(f"[index_factory] only {n} vectors: lowering PQ nbits {params['nbits']} -> {max_nbits}")
+            params["nbits"] = max_nbits
+    return params
+
+
+def factory_string(index_type, params):
+    if index_type == "flat":
+        spec = "Flat"
+    elif index_type == "ivf_flat":
+        spec = f"IVF{params['nlist']},Flat"
+    elif index_type == "ivf_pq":
+        spec = f"IVF{params['nlist']},PQ{params['m']}x{params['nbits']}"
+    elif index_type == "hnsw":
+        spec = f"HNSW{params['M']}"
+    elif index_type == "sq8":
+        spec = "SQ8"
+    elif index_type == "sq_fp16":
+        spec = "SQfp16"
+    elif index_type == "pq":
+        spec = f"PQ{params['m']}x{params['nbits']}"
+    else:
+        raise ValueError(f"Invalid index type '{index_type}'. Use one of {INDEX_TYPES}.")
+
+    if params.get("refine"):
+        spec += "," + REFINE_SPECS[params["refine"]]
+    return spec
+
+
+def apply_search_params(index, config, **overrides):
+    """
+    Apply persisted nprobe/efSearch to a loaded index. Overrides only replace
+    parameters the index type actually has (nprobe is ignored for HNSW, etc.).
+    """
+    params = dict((config or {}).get("params", {}))
+    params.update({k: v for k, v in overrides.items() if v is not None and k in params})
+    space = faiss.ParameterSpace()
+    for name in ("nprobe", "efSearch"):
+        if params.get(name) is not None:
+            space.set_index_parameter(index, name, params[name])
+    base = _unwrap_id_map(index)
+    if params.get("refine") and isinstance(base, faiss.IndexRefine):
+        base.k_factor = float(params["k_factor"])
+    return index
+
+
+def _unwrap_id_map(index):
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def search_parameters(index, selector):
+    """
+    SearchParameters carrying an ID selector (filtered search inside the index)
+    plus the index's current nprobe/efSearch, which per-call params would otherwise reset.
+    Returns None for indexes that cannot filter during search (flat PQ); the
+    caller then has to filter the results itself.
+    """
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        # IndexIDMap translates the selector and forwards the params to the wrapped index
+        return search_parameters(faiss.downcast_index(index.index), selector)
+    if isinstance(index, faiss.IndexRefine):
+        base_params = search_parameters(faiss.downcast_index(index.base_index), selector)
+        if base_params is None:
+            return None
+        return faiss.IndexRefineSearchParameters(k_factor=index.k_factor, base_index_params=base_params)
+    if hasattr(index, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    if isinstance(index, faiss.IndexPQ):
+        return None
+    try:
+        ivf = faiss.extract_index_ivf(index)
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    except RuntimeError:
+        return faiss.SearchParameters(sel=selector)
+
+
+def _training_sample(embeddings, max_vectors=MAX_TRAIN_VECTORS, seed=0):
+    n = embeddings.shape[0]
+    if n <= max_vectors:
+        return np.ascontiguousarray(embeddings[:], dtype=np.float32)
+    rows = np.sort(np.random.default_rng(seed).choice(n, size=max_vectors, replace=False))
+    return np.ascontiguousarray(embeddings[rows], dtype=np.float32)
+
+
+def build_index(embeddings, index_type="flat", ids=None, **params):
+    """
+    Train (if needed) and fill an index of the requested type.
+    With `ids`, vector i gets label ids[i] (stable chunk rows, so chunks can later
+    be removed / added in place). IVF indexes store the labels in their inverted
+    lists; every other type is wrapped in an IndexIDMap2.
+
+    `embeddings` may be a memmap: training uses at most MAX_TRAIN_VECTORS rows
+    and vectors are added BUILD_BATCH_SIZE rows at a time.
+
+    Returns:
+        (faiss.Index, dict): the index and its config (type, factory string, params).
+    """
+    n, dimension = embeddings.shape
+    params = resolve_params(index_type, n, dimension, **params)
+    spec = factory_string(index_type, params)
+
+    index = faiss.index_factory(dimension, spec, faiss.METRIC_L2)
+    if index_type == "hnsw":
+        index.hnsw.efConstruction = params["efConstruction"]
+    if ids is not None and not isinstance(index, faiss.IndexIVF):
+        # IndexIDMap's remove_ids assumes the inner index compacts ids like a flat
+        # index does, which IVF does not: IVF keeps the labels itself
+        index = faiss.IndexIDMap2(index)
+
+    start = time.perf_counter()
+    if not index.is_trained:
+        index.train(_training_sample(embeddings))
+    train_seconds = time.perf_counter() - start
+    if ids is not None:
+        ids = np.asarray(ids, dtype=np.int64)
+    for batch_start in range(0, n, BUILD_BATCH_SIZE):
+        batch = np.ascontiguousarray(embeddings[batch_start:batch_start + BUILD_BATCH_SIZE], dtype=np.float32)
+        if ids is not None:
+            index.add_with_ids(batch, ids[batch_start:batch_start + BUILD_BATCH_SIZE])
+        else:
+            index.add(batch)
+    build_seconds = time.perf_counter() - start
+
+    config = {
+        "index_type": index_type,
+        "factory": spec,
+        "metric": "l2",
+        "dimension": dimension,
+        "ntotal": int(index.ntotal),
+        "params": params,
+        "id_map": ids is not None,
+        "train_seconds": round(train_seconds, 3),
+        "build_seconds": round(build_seconds, 3),
+    }
+    apply_search_params(index, config)
+    config.update(index_size(index))
+    return index, config
+
+
+def update_index(index, remove_ids, vectors, ids):
+    """
+    Delete `remove_ids` from an ID-labelled index (IDMap or IVF) and add `vectors` under `ids`, in place.
+    Returns False when the index type cannot remove vectors (HNSW, refine); rebuild then.
+    """
+    if not isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2, faiss.IndexIVF)):
+        return False
+    remove_ids = np.asarray(remove_ids, dtype=np.int64)
+    if remove_ids.size:
+        try:
+            index.remove_ids(remove_ids)
+        except RuntimeError:
+            return False
+    if len(ids):
+        index.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), np.asarray(ids, dtype=np.int64))
+    return True
+
+
+def index_size(index):
+    """Serialized size of the index vs. raw float32 vectors."""
+    n_bytes = int(faiss.serialize_index(index).size)
+    raw_bytes = int(index.ntotal) * index.d * 4
+    return {
+        "index_bytes": n_bytes,
+        "bytes_per_vector": round(n_bytes / max(index.ntotal, 1), 1),
+        "compression_vs_float32": round(raw_bytes / n_bytes, 2) if n_bytes else None,
+    }
+
+
+def compare_index_types(embeddings, specs, k=10):
+    """
+    Build each (index_type, params) in `specs` and return one report row per spec:
+    size, compression, build time, recall@k and latency. Nothing is saved.
+    """
+    rows = []
+    for index_type, params in specs:
+        index, config = build_index(embeddings, index_type=index_type, **params)
+        report = evaluate_index(index, embeddings, k=k)
+        rows.append({
+            "index_type": index_type,
+            "factory": config["factory"],
+            "index_bytes": config["index_bytes"],
+            "compression_vs_float32": config["compression_vs_float32"],
+            "build_seconds": config["build_seconds"],
+            **{key: report[key] for key in report if key.startswith("recall") or key.startswith("latency")},
+        })
+    return rows
+
+
+def save_index(index, config, index_path):
+    faiss.write_index(index, index_path)
+    with open(config_path_for(index_path), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+
+
+def load_index_config(index_path):
+    """Return the persisted config, or None for indexes built before configs existed."""
+    path = config_path_for(index_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# ---------------- EVALUATION ----------------
+def _timed_search(index, queries, k):
+    latencies = []
+    results = []
+    for q in queries:
+        start = time.perf_counter()
+        _, ids = index.search(q.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(ids[0])
+    return np.vstack(results), np.asarray(latencies)
+
+
+def _exact_search(embeddings, queries, k):
+    """Exact L2 top-k ids of `queries`, scanning `embeddings` BUILD_BATCH_SIZE rows at a time."""
+    heap = faiss.ResultHeap(len(queries), k)
+    for start in range(0, embeddings.shape[0], BUILD_BATCH_SIZE):
+        block = np.ascontiguousarray(embeddings[start:start + BUILD_BATCH_SIZE], dtype=np.float32)
+        distances, ids = faiss.knn(queries, block, min(k, len(block)))
+        heap.add_result(distances, ids + start)
+    heap.finalize()
+    return heap.I
+
+
+def evaluate_index(index, embeddings, k=10, n_queries=200, seed=0, ids=None):
+    """
+    Compare `index` against an exact L2 scan over the same embeddings.
+    Queries are a seeded sample of the corpus vectors. `ids` are the labels the
+    index uses for the embeddings (ID-mapped indexes); default 0..n-1.
+    `embeddings` may be a memmap: the exact scan reads it in blocks instead of
+    copying it into an IndexFlatL2.
+
+    Returns recall@k plus per-query latency (ms) for the index, and the mean
+    per-query time of the (batched) exact scan.
+    """
+    n = embeddings.shape[0]
+    k = min(k, n)
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(n, size=min(n_queries, n), replace=False))
+    queries = np.ascontiguousarray(embeddings[sample], dtype=np.float32)
+
+    start = time.perf_counter()
+    exact_ids = _exact_search(embeddings, queries, k)
+    exact_ms = (time.perf_counter() - start) * 1000 / max(len(queries), 1)
+    if ids is not None:
+        exact_ids = np.asarray(ids, dtype=np.int64)[exact_ids]
+    approx_ids, approx_lat = _timed_search(index, queries, k)
+
+    recall = np.mean([
+        len(set(a[a >= 0]) & set(e)) / k for a, e in zip(approx_ids, exact_ids)
+    ])
+    return {
+        "k": k,
+        "n_queries": len(queries),
+        f"recall@{k}": round(float(recall), 4),
+        "latency_ms_p50": round(float(np.percentile(approx_lat, 50)), 4),
+        "latency_ms_p95": round(float(np.percentile(approx_lat, 95)), 4),
+        "exact_latency_ms_mean": round(float(exact_ms), 4),
+        "qps": round(float(len(queries) / (approx_lat.sum() / 1000)), 1),
+    }
@@ -0,0 +1,212 @@
+# Src/rag/lexical_index.py
+"""
+Prebuilt BM25 inverted index over chunk contents.
+
+Dense MiniLM embeddings blur exact drug/disease names ("Cirrhosis",
+"Artemether-Lumefantrine"); this index answers those lookups exactly. BM25
+impacts are computed at build time, so a query is just a few slices of the
+postings arrays summed with numpy (no per-document Python loop).
+
+Layout of the index directory (all .npy files are opened with mmap):
+    meta.json           n_docs, avgdl, k1, b
+    vocab.json          term -> term id
+    term_offsets.npy    int64 CSR offsets per term id
+    doc_ids.npy         int32 posting row ids
+    impacts.npy         float32 precomputed BM25 term weight per posting
+"""
+import os
+import re
+import json
+import shutil
+from collections import Counter
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were which with
+what how tell about do does can may also not no than then these those their there been being into
+""".split())
+
+
+def tokenize(text):
+    """Lower-case word tokens; hyphenated names are kept whole and also split into parts."""
+    tokens = []
+    for token in TOKEN_PATTERN.findall((text or "").lower()):
+        if "-" in token:
+            tokens.append(token)
+            tokens.extend(part for part in token.split("-") if part not in STOPWORDS)
+        elif token not in STOPWORDS:
+            tokens.append(token)
+    return tokens
+
+
+# ---------------- BUILD ----------------
+def _save_array(path, values, dtype):
+    # np.memmap refuses zero-length arrays
+    if len(values) == 0:
+        np.save(path, np.zeros(0, dtype=dtype))
+        return None
+    return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(len(values),))
+
+
+class BM25Writer:
+    """
+    Add documents one at a time (row id = order of add()) and write the BM25
+    index on close(). Postings are appended to spool files on disk as
+    (term id, row, tf) columns; only the vocabulary and document lengths stay
+    in memory until close() sorts the postings by term.
+    """
+
+    SPOOL_COLUMNS = (("term_ids", np.int32), ("rows", np.int32), ("tfs", np.float32))
+
+    def __init__(self, index_dir, k1=1.2, b=0.75, batch_size=1 << 20):
+        self.index_dir = index_dir
+        self.k1 = k1
+        self.b = b
+        self.batch_size = batch_size
+        self.tmp_dir = index_dir.rstrip("/\\") + ".tmp"
+        if os.path.exists(self.tmp_dir):
+            shutil.rmtree(self.tmp_dir)
+        os.makedirs(self.tmp_dir)
+
+        self.vocab = {}
+        self.doc_len = []
+        self.n_postings = 0
+        self._spool = {name: open(self._spool_path(name), "wb") for name, _ in self.SPOOL_COLUMNS}
+
+    def _spool_path(self, name):
+        return os.path.join(self.tmp_dir, f"spool_{name}.bin")
+
+    def add(self, text):
+        """Append one document. Returns its row id."""
+        row = len(self.doc_len)
+        counts = Counter(tokenize(text))
+        self.doc_len.append(sum(counts.values()))
+        if counts:
+            n = len(counts)
+            np.fromiter((self.vocab.setdefault(term, len(self.vocab)) for term in counts),
+                        dtype=np.int32, count=n).tofile(self._spool["term_ids"])
+            np.full(n, row, dtype=np.int32).tofile(self._spool["rows"])
+            np.fromiter(counts.values(), dtype=np.float32, count=n).tofile(self._spool["tfs"])
+            self.n_postings += n
+        return row
+
+    def _read_spool(self, name, dtype):
+        if self.n_postings == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self._spool_path(name), dtype=dtype, mode="r")
+
+    def close(self):
+        for f in self._spool.values():
+            f.close()
+        k1, b = self.k1, self.b
+        n_docs = len(self.doc_len)
+        doc_len = np.asarray(self.doc_len, dtype=np.float32)
+        avgdl = float(doc_len.mean()) if n_docs else 0.0
+
+        # Term ids in sorted term order (same layout as a build from a full postings dict)
+        terms = sorted(self.vocab)
+        sorted_id = np.zeros(len(terms), dtype=np.int32)
+        for new_id, term in enumerate(terms):
+            sorted_id[self.vocab[term]] = new_id
+        vocab = {term: new_id for new_id, term in enumerate(terms)}
+
+        term_ids = sorted_id[self._read_spool("term_ids", np.int32)]
+        spool_rows = self._read_spool("rows", np.int32)
+        spool_tfs = self._read_spool("tfs", np.float32)
+        df = np.bincount(term_ids, minlength=len(terms))
+        term_offsets = np.concatenate([[0], np.cumsum(df)]).astype(np.int64)
+        idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+        # Stable: rows stay in ascending order inside each posting list
+        order = np.argsort(term_ids, kind="stable")
+        del term_ids
+
+        doc_ids = _save_array(os.path.join(self.tmp_dir, "doc_ids.npy"), order, np.int32)
+        impacts = _save_array(os.path.join(self.tmp_dir, "impacts.npy"), order, np.float32)
+        for start in range(0, len(order), self.batch_size):
+            postings = order[start:start + self.batch_size]
+            rows = spool_rows[postings]
+            tfs = spool_tfs[postings]
+            norm = k1 * (1 - b + b * doc_len[rows] / (avgdl or 1.0))
+            term = np.searchsorted(term_offsets, np.arange(start, start + len(postings)), side="right") - 1
+            doc_ids[start:start + len(postings)] = rows
+            impacts[start:start + len(postings)] = idf[term] * tfs * (k1 + 1) / (tfs + norm)
+        for array in (doc_ids, impacts):
+            if array is not None:
+                array.flush()
+        del doc_ids, impacts, spool_rows, spool_tfs
+        for name, _ in self.SPOOL_COLUMNS:
+            os.remove(self._spool_path(name))
+
+        np.save(os.path.join(self.tmp_dir, "term_offsets.npy"), term_offsets)
+        with open(os.path.join(self.tmp_dir, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(vocab, f, ensure_ascii=False)
+        with open(os.path.join(self.tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"n_docs": n_docs, "avgdl": avgdl, "k1": k1, "b": b, "n_terms": len(vocab)}, f)
+
+        if os.path.exists(self.index_dir):
+            shutil.rmtree(self.index_dir)
+        os.replace(self.tmp_dir, self.index_dir)
+        return self.index_dir
+
+
+def build_bm25_index(texts, index_dir, k1=1.2, b=0.75):
+    """Build and save a BM25 index for `texts` (row id = position in `texts`)."""
+    writer = BM25Writer(index_dir, k1=k1, b=b)
+    for text in texts:
+        writer.add(text)
+    return writer.close()
+
+
+def bm25_index_exists(index_dir):
+    return os.path.exists(os.path.join(index_dir, "meta.json"))
+
+
+# ---------------- SEARCH ----------------
+class BM25Index:
+    """Read-only BM25 index; `search` returns (rows, scores) best first."""
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(os.path.join(index_dir, "vocab.json"), "r", encoding="utf-8") as f:
+            self.vocab = json.load(f)
+        self.n_docs = self.meta["n_docs"]
+        self.term_offsets = np.load(os.path.join(index_dir, "term_offsets.npy"), mmap_mode="r")
+        self.doc_ids = np.load(os.path.join(index_dir, "doc_ids.npy"), mmap_mode="r")
+        self.impacts = np.load(os.path.join(index_dir, "impacts.npy"), mmap_mode="r")
+
+    def scores(self, query):
+        """Dense array of BM25 scores (one per row) for `query`."""
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for term in tokenize(query):
+            tid = self.vocab.get(term)
+            if tid is None:
+                continue
+            start, end = self.term_offsets[tid], self.term_offsets[tid + 1]
+            # doc ids are unique within a posting list, so fancy-index add is safe
+            scores[self.doc_ids[start:end]] += self.impacts[start:end]
+        return scores
+
+    def search(self, query, k=10, mask=None):
+        """
+        Top-k rows by BM25. `mask` (bool array over rows) restricts the candidates.
+        Rows with a zero score are never returned.
+        """
+        return self.top_k(self.scores(query), k, mask)
+
+    @staticmethod
+    def top_k(scores, k=10, mask=None):
+        """(rows, scores) of the k best non-zero entries of a `scores()` array."""
+        if mask is not None:
+            scores = np.where(mask, scores, 0)
+        candidates = np.flatnonzero(scores)
+        if candidates.size == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if candidates.size > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        order = np.argsort(-scores[candidates], kind="stable")
+        rows = candidates[order]
+        return rows, scores[rows]
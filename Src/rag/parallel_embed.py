@@ -0,0 +1,149 @@
+# Src/rag/parallel_embed.py
+"""
+Streaming, multi-process, resumable embedding for index builds.
+
+Texts are consumed lazily from any iterable (the chunk file is still being
+parsed while the first batches encode). Texts whose content hash is already
+in the HashVectorStore are skipped; the rest are cut into batches and encoded
+by a pool of worker processes, each holding its own encoder with
+CPUs / workers intra-op threads. Every `checkpoint_every` batches the new
+vectors are appended to the store as an on-disk segment, so a build that is
+interrupted resumes from the last checkpoint instead of from scratch.
+"""
+import os
+import time
+import multiprocessing
+from collections import deque
+import numpy as np
+from Src.rag.vector_store import content_hash
+
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "0"))  # 0 = one per CPU (max 8), 1 = in-process
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+EMBED_CHECKPOINT_EVERY = int(os.getenv("EMBED_CHECKPOINT_EVERY", "8"))  # batches between checkpoints
+
+_worker_encoder = None
+
+
+def default_workers():
+    return EMBED_WORKERS or min(8, os.cpu_count() or 1)
+
+
+# ---------------- WORKERS ----------------
+def _init_worker(backend, model_path, threads):
+    global _worker_encoder
+    # Split the cores between workers instead of every worker grabbing all of them
+    from Src.rag import encoders
+    encoders.ONNX_THREADS = threads
+    _worker_encoder = encoders.load_encoder(backend, model_path)
+    if backend == "torch":
+        import torch
+        torch.set_num_threads(threads)
+
+
+def _encode_batch(batch):
+    hashes, texts = batch
+    vectors = _worker_encoder.encode(texts, convert_to_numpy=True, batch_size=64, show_progress_bar=False)
+    return hashes, np.asarray(vectors, dtype=np.float32)
+
+
+# ---------------- PIPELINE ----------------
+def _missing_batches(texts, store, hashes, batch_size):
+    """Record the hash of every text in `hashes`; yield (hashes, texts) batches of unseen ones."""
+    queued = set()
+    batch_hashes, batch_texts = [], []
+    for text in texts:
+        h = content_hash(text)
+        hashes.append(h)
+        if h in store or h in queued:
+            continue
+        queued.add(h)
+        batch_hashes.append(h)
+        batch_texts.append(text or "")
+        if len(batch_texts) == batch_size:
+            yield batch_hashes, batch_texts
+            batch_hashes, batch_texts = [], []
+    if batch_texts:
+        yield batch_hashes, batch_texts
+
+
+def embed_texts(store, texts, backend, model_path, workers=None, batch_size=EMBED_BATCH_SIZE,
+                checkpoint_every=EMBED_CHECKPOINT_EVERY, label="texts"):
+    """
+    Make sure every text in the iterable `texts` has a vector in `store`.
+
+    Returns:
+        (hashes, stats): the content hash of each text (in order) and
+        {"texts", "embedded", "reused", "seconds", "texts_per_second", "workers"}.
+    """
+    workers = workers or default_workers()
+    hashes = []
+    batches = _missing_batches(texts, store, hashes, batch_size)
+    start = time.perf_counter()
+    embedded = 0
+    done_batches = 0
+    last_report = start
+
+    def collect(results):
+        nonlocal embedded, done_batches, last_report
+        for batch_hashes, vectors in results:
+            store.put_many(batch_hashes, vectors)
+            embedded += len(batch_hashes)
+            done_batches += 1
+            if done_batches % checkpoint_every == 0:
+                store.checkpoint()
+            now = time.perf_counter()
+            if now - last_report >= 5:
+                print(f"[parallel_embed] {label}: {embedded} embedded, {len(hashes)} read, "
+                      f"{embedded / (now - start):.1f} {label}/s")
+                last_report = now
+
+    # The encoder (or the pool) only starts once there is something to encode;
+    # a single batch (small incremental update) is not worth starting worker processes
+    first = next(batches, None)
+    second = next(batches, None) if first is not None else None
+    try:
+        if first is not None and (workers == 1 or second is None):
+            from Src.rag.encoders import load_encoder
+            encoder = load_encoder(backend, model_path)
+            collect((h, np.asarray(encoder.encode(t, convert_to_numpy=True, show_progress_bar=False),
+                                   dtype=np.float32)) for h, t in _chain(first, second, batches))
+        elif first is not None:
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            # spawn: forked workers can deadlock inside torch / onnxruntime thread pools
+            context = multiprocessing.get_context("spawn")
+            with context.Pool(workers, initializer=_init_worker, initargs=(backend, model_path, threads)) as pool:
+                collect(_bounded_map(pool, _chain(first, second, batches), window=2 * workers))
+    finally:
+        # Also on failure / Ctrl+C: keep what was encoded for the next run
+        store.checkpoint()
+
+    seconds = time.perf_counter() - start
+    stats = {
+        "texts": len(hashes),
+        "embedded": embedded,
+        "reused": len(hashes) - embedded,
+        "seconds": round(seconds, 3),
+        "texts_per_second": round(embedded / seconds, 1) if embedded and seconds else None,
+        "workers": (workers if second is not None else 1) if embedded else 0,
+    }
+    print(f"[parallel_embed] {label}: {stats['embedded']} embedded, {stats['reused']} reused "
+          f"in {stats['seconds']}s ({stats['texts_per_second']} {label}/s, {stats['workers']} workers)")
+    return hashes, stats
+
+
+def _bounded_map(pool, batches, window):
+    """Ordered pool.imap with at most `window` batches in flight (imap reads its input eagerly)."""
+    pending = deque()
+    for batch in batches:
+        pending.append(pool.apply_async(_encode_batch, (batch,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def _chain(first, second, rest):
+    yield first
+    if second is not None:
+        yield second
+        yield from rest
@@ -1,6 +1,7 @@
-import fitz, re, os, contractions, camelot
+import fitz, re, os, json, time, hashlib, inspect, contractions, camelot
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from tqdm.notebook import tqdm
-from langchain_community.document_loaders import PyPDFLoader
 import nltk
 
 # Make sure NLTK sentence tokenizer is available
@@ -49,6 +50,30 @@ def standardize_headings(text):
     return text
 
 
+# Standard section names produced by standardize_headings (Causes, Definition, Diagnosis, Treatment)
+SECTION_NAMES = sorted(set(heading_map.values()))
+SECTION_PATTERN = re.compile(r"\b(" + "|".join(SECTION_NAMES) + r")\b")
+
+def assign_section(text, current_section=None):
+    """
+    Tag a chunk with the standardized section covering most of its text.
+    Text before the first heading belongs to `current_section` (carried over
+    from the previous chunk). Returns (section, section_at_end_of_chunk).
+    """
+    spans = {}
+    section, start = current_section, 0
+    for match in SECTION_PATTERN.finditer(text):
+        if section is not None:
+            spans[section] = spans.get(section, 0) + match.start() - start
+        section, start = match.group(1), match.start()
+    if section is not None:
+        spans[section] = spans.get(section, 0) + len(text) - start
+
+    if not spans:
+        return None, None
+    return max(spans, key=spans.get), section
+
+
 def clean_text(text):
     """
     Clean extracted text from PDF for RAG:
@@ -211,80 +236,590 @@ def clean_text(text):
 
     return text, changes_log
 
+
+# ---------------- FAST CLEAN ----------------
+# clean_text's patterns, compiled once. clean_text stays the reference (and the only
+# one producing a change log); clean_text_fast must return exactly the same text.
+_NON_ASCII = re.compile(r'[^\x00-\x7F]+')
+# (literal every match must contain, lowercased; pattern): the pattern only runs when the literal is there
+_TITLE_PATTERNS = [(needle, re.compile(p, re.DOTALL | re.IGNORECASE)) for needle, p in (
+    ("the gale", r"The GALE\s+ENCYCLOPEDIA\s+of MEDICINE.*?(?=\n[A-Z])"),
+    ("staff\n", r"STAFF\n.*?(?=\n[A-Z])"),
+    ("contributors\n", r"CONTRIBUTORS\n.*?(?=\n[A-Z])"),
+    ("advisory board\n", r"ADVISORY BOARD\n.*?(?=\n[A-Z])"),
+    ("library of congress cataloging", r"Library of Congress Cataloging.*?(?=\n[A-Z])"),
+)]
+_HEADER_FOOTER_PATTERNS = [(needle, re.compile(p, re.DOTALL | re.IGNORECASE)) for needle, p in (
+    ("gale encyclopedia of medicine", r"GALE ENCYCLOPEDIA OF MEDICINE.*?\n"),
+    ("gem", r"GEM\s*-\s*\d{4}\s*to\s*\d{4}.*?\n"),
+    ("page ", r"Page \d+"),
+    ("\n", r"\n\d+\n"),
+)]
+_HEADING_LINE = re.compile(r"(?<=\n)([A-Z][A-Za-z\s]+)(?=\n)")
+_BIBLIO_WORDS = ("resources", "organizations", "periodicals", "further reading")
+_KEY_TERMS_WORDS = ("key terms", "see also", "other names")
+# \b: a match can only start where a word starts, so skip the \w+ scan from inside words
+_HYPHEN_SPLIT = re.compile(r"\b(\w+)-\s+(\w+)")
+_REPEATED_MARKS = re.compile(r'[!?]{2,}')
+_REPEATED_DOTS = re.compile(r'\.{2,}')
+_EXTRA_SPACE = re.compile(r"\s{2,}")
+
+
+def _sub_patterns(patterns, text):
+    """Apply (needle, pattern) removals in order, skipping patterns whose literal is absent."""
+    lower = text.lower()
+    for needle, pattern in patterns:
+        if needle in lower:
+            cleaned = pattern.sub("", text)
+            # A removal can join text into a new match for the next pattern: re-check on the new text
+            if cleaned != text:
+                text, lower = cleaned, cleaned.lower()
+    return text
+
+
+def _cut_at_first(text, lower, words):
+    """Text before the first (case-insensitive) occurrence of any of `words`."""
+    positions = [i for i in (lower.find(word) for word in words) if i >= 0]
+    if not positions:
+        return text, lower
+    end = min(positions)
+    return text[:end], lower[:end]
+
+
+def clean_text_fast(text):
+    """
+    clean_text without the change log: same steps and output, but compiled
+    patterns that are skipped when their literal text is absent, plain string
+    search for the section cut-offs, and no before/after snapshots. Bullet and
+    ligature replacement are skipped because those characters are non-ASCII
+    and already gone after step 2.
+    """
+    text = contractions.fix(text)
+    text = _NON_ASCII.sub(' ', text)
+    # ASCII only from here on, so lower() keeps positions and matches IGNORECASE
+    text = _sub_patterns(_TITLE_PATTERNS, text)
+    text = _sub_patterns(_HEADER_FOOTER_PATTERNS, text)
+
+    for match in _HEADING_LINE.findall(text):
+        key = match.lower().strip()
+        if key in heading_map:
+            text = text.replace(match, heading_map[key])
+
+    # "<section>.*" with DOTALL removes everything from the first occurrence on
+    text, lower = _cut_at_first(text, text.lower(), _BIBLIO_WORDS)
+    text, lower = _cut_at_first(text, lower, _KEY_TERMS_WORDS)
+
+    text = " ".join(
+        line.strip() + " " if line and not line.endswith((".", ":", ";")) else line.strip()
+        for line in text.splitlines()
+    )
+    if "-" in text:
+        text = _HYPHEN_SPLIT.sub(r"\1\2", text)
+    if "!" in text or "?" in text:
+        text = _REPEATED_MARKS.sub('.', text)
+    if ".." in text:
+        text = _REPEATED_DOTS.sub('.', text)
+    return _EXTRA_SPACE.sub(" ", text).strip()
+
+
 # ---------------- TEXT + TABLE EXTRACTION ----------------
-def extract_text_with_tables(pdf_path):
+# Text extraction + clean_text run in a process pool, PAGES_PER_TASK pages per work unit
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", "0")) or os.cpu_count() or 1
+PAGES_PER_TASK = int(os.getenv("PAGES_PER_TASK", "16"))
+# Every Nth page is cleaned with the logging clean_text (0 = none); the rest use clean_text_fast
+CLEAN_LOG_EVERY = int(os.getenv("CLEAN_LOG_EVERY", "0"))
+
+
+# Camelot only runs on pages the PyMuPDF pre-pass flags (TABLE_PREPASS=0: every page, lattice only)
+TABLE_PREPASS = os.getenv("TABLE_PREPASS", "1") != "0"
+TABLE_MIN_RULES = 4          # horizontal and vertical ruling lines each (lattice tables)
+TABLE_MIN_ALIGNED_ROWS = 3   # rows of >= 3 side-by-side text blocks (borderless tables)
+# Stream results kept only on "layout" pages, with >= 3 columns and a clean parsing report
+# (two-column body text otherwise reads as a 2-column table and gets appended to the page twice)
+TABLE_STREAM_MIN_COLUMNS = 3
+TABLE_STREAM_MIN_ACCURACY = 80.0
+TABLE_STREAM_MAX_WHITESPACE = 50.0
+
+
+def _ruling_lines(page, min_length=20):
+    """(horizontal, vertical) counts of straight line segments / thin rectangles drawn on the page."""
+    horizontal = vertical = 0
+    for drawing in page.get_drawings():
+        for item in drawing["items"]:
+            if item[0] == "l":
+                p1, p2 = item[1], item[2]
+                if abs(p1.y - p2.y) < 1 and abs(p1.x - p2.x) >= min_length:
+                    horizontal += 1
+                elif abs(p1.x - p2.x) < 1 and abs(p1.y - p2.y) >= min_length:
+                    vertical += 1
+            elif item[0] == "re":
+                rect = item[1]
+                if rect.height < 2 and rect.width >= min_length:
+                    horizontal += 1
+                elif rect.width < 2 and rect.height >= min_length:
+                    vertical += 1
+                elif rect.width >= min_length and rect.height >= min_length:
+                    # Cell / frame box: two rules each way
+                    horizontal += 2
+                    vertical += 2
+    return horizontal, vertical
+
+
+def _aligned_rows(blocks, tolerance=3):
+    """Number of text rows holding >= 3 separate blocks (body text has 1-2 per row: the columns)."""
+    rows = {}
+    for block in blocks:
+        if block[6] == 0 and block[4].strip():
+            key = round(block[1] / tolerance)
+            rows[key] = rows.get(key, 0) + 1
+    return sum(1 for count in rows.values() if count >= 3)
+
+
+def detect_table_pages(pdf_path, page_nums=None):
     """
-    Extract page text using LangChain (PyPDFLoader) and tables using Camelot.
-    Merge tables into text in reading order (tables appended after text of that page).
+    Cheap pre-pass over the PDF: {page_num: reason} of pages that may hold a table,
+    from ruling lines ("rules") or a grid-like text-block layout ("layout").
+    `page_nums` limits the walk to those pages (default: all).
+    """
+    candidates = {}
+    wanted = None if page_nums is None else set(page_nums)
+    doc = fitz.open(pdf_path)
+    for page_num, page in enumerate(doc, start=1):
+        if wanted is not None and page_num not in wanted:
+            continue
+        reason = table_candidate(page)
+        if reason:
+            candidates[page_num] = reason
+    return candidates
+
+
+def table_candidate(page, blocks=None):
+    """"rules" / "layout" when the PyMuPDF `page` may hold a table, else None."""
+    horizontal, vertical = _ruling_lines(page)
+    if horizontal >= TABLE_MIN_RULES and vertical >= TABLE_MIN_RULES:
+        return "rules"
+    if _aligned_rows(page.get_text("blocks") if blocks is None else blocks) >= TABLE_MIN_ALIGNED_ROWS:
+        return "layout"
+    return None
+
+
+def _table_text(table):
+    # Convert table to Markdown-like text
+    return "\nTable:\n" + "\n".join([" | ".join(row) for row in table.df.values.tolist()])
+
+
+def _stream_table_ok(table):
+    report = table.parsing_report
+    return (table.shape[1] >= TABLE_STREAM_MIN_COLUMNS
+            and report.get("accuracy", 0) >= TABLE_STREAM_MIN_ACCURACY
+            and report.get("whitespace", 100) <= TABLE_STREAM_MAX_WHITESPACE)
+
+
+def _read_page_tables(pdf_path, page_num, reason="rules"):
+    """
+    Work unit: Camelot on one page, lattice first, then stream (borderless tables)
+    when lattice finds nothing and the pre-pass flagged the page by its text
+    `reason` "layout". Returns (page_num, [table text, ...], flavor, seconds).
     """
-    # Load text with LangChain
-    loader = PyPDFLoader(pdf_path)
-    docs = loader.load()
+    start = time.perf_counter()
+    flavor = "lattice"
+    tables = camelot.read_pdf(pdf_path, pages=str(page_num), flavor="lattice")
+    if not tables.n and reason == "layout":
+        flavor = "stream"
+        # Stream splits any text into columns: keep only confident, genuinely tabular results
+        tables = [t for t in camelot.read_pdf(pdf_path, pages=str(page_num), flavor="stream")
+                  if _stream_table_ok(t)]
+    return page_num, [_table_text(table) for table in tables], flavor, time.perf_counter() - start
+
+
+def extract_tables(pdf_path, workers=PREPROCESS_WORKERS):
+    """
+    {page_num: [table text, ...]} of the tables Camelot finds in the PDF.
+
+    With TABLE_PREPASS (default) only the pages detect_table_pages flags are
+    parsed, one page per task on `workers` processes; the printed per-page
+    timing estimates what running Camelot on every page would have cost.
+    """
+    tables_by_page = {}
+    if not TABLE_PREPASS:
+        try:
+            tables = camelot.read_pdf(pdf_path, pages='all', flavor='lattice')  # use 'stream' if borderless
+            print(tables)
+            for table in tqdm(tables, desc="Extracting Tables"):
+                tables_by_page.setdefault(int(table.page), []).append(_table_text(table))
+        except Exception as e:
+            print(f"No tables detected or error extracting tables: {e}")
+        return tables_by_page
+
+    start = time.perf_counter()
+    candidates = detect_table_pages(pdf_path)
+    return read_candidate_tables(pdf_path, candidates, len(fitz.open(pdf_path)),
+                                 time.perf_counter() - start, workers)
 
-    # Extract tables using Camelot
+
+def read_candidate_tables(pdf_path, candidates, n_pages, prepass_seconds, workers=PREPROCESS_WORKERS):
+    """
+    Camelot over the {page_num: reason} candidate pages; {page_num: [table text, ...]}.
+    `prepass_seconds` is None when the candidates came out of a page walk done anyway.
+    """
     tables_by_page = {}
+    prepass_seconds = prepass_seconds or 0.0
+    print(f"[pdf_utils] table pre-pass: {len(candidates)}/{n_pages} candidate pages in {prepass_seconds:.1f}s "
+          f"({sum(r == 'rules' for r in candidates.values())} ruled, "
+          f"{sum(r == 'layout' for r in candidates.values())} by layout)")
+    if not candidates:
+        return tables_by_page
+
+    start = time.perf_counter()
+    page_seconds, flavors = [], {}
     try:
-        tables = camelot.read_pdf(pdf_path, pages='all', flavor='lattice')  # use 'stream' if borderless
-        print(tables)
-        for table in tqdm(tables, desc="Extracting Tables"):
-            page_num = table.page
-            # Convert table to Markdown-like text
-            table_text = "\nTable:\n" + "\n".join([" | ".join(row) for row in table.df.values.tolist()])
-            tables_by_page.setdefault(page_num, []).append(table_text)
+        workers = min(workers, len(candidates))
+        if workers <= 1:
+            results = (_read_page_tables(pdf_path, page_num, candidates[page_num]) for page_num in sorted(candidates))
+            results = list(tqdm(results, total=len(candidates), desc="Extracting Tables"))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(_read_page_tables, pdf_path, page_num, candidates[page_num])
+                           for page_num in sorted(candidates)]
+                results = [future.result() for future in tqdm(futures, desc="Extracting Tables")]
     except Exception as e:
         print(f"No tables detected or error extracting tables: {e}")
+        return tables_by_page
 
-    # Combine text + tables per page
-    combined_pages = []
-    for doc in tqdm(docs, desc="Extracting Text"):
-        page_num = doc.metadata['page'] + 1
-        text_content = doc.page_content.strip()
-
-        if page_num in tables_by_page:
-            for table_text in tables_by_page[page_num]:
-                text_content += "\n" + table_text
-
-        print(f'Page No. {page_num}')
-        text_content, logs = clean_text(text_content)  # Assume you have clean_text implemented
-        print(logs)
-        
-        combined_pages.append({
-            "page_num": page_num,
-            "content": text_content
-        })
+    for page_num, table_texts, flavor, seconds in results:
+        page_seconds.append(seconds)
+        if table_texts:
+            tables_by_page[page_num] = table_texts
+            flavors[flavor] = flavors.get(flavor, 0) + 1
+    camelot_seconds = time.perf_counter() - start
 
-    return combined_pages, logs
+    # Rough estimate: every page at the mean candidate-page time (which includes stream fallbacks)
+    estimated_all = sum(page_seconds) / len(page_seconds) * n_pages
+    print(f"[pdf_utils] tables on {len(tables_by_page)} pages {flavors}; Camelot {camelot_seconds:.1f}s wall "
+          f"({sum(page_seconds) / len(page_seconds):.2f}s/page, {workers} workers) + pre-pass "
+          f"{prepass_seconds:.1f}s vs. ~{estimated_all:.0f}s for all {n_pages} pages "
+          f"(~{estimated_all - camelot_seconds - prepass_seconds:.0f}s saved)")
+    return tables_by_page
 
 
-def extract_images_pymupdf(pdf_path, images_output_dir):
+def _clean_page(page_num, text_content, table_texts=(), verbose=False):
     """
-    Extract inline figures/images from PDF using PyMuPDF.
+    Append the page's tables to its text and clean it. Returns (page dict,
+    changed log categories or None when the page was cleaned without a log).
     """
-    os.makedirs(images_output_dir, exist_ok=True)
-    doc = fitz.open(pdf_path)
+    for table_text in table_texts:
+        text_content += "\n" + table_text
 
-    image_map = {}
-    for page_num, page in enumerate(doc, start=1):
-        images = page.get_images(full=True)
-        image_list = []
+    if verbose or (CLEAN_LOG_EVERY and page_num % CLEAN_LOG_EVERY == 0):
+        text_content, logs = clean_text(text_content)
+        if verbose:
+            print(f'Page No. {page_num}')
+            print(logs)
+        changed = [category for category, entries in logs.items() if entries]
+    else:
+        text_content, changed = clean_text_fast(text_content), None
+    return {"page_num": page_num, "content": text_content}, changed
+
+
+def _extract_page_range(pdf_path, first, last, tables_by_page, verbose=False):
+    """
+    Work unit: text of pages first..last (1-based, inclusive) with their tables
+    appended, cleaned. Returns [(page dict, changed), ...] in page order (see _clean_page).
+    """
+    # Same text as PyPDFLoader (page.extract_text()), without loading every page
+    from pypdf import PdfReader
+    reader = PdfReader(pdf_path)
+    pages = []
+    for page_num in range(first, last + 1):
+        text_content = (reader.pages[page_num - 1].extract_text() or "").strip()
+        pages.append(_clean_page(page_num, text_content, tables_by_page.get(page_num, []), verbose))
+    return pages
+
+
+def iter_text_with_tables(pdf_path, workers=PREPROCESS_WORKERS, pages_per_task=PAGES_PER_TASK, verbose=False):
+    """
+    Yield (page, changed) in page order while extraction is still running:
+    page ranges are submitted to the pool lazily, at most 2 * workers ranges
+    in flight, so only those pages are held in memory at any time. `changed`
+    is the list of change-log categories of the page (None when it was
+    cleaned without a log, see extract_text_with_tables).
+    """
+    from pypdf import PdfReader
+
+    tables_by_page = extract_tables(pdf_path, workers)
+    n_pages = len(PdfReader(pdf_path).pages)
+    ranges = [(first, min(first + pages_per_task - 1, n_pages)) for first in range(1, n_pages + 1, pages_per_task)]
+    tasks = (
+        (pdf_path, first, last, {p: t for p, t in tables_by_page.items() if first <= p <= last}, verbose)
+        for first, last in ranges
+    )
+
+    workers = min(workers, len(ranges))
+
+    def range_results():
+        if workers <= 1:
+            yield from (_extract_page_range(*task) for task in tasks)
+            return
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for task in tasks:
+                pending.append(pool.submit(_extract_page_range, *task))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    start = time.perf_counter()
+    n_done = 0
+    for result in tqdm(range_results(), total=len(ranges), desc="Extracting Text"):
+        n_done += len(result)
+        yield from result
+
+    elapsed = time.perf_counter() - start
+    print(f"[pdf_utils] extracted {n_done} pages in {elapsed:.1f}s "
+          f"({n_done / max(elapsed, 1e-9):.1f} pages/s, {max(workers, 1)} workers)")
 
-        for img_index, img in enumerate(images):
-            xref = img[0]
-            base_image = doc.extract_image(xref)
-            image_bytes = base_image["image"]
-            image_ext = base_image["ext"]
 
-            image_filename = f"{os.path.basename(pdf_path).replace('.pdf','')}_page{page_num}_img{img_index+1}.{image_ext}"
-            image_path = os.path.join(images_output_dir, image_filename)
-            image_path = os.path.relpath(image_path).replace("\\", "/")
+def summarize_changes(pages, summary):
+    """Pass (page, changed) pairs through as pages, counting logged changes into `summary`."""
+    for page, changed in pages:
+        if changed is not None:
+            summary["logged_pages"] = summary.get("logged_pages", 0) + 1
+            for category in changed:
+                summary[category] = summary.get(category, 0) + 1
+        yield page
 
-            with open(image_path, "wb") as img_file:
-                img_file.write(image_bytes)
 
-            image_list.append(image_path)
+def extract_text_with_tables(pdf_path, workers=PREPROCESS_WORKERS, pages_per_task=PAGES_PER_TASK, verbose=False):
+    """
+    Extract page text (pypdf, as PyPDFLoader does) and tables using Camelot.
+    Merge tables into text in reading order (tables appended after text of that page).
+
+    Pages are split into ranges of `pages_per_task` and extracted + cleaned on
+    `workers` processes; results are merged in page order, so the output is
+    the same for any worker count. Pages are cleaned with clean_text_fast;
+    `verbose` (every page) or CLEAN_LOG_EVERY (sampled pages) use the logging
+    clean_text instead, and `verbose` prints each log.
+
+    Returns:
+        (pages, summary): [{page_num, content}] and {change category: logged pages changed}.
+    """
+    summary = {}
+    combined_pages = list(summarize_changes(
+        iter_text_with_tables(pdf_path, workers, pages_per_task, verbose), summary))
+    logged = summary.pop("logged_pages", 0)
+    if logged:
+        print(f"[pdf_utils] pages changed per cleaning step ({logged} logged pages): {summary}")
+    return combined_pages, summary
+
+
+# ---------------- IMAGE STORE ----------------
+# Extracted images are stored once per content: <images dir>/<sha1 of the bytes>.<ext>
+IMAGE_MANIFEST_NAME = "manifest.json"
+# Per-occurrence files written before the content-addressed store (<pdf>_page<N>_img<M>.<ext>)
+LEGACY_IMAGE_NAME = re.compile(r"^.+_page\d+_img\d+\.\w+$")
+
+
+def store_image(doc, xref, images_output_dir, seen=None):
+    """
+    Content-addressed write of image `xref`. `seen` ({xref: record}, per open
+    document) skips re-extracting an xref already stored (logos, figures
+    referenced from several pages); equal bytes under another xref map to the
+    same file, which is only written once.
+
+    Returns {"xref", "sha1", "ext", "size", "image_path" (relative), "written"}.
+    """
+    if seen is not None and xref in seen:
+        return {**seen[xref], "written": False}
+    base_image = doc.extract_image(xref)
+    image_bytes = base_image["image"]
+    sha1 = hashlib.sha1(image_bytes).hexdigest()
+    image_path = os.path.join(images_output_dir, f"{sha1}.{base_image['ext']}")
 
-        image_map[page_num] = image_list
+    written = not os.path.exists(image_path)
+    if written:
+        # tmp + rename: concurrent workers storing the same image never leave a partial file
+        tmp_path = f"{image_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as img_file:
+            img_file.write(image_bytes)
+        os.replace(tmp_path, image_path)
 
+    record = {"xref": xref, "sha1": sha1, "ext": base_image["ext"], "size": len(image_bytes),
+              "image_path": os.path.relpath(image_path).replace("\\", "/")}
+    if seen is not None:
+        seen[xref] = record
+    return {**record, "written": written}
+
+
+class ImageManifest:
+    """
+    On-disk index of the image store (<images dir>/manifest.json):
+        {"images": {sha1: {"image_path", "ext", "size", "xrefs": {pdf_file: [xref, ...]}}},
+         "pages": {pdf_file: {page_num: [sha1, ...]}}}
+    Pages of a document are replaced as they are re-extracted; other documents are kept.
+    save() deletes the hashed images this manifest stored that no page references any more.
+    """
+
+    def __init__(self, images_dir):
+        self.images_dir = images_dir
+        self.path = os.path.join(images_dir, IMAGE_MANIFEST_NAME)
+        self.images, self.pages = {}, {}
+        self.written = self.reused = self.removed = 0
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.images, self.pages = data.get("images", {}), data.get("pages", {})
+
+    def add(self, pdf_file, page_num, records):
+        """Record the images of one page (store_image records, in page order)."""
+        self.pages.setdefault(pdf_file, {})[str(page_num)] = [r["sha1"] for r in records]
+        for r in records:
+            entry = self.images.setdefault(r["sha1"], {"image_path": r["image_path"], "ext": r["ext"],
+                                                       "size": r["size"], "xrefs": {}})
+            xrefs = entry["xrefs"].setdefault(pdf_file, [])
+            if r["xref"] not in xrefs:
+                xrefs.append(r["xref"])
+            if r["written"]:
+                self.written += 1
+            else:
+                self.reused += 1
+
+    def _remove_file(self, name):
+        try:
+            os.remove(os.path.join(self.images_dir, name))
+            self.removed += 1
+        except FileNotFoundError:
+            pass
+
+    def prune(self):
+        """Drop images of this manifest that no page references any more (entry and file)."""
+        referenced = {sha1 for pages in self.pages.values() for sha1s in pages.values() for sha1 in sha1s}
+        for sha1 in [sha1 for sha1 in self.images if sha1 not in referenced]:
+            self._remove_file(f"{sha1}.{self.images.pop(sha1)['ext']}")
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.prune()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"images": self.images, "pages": self.pages}, f, indent=2)
+        os.replace(tmp_path, self.path)
+        print(f"[pdf_utils] image store: {len(self.images)} unique images, {self.written} written, "
+              f"{self.reused} duplicate references reused, {self.removed} unreferenced files removed "
+              f"({self.path})")
+
+
+def _chunk_image_names(chunk_file):
+    """
+    Base names of the images (and caption images) referenced by a chunk file
+    (.json, .jsonl or .pkl) or a chunk store directory (needs the Src package importable).
+    """
+    if os.path.isdir(chunk_file):
+        from Src.rag.chunk_store import ChunkStore
+        chunks = ChunkStore(chunk_file)
+    elif chunk_file.endswith(".pkl"):
+        import pickle
+        with open(chunk_file, "rb") as f:
+            chunks = pickle.load(f)
+    else:
+        with open(chunk_file, "r", encoding="utf-8") as f:
+            chunks = ([json.loads(line) for line in f if line.strip()] if chunk_file.endswith(".jsonl")
+                      else json.load(f))
+    names = set()
+    for chunk in chunks:
+        names.update(os.path.basename(path) for path in chunk.get("images") or [])
+        names.update(os.path.basename(c["image_path"]) for c in chunk.get("captions") or [] if c.get("image_path"))
+    return names
+
+
+def remove_legacy_images(images_dir, chunk_files):
+    """
+    Delete the per-occurrence <pdf>_page<N>_img<M> files in `images_dir` that none
+    of `chunk_files` (chunk JSON / JSON lines / metadata.pkl / chunk store directories)
+    references any more.
+    Returns (removed, kept) file counts.
+    """
+    referenced = set()
+    for chunk_file in chunk_files:
+        if os.path.exists(chunk_file):
+            referenced |= _chunk_image_names(chunk_file)
+    removed = kept = 0
+    for name in sorted(os.listdir(images_dir)) if os.path.isdir(images_dir) else []:
+        if not LEGACY_IMAGE_NAME.match(name):
+            continue
+        if name in referenced:
+            kept += 1
+            continue
+        os.remove(os.path.join(images_dir, name))
+        removed += 1
+    print(f"[pdf_utils] legacy images: {removed} removed, {kept} still referenced by chunk metadata")
+    return removed, kept
+
+
+def extract_page_images(doc, page, page_num, pdf_path, images_output_dir, seen=None, manifest=None):
+    """Store the inline images of one PyMuPDF `page`; returns their relative paths."""
+    records = [store_image(doc, img[0], images_output_dir, seen) for img in page.get_images(full=True)]
+    if manifest is not None:
+        manifest.add(os.path.basename(pdf_path), page_num, records)
+    return [r["image_path"] for r in records]
+
+
+def extract_page_captions(doc, page, page_num, pdf_path, images_output_dir, seen=None, manifest=None,
+                          caption_lines=3):
+    """
+    Store the inline images of one PyMuPDF `page` with the text found next to
+    each; returns [{image_path, caption_text}] in page order (one per image).
+    """
+    # Text blocks for caption proximity: (x0, y0, x1, y1, text, block_no, block_type)
+    text_blocks_sorted = sorted((b for b in page.get_text("blocks") if b[4].strip()), key=lambda b: b[1])
+    records, captions = [], []
+    for img in page.get_images(full=True):
+        xref = img[0]
+        records.append(store_image(doc, xref, images_output_dir, seen))
+        try:
+            rect = page.get_image_rects(xref)[0]  # bounding box
+        except (IndexError, ValueError, RuntimeError):
+            rect = None
+        captions.append({"image_path": records[-1]["image_path"],
+                         "caption_text": _caption_text(text_blocks_sorted, rect, caption_lines)})
+    if manifest is not None:
+        manifest.add(os.path.basename(pdf_path), page_num, records)
+    return captions
+
+
+def _caption_text(text_blocks_sorted, rect, caption_lines=3):
+    """Caption for an image at `rect`: text blocks (sorted by y0) within ~100px above or below it."""
+    caption_text = ""
+    if rect:
+        caption_candidates = []
+        for b in text_blocks_sorted:
+            x0, y0, x1, y1, text, *_ = b
+            # Text above or below image within ~100px
+            if (y0 >= rect.y1 and y0 - rect.y1 < 100) or (rect.y0 - y1 < 100 and y1 <= rect.y0):
+                caption_candidates.append(text)
+
+        caption_text = " ".join(caption_candidates[:caption_lines])
+
+    # Clean caption text
+    caption_text = re.sub(r"Figure\s*\d+[:.]?", "", caption_text, flags=re.IGNORECASE).strip()
+    caption_text = re.sub(r"\s{2,}", " ", caption_text)
+    return caption_text if caption_text else "No caption detected"
+
+
+def extract_images_pymupdf(pdf_path, images_output_dir):
+    """
+    Extract inline figures/images from PDF using PyMuPDF.
+    """
+    os.makedirs(images_output_dir, exist_ok=True)
+    doc = fitz.open(pdf_path)
+
+    image_map, seen = {}, {}
+    manifest = ImageManifest(images_output_dir)
+    for page_num, page in enumerate(doc, start=1):
+        image_map[page_num] = extract_page_images(doc, page, page_num, pdf_path, images_output_dir,
+                                                  seen, manifest)
+
+    manifest.save()
     return image_map
 
 
@@ -303,58 +838,28 @@ def extract_images_with_captions(pdf_path, output_dir=IMAGE_CAPTIONS_DIR, captio
     """
     os.makedirs(output_dir, exist_ok=True)
     doc = fitz.open(pdf_path)
-    caption_map = {}
-    pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
+    caption_map, seen = {}, {}
+    manifest = ImageManifest(output_dir)
 
     for page_index, page in enumerate(doc, start=1):
-        # Extract text blocks for caption proximity
-        blocks = page.get_text("blocks")  # (x0, y0, x1, y1, text, block_no, block_type)
-        text_blocks = [b for b in blocks if b[4].strip()]
+        captions = extract_page_captions(doc, page, page_index, pdf_path, output_dir, seen, manifest,
+                                         caption_lines)
+        if captions:
+            caption_map[page_index] = captions
 
-        # Extract images on this page
-        images = page.get_images(full=True)
-        for img_index, img in enumerate(images):
-            xref = img[0]
-            base_image = doc.extract_image(xref)
-            image_bytes = base_image["image"]
-            image_ext = base_image["ext"]
+    manifest.save()
+    return caption_map
 
-            # Save image
-            image_filename = f"{pdf_name}_page{page_index}_img{img_index+1}.{image_ext}"
-            image_path = os.path.join(output_dir, image_filename)
-            with open(image_path, "wb") as f:
-                f.write(image_bytes)
+def render_page_snapshot(page, page_num, pdf_name, page_output_dir=PAGE_IMAGES_DIR):
+    """Save one PyMuPDF `page` as a PNG snapshot; returns its relative path."""
+    pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))  # High-res snapshot
+    image_filename = f"{pdf_name}_page{page_num}_snapshot.png"
+    image_path = os.path.join(page_output_dir, image_filename)
+    pix.save(image_path)
 
-            # Get image rectangle
-            try:
-                rect = page.get_image_rects(xref)[0]  # bounding box
-            except:
-                rect = None
+    # Store relative path
+    return os.path.relpath(image_path).replace("\\", "/")
 
-            caption_text = ""
-            if rect:
-                # Sort text blocks by vertical position
-                text_blocks_sorted = sorted(text_blocks, key=lambda b: b[1])  # y0
-                caption_candidates = []
-                for b in text_blocks_sorted:
-                    x0, y0, x1, y1, text, *_ = b
-                    # Text above or below image within ~100px
-                    if (y0 >= rect.y1 and y0 - rect.y1 < 100) or (rect.y0 - y1 < 100 and y1 <= rect.y0):
-                        caption_candidates.append(text)
-
-                caption_text = " ".join(caption_candidates[:caption_lines])
-
-            # Clean caption text
-            caption_text = re.sub(r"Figure\s*\d+[:.]?", "", caption_text, flags=re.IGNORECASE).strip()
-            caption_text = re.sub(r"\s{2,}", " ", caption_text)
-
-            # Save into map
-            caption_map.setdefault(page_index, []).append({
-                "image_path": os.path.relpath(image_path).replace("\\", "/"),
-                "caption_text": caption_text if caption_text else "No caption detected"
-            })
-
-    return caption_map
 
 def extract_full_page_images(pdf_path, page_output_dir=PAGE_IMAGES_DIR):
     """
@@ -367,12 +872,316 @@ def extract_full_page_images(pdf_path, page_output_dir=PAGE_IMAGES_DIR):
 
     for page_num in range(len(doc)):
         page = doc.load_page(page_num)
-        pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))  # High-res snapshot
-        image_filename = f"{pdf_name}_page{page_num+1}_snapshot.png"
-        image_path = os.path.join(page_output_dir, image_filename)
-        pix.save(image_path)
+        page_snapshot_map[page_num + 1] = render_page_snapshot(page, page_num + 1, pdf_name, page_output_dir)
+
+    return page_snapshot_map
+
+
+# ---------------- SINGLE-PASS EXTRACTION ----------------
+def _scan_page_range(pdf_path, first, last, images_output_dir, page_output_dir=None, caption_lines=3):
+    """
+    Work unit: open the PDF once and walk pages first..last, each page once, for
+    its raw text, text blocks, table-candidate flag, inline images (written to
+    `images_output_dir`) with caption candidates and, with `page_output_dir`,
+    its snapshot. Returns one dict per page, in page order; "images" are
+    store_image records, recorded in the image manifest by the caller.
+    """
+    doc = fitz.open(pdf_path)
+    pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
+    scans, seen = [], {}
+    for page_num in range(first, last + 1):
+        page = doc.load_page(page_num - 1)
+        blocks = page.get_text("blocks")  # (x0, y0, x1, y1, text, block_no, block_type)
+        text_blocks_sorted = sorted((b for b in blocks if b[4].strip()), key=lambda b: b[1])
+
+        images, captions = [], []
+        for img in page.get_images(full=True):
+            xref = img[0]
+            record = store_image(doc, xref, images_output_dir, seen)
+            image_path = record["image_path"]
+            try:
+                rect = page.get_image_rects(xref)[0]  # bounding box
+            except (IndexError, ValueError, RuntimeError):
+                rect = None
+            images.append(record)
+            captions.append({"image_path": image_path,
+                             "caption_text": _caption_text(text_blocks_sorted, rect, caption_lines)})
+
+        scans.append({
+            "page_num": page_num,
+            "text": page.get_text("text").strip(),
+            "blocks": [tuple(b[:5]) for b in blocks],
+            "table_candidate": table_candidate(page, blocks),
+            "images": images,
+            "captions": captions,
+            "snapshot": render_page_snapshot(page, page_num, pdf_name, page_output_dir) if page_output_dir else None,
+        })
+    return scans
+
+
+def extract_pdf_single_pass(pdf_path, images_output_dir, page_output_dir=PAGE_IMAGES_DIR, caption_lines=3,
+                            workers=PREPROCESS_WORKERS, pages_per_task=PAGES_PER_TASK, verbose=False):
+    """
+    Everything preprocessing needs from the PDF in one PyMuPDF walk over the
+    pages (instead of separate text, image, caption and snapshot passes):
+    page ranges are scanned on `workers` processes, Camelot then runs on the
+    table-candidate pages found by the same walk, and the pages are cleaned
+    as in extract_text_with_tables. Page text comes from PyMuPDF, not pypdf.
+    `page_output_dir=None` skips snapshots.
+
+    Returns:
+        dict with "pages" ([{page_num, content}], as extract_text_with_tables),
+        "image_map", "caption_map" and "page_snapshot_map" (as the
+        extract_images_* / extract_full_page_images functions), "blocks"
+        ({page_num: [(x0, y0, x1, y1, text)]}) and "summary".
+    """
+    os.makedirs(images_output_dir, exist_ok=True)
+    if page_output_dir:
+        os.makedirs(page_output_dir, exist_ok=True)
+    n_pages = len(fitz.open(pdf_path))
+    ranges = [(first, min(first + pages_per_task - 1, n_pages)) for first in range(1, n_pages + 1, pages_per_task)]
+    workers = min(workers, len(ranges))
+
+    start = time.perf_counter()
+    task_args = [(pdf_path, first, last, images_output_dir, page_output_dir, caption_lines) for first, last in ranges]
+    if workers <= 1:
+        results = [_scan_page_range(*args) for args in tqdm(task_args, desc="Scanning Pages")]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_scan_page_range, *args) for args in task_args]
+            results = [future.result() for future in tqdm(futures, desc="Scanning Pages")]
+    scans = [scan for result in results for scan in result]
+    manifest = ImageManifest(images_output_dir)
+    for scan in scans:
+        manifest.add(os.path.basename(pdf_path), scan["page_num"], scan["images"])
+    manifest.save()
+    scan_seconds = time.perf_counter() - start
+    print(f"[pdf_utils] scanned {len(scans)} pages in one pass in {scan_seconds:.1f}s "
+          f"({len(scans) / max(scan_seconds, 1e-9):.1f} pages/s, {max(workers, 1)} workers)")
+
+    candidates = {scan["page_num"]: scan["table_candidate"] for scan in scans if scan["table_candidate"]}
+    tables_by_page = read_candidate_tables(pdf_path, candidates, n_pages, None, workers or 1)
+
+    clean_args = [(scan["page_num"], scan["text"], tables_by_page.get(scan["page_num"], []), verbose)
+                  for scan in scans]
+    if workers <= 1:
+        cleaned = [_clean_page(*args) for args in clean_args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            cleaned = list(pool.map(_clean_page, *zip(*clean_args), chunksize=pages_per_task))
+
+    summary = {}
+    pages = list(summarize_changes(cleaned, summary))
+    logged = summary.pop("logged_pages", 0)
+    if logged:
+        print(f"[pdf_utils] pages changed per cleaning step ({logged} logged pages): {summary}")
+
+    return {
+        "pages": pages,
+        "image_map": {scan["page_num"]: [image["image_path"] for image in scan["images"]] for scan in scans},
+        "caption_map": {scan["page_num"]: scan["captions"] for scan in scans if scan["captions"]},
+        "page_snapshot_map": {scan["page_num"]: scan["snapshot"] for scan in scans if scan["snapshot"]},
+        "blocks": {scan["page_num"]: scan["blocks"] for scan in scans},
+        "summary": summary,
+    }
+
+
+# ---------------- INCREMENTAL PREPROCESSING ----------------
+# Per-page record of what each preprocessing stage produced, and from which inputs
+PAGE_MANIFEST_PATH = os.path.join(PROCESSED_TEXT_DIR, "page_manifest.json")
+STAGE_CACHE_DIR = os.path.join(PROCESSED_TEXT_DIR, "stage_cache")
+# Bump when a stage's output changes in a way its version hash below does not see
+TEXT_STAGE_VERSION = "pypdf-1"
+TABLE_STAGE_VERSION = "camelot-1"
+IMAGE_STAGE_VERSION = "sha1-store-captions-2"
+SNAPSHOT_STAGE_VERSION = "png-2x-1"
+
+
+def json_digest(*parts):
+    """sha1 of the JSON form of `parts` (tuples and lists hash alike)."""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _sources(*functions):
+    return [inspect.getsource(fn) for fn in functions]
+
+
+def text_stage_version():
+    import pypdf
+    return json_digest(TEXT_STAGE_VERSION, getattr(pypdf, "__version__", None))
+
+
+def table_stage_version():
+    return json_digest(TABLE_STAGE_VERSION, getattr(camelot, "__version__", None), TABLE_MIN_RULES,
+                       TABLE_MIN_ALIGNED_ROWS, TABLE_STREAM_MIN_COLUMNS, TABLE_STREAM_MIN_ACCURACY,
+                       TABLE_STREAM_MAX_WHITESPACE,
+                       _sources(_ruling_lines, _aligned_rows, table_candidate, _stream_table_ok,
+                                _read_page_tables, _table_text))
+
+
+def image_stage_version():
+    return json_digest(IMAGE_STAGE_VERSION, _sources(extract_page_captions, _caption_text))
+
+
+def clean_stage_version():
+    """Changes with the cleaning code, its patterns, heading_map or the contractions package."""
+    patterns = [p.pattern for _, p in _TITLE_PATTERNS + _HEADER_FOOTER_PATTERNS]
+    return json_digest(_sources(clean_text, standardize_headings, clean_text_fast, _sub_patterns, _cut_at_first,
+                                _clean_page),
+                       patterns, heading_map, _BIBLIO_WORDS, _KEY_TERMS_WORDS,
+                       getattr(contractions, "__version__", None))
+
+
+def page_fingerprints(pdf_path):
+    """
+    {page_num: sha1} of what a page is made of: its content streams, the raw
+    streams of the images it draws and its size. Equal fingerprints mean the
+    extraction stages would see the same page.
+    """
+    doc = fitz.open(pdf_path)
+    fingerprints = {}
+    for page_num, page in enumerate(doc, start=1):
+        digest = hashlib.sha1(page.read_contents())
+        for img in page.get_images(full=True):
+            digest.update(repr(img[1:]).encode("utf-8"))
+            digest.update(doc.xref_stream_raw(img[0]) or b"")
+        digest.update(repr(tuple(page.rect)).encode("utf-8"))
+        fingerprints[page_num] = digest.hexdigest()
+    return fingerprints
+
+
+def _raw_page_texts(pdf_path, page_nums):
+    """Work unit: {page_num: raw text} (pypdf, as _extract_page_range) of `page_nums`."""
+    from pypdf import PdfReader
+    reader = PdfReader(pdf_path)
+    return {page_num: (reader.pages[page_num - 1].extract_text() or "").strip() for page_num in page_nums}
+
+
+def extract_raw_texts(pdf_path, page_nums, workers=PREPROCESS_WORKERS, pages_per_task=PAGES_PER_TASK):
+    """{page_num: raw text} of `page_nums`, `pages_per_task` pages per task on `workers` processes."""
+    page_nums = sorted(page_nums)
+    groups = [page_nums[i:i + pages_per_task] for i in range(0, len(page_nums), pages_per_task)]
+    workers = min(workers, len(groups))
+    texts = {}
+    if workers <= 1:
+        for group in groups:
+            texts.update(_raw_page_texts(pdf_path, group))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for result in pool.map(_raw_page_texts, [pdf_path] * len(groups), groups):
+                texts.update(result)
+    return texts
+
+
+def clean_pages(page_args, workers=PREPROCESS_WORKERS, pages_per_task=PAGES_PER_TASK, verbose=False):
+    """_clean_page over [(page_num, raw text, table texts)] on `workers` processes; [(page, changed)]."""
+    clean_args = [(page_num, text, tables, verbose) for page_num, text, tables in page_args]
+    if min(workers, len(clean_args)) <= 1:
+        return [_clean_page(*args) for args in clean_args]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_clean_page, *zip(*clean_args), chunksize=pages_per_task))
+
+
+class PageManifest:
+    """
+    Per-page, per-stage record of preprocessing (<processed_text>/page_manifest.json):
+        {pdf_file: {"fingerprints": {page_num: sha1},
+                    "stages": {stage: {page_num: {"version", "input", "output"}}}}}
+    "input" hashes what the stage read for the page, "version" its code and settings,
+    and "output" is the sha1 of what it produced, stored once per content as
+    <stage cache>/<output>.json. A stage output is reused while its version and
+    input hash are unchanged and the stored output is still there.
+    """
+
+    def __init__(self, path=PAGE_MANIFEST_PATH, cache_dir=STAGE_CACHE_DIR):
+        self.path = path
+        self.cache_dir = cache_dir
+        self.documents = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.documents = json.load(f)
+
+    def _entries(self, pdf_file, stage):
+        return self.documents.setdefault(pdf_file, {}).setdefault("stages", {}).setdefault(stage, {})
+
+    def set_fingerprints(self, pdf_file, fingerprints):
+        """Record the current page fingerprints; entries of pages past the end are dropped."""
+        document = self.documents.setdefault(pdf_file, {})
+        document["fingerprints"] = {str(page_num): sha1 for page_num, sha1 in fingerprints.items()}
+        for entries in document.get("stages", {}).values():
+            for page_num in [p for p in entries if p not in document["fingerprints"]]:
+                del entries[page_num]
+
+    def output_hash(self, pdf_file, page_num, stage):
+        entry = self._entries(pdf_file, stage).get(str(page_num))
+        return entry["output"] if entry else None
+
+    def _object_path(self, output_hash):
+        return os.path.join(self.cache_dir, f"{output_hash}.json")
+
+    def lookup(self, pdf_file, page_num, stage, version, input_hash):
+        """Cached output of `stage` for the page, or None when it has to be recomputed."""
+        entry = self._entries(pdf_file, stage).get(str(page_num))
+        if not entry or entry["version"] != version or entry["input"] != input_hash:
+            return None
+        try:
+            with open(self._object_path(entry["output"]), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def record(self, pdf_file, page_num, stage, version, input_hash, output):
+        """Store `output` (JSON-serializable) and point the page's stage entry at it."""
+        output_hash = json_digest(output)
+        path = self._object_path(output_hash)
+        if not os.path.exists(path):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(output, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        self._entries(pdf_file, stage)[str(page_num)] = {"version": version, "input": input_hash,
+                                                         "output": output_hash}
+        return output_hash
+
+    def run_stage(self, pdf_file, stage, version, inputs, compute, valid=None):
+        """
+        {page_num: output} of `stage` for every page of `inputs` ({page_num: input hash}).
+        Cached outputs are reused (when `valid(output)` holds, if given); the rest
+        come from `compute(page_nums)` -> {page_num: output} and are recorded.
+        """
+        outputs, todo = {}, []
+        for page_num, input_hash in inputs.items():
+            output = self.lookup(pdf_file, page_num, stage, version, input_hash)
+            if output is None or (valid is not None and not valid(output)):
+                todo.append(page_num)
+            else:
+                outputs[page_num] = output
+
+        start = time.perf_counter()
+        computed = compute(todo) if todo else {}
+        for page_num in todo:
+            outputs[page_num] = computed[page_num]
+            self.record(pdf_file, page_num, stage, version, inputs[page_num], computed[page_num])
+        print(f"[pdf_utils] {stage}: {len(todo)} pages recomputed in {time.perf_counter() - start:.1f}s, "
+              f"{len(inputs) - len(todo)} reused")
+        return outputs
 
-        # Store relative path
-        page_snapshot_map[page_num + 1] = os.path.relpath(image_path).replace("\\", "/")
+    def save(self):
+        """Write the manifest and delete stored outputs no entry points at any more."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.documents, f, indent=2)
+        os.replace(tmp_path, self.path)
 
-    return page_snapshot_map
\ No newline at end of file
+        live = {entry["output"] for document in self.documents.values()
+                for entries in document.get("stages", {}).values() for entry in entries.values()}
+        removed = 0
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".json") and name[:-len(".json")] not in live:
+                    os.remove(os.path.join(self.cache_dir, name))
+                    removed += 1
+        print(f"[pdf_utils] page manifest saved ({self.path}); {len(live)} stage outputs cached, "
+              f"{removed} stale removed")
@@ -1,12 +1,38 @@
 import os
+import sys
+import glob
 import json
+import time
+import inspect
+import argparse
+import fitz
 import nltk
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from pdf_utils import (
     extract_text_with_tables,
-    extract_images_pymupdf,
+    extract_pdf_single_pass,
+    page_fingerprints,
+    PageManifest,
+    json_digest,
+    text_stage_version,
+    table_stage_version,
+    clean_stage_version,
+    extract_raw_texts,
+    detect_table_pages,
+    read_candidate_tables,
+    clean_pages,
+    PREPROCESS_WORKERS,
+    image_stage_version,
+    SNAPSHOT_STAGE_VERSION,
+    iter_text_with_tables,
+    summarize_changes,
+    extract_page_captions,
+    ImageManifest,
+    remove_legacy_images,
     extract_images_with_captions,
-    extract_full_page_images
+    extract_full_page_images,
+    render_page_snapshot,
+    assign_section
 )
 
 # Get project root dynamically (3 levels up from current file)
@@ -21,26 +47,19 @@ IMAGE_PATH = os.path.join(DATA_DIR, "images")
 IMAGE_CAPTIONS_DIR = os.path.join(DATA_DIR, "image_with_captions")
 pdf_path = os.path.join(RAW_PDF_DIR, "medical_book.pdf")
 OUTPUT_JSON_PATH = os.path.join(PROCESSED_TEXT_DIR, "chunks_metadata.json")
+OUTPUT_JSONL_PATH = os.path.join(PROCESSED_TEXT_DIR, "chunks_metadata.jsonl")
+CORPUS_DIR = os.getenv("CORPUS_DIR", os.path.join(DATA_DIR, "corpus"))
 
 os.makedirs(PROCESSED_TEXT_DIR, exist_ok=True)
 
 # ---------------- CHUNKING ----------------
-def chunk_combined_content(pages_data, pdf_path, chunk_size=800, overlap=50, mode="recursive"):
+def iter_page_chunks(pages_data, pdf_path, chunk_size=800, overlap=50, mode="recursive"):
     """
-    Chunk combined text (text + tables) into smaller parts.
-    
-    Args:
-        pages_data (list): Extracted pages with combined text/tables.
-        pdf_path (str): Path to the PDF file.
-        chunk_size (int): Size of each chunk (only for recursive).
-        overlap (int): Overlap between chunks (only for recursive).
-        mode (str): "recursive" or "sentence".
-        
-    Returns:
-        list: List of chunk metadata dictionaries.
+    Yield the chunks of each page as the pages come in (`pages_data` can be a
+    generator, e.g. pdf_utils.iter_text_with_tables). Chunks are not section-tagged;
+    see chunk_combined_content for the arguments.
     """
-    formatted_chunks = []
-
+    pdf_file = os.path.basename(pdf_path)
     if mode == "recursive":
         # Recursive character splitter
         splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=overlap)
@@ -48,13 +67,13 @@ def chunk_combined_content(pages_data, pdf_path, chunk_size=800, overlap=50, mod
         for page in pages_data:
             chunks = splitter.split_text(page["content"])
             for i, chunk in enumerate(chunks):
-                formatted_chunks.append({
+                yield {
                     "chunk_id": f"{page['page_num']}_{i}",
                     "page_num": page["page_num"],
                     "content": chunk.strip(),
-                    "pdf_file": os.path.basename(pdf_path),
+                    "pdf_file": pdf_file,
                     "images": []
-                })
+                }
 
     elif mode == "sentence":
         # Sentence splitting with merging short sentences
@@ -67,46 +86,83 @@ def chunk_combined_content(pages_data, pdf_path, chunk_size=800, overlap=50, mod
                     buffer += " " + sentence
                 else:
                     if buffer:
-                        formatted_chunks.append({
+                        yield {
                             "chunk_id": f"{page['page_num']}_{i}",
                             "page_num": page["page_num"],
                             "content": buffer.strip(),
-                            "pdf_file": os.path.basename(pdf_path),
+                            "pdf_file": pdf_file,
                             "images": []
-                        })
+                        }
                     buffer = sentence
             if buffer:
-                formatted_chunks.append({
+                yield {
                     "chunk_id": f"{page['page_num']}_{len(sentences)}",
                     "page_num": page["page_num"],
                     "content": buffer.strip(),
-                    "pdf_file": os.path.basename(pdf_path),
+                    "pdf_file": pdf_file,
                     "images": []
-                })
+                }
 
     else:
         raise ValueError("Invalid mode. Use 'recursive' or 'sentence'.")
 
-    return formatted_chunks
 
-# ---------------- MERGE TEXT + IMAGES ----------------
-def merge_text_and_images_with_captions(chunks, image_map, page_snapshot_map, 
-                                        # caption_map
-                                        ):
+def chunk_combined_content(pages_data, pdf_path, chunk_size=800, overlap=50, mode="recursive"):
     """
-    Add extracted images, page snapshots, and captions to chunks.
+    Chunk combined text (text + tables) into smaller parts.
+    
+    Args:
+        pages_data (list): Extracted pages with combined text/tables.
+        pdf_path (str): Path to the PDF file.
+        chunk_size (int): Size of each chunk (only for recursive).
+        overlap (int): Overlap between chunks (only for recursive).
+        mode (str): "recursive" or "sentence".
+        
+    Returns:
+        list: List of chunk metadata dictionaries.
     """
+    return tag_chunk_sections(list(iter_page_chunks(pages_data, pdf_path, chunk_size, overlap, mode)))
+
+# ---------------- SECTION TAGGING ----------------
+def iter_tagged_sections(chunks):
+    """Generator form of tag_chunk_sections: tags and yields chunks one at a time."""
+    current_section = None
     for chunk in chunks:
-        page_num = chunk["page_num"]
+        chunk["section"], current_section = assign_section(chunk["content"], current_section)
+        yield chunk
+
+
+def tag_chunk_sections(chunks):
+    """
+    Tag each chunk with its standardized section (Definition/Causes/Diagnosis/Treatment
+    or None). The section carries over from chunk to chunk until the next heading.
+    """
+    for _ in iter_tagged_sections(chunks):
+        pass
+    return chunks
+
+# ---------------- MERGE TEXT + IMAGES ----------------
+def attach_images(chunk, image_map, page_snapshot_map, caption_map=None):
+    """Set one chunk's inline images, page snapshot and image captions from the per-page maps."""
+    page_num = chunk["page_num"]
+
+    # Add inline figure images
+    chunk["images"] = [path.replace("\\", "/") for path in image_map.get(page_num, [])]
 
-        # Add inline figure images
-        chunk["images"] = [path.replace("\\", "/") for path in image_map.get(page_num, [])]
+    # Add page snapshot
+    chunk["page_snapshot"] = page_snapshot_map.get(page_num)
 
-        # Add page snapshot
-        chunk["page_snapshot"] = page_snapshot_map.get(page_num)
+    # Add captions (list of {image_path, caption_text}); copies, the caption index numbers them per chunk
+    chunk["captions"] = [dict(caption) for caption in (caption_map or {}).get(page_num, [])]
+    return chunk
 
-        # Add captions (list of {image_path, caption_text})
-        # chunk["captions"] = caption_map.get(page_num, [])
+
+def merge_text_and_images_with_captions(chunks, image_map, page_snapshot_map, caption_map=None):
+    """
+    Add extracted images, page snapshots, and captions to chunks.
+    """
+    for chunk in chunks:
+        attach_images(chunk, image_map, page_snapshot_map, caption_map)
 
     return chunks
 
@@ -120,16 +176,233 @@ def save_chunks_to_json(final_data, output_path=OUTPUT_JSON_PATH):
         json.dump(final_data, f, ensure_ascii=False, indent=4)
     print(f"Saved chunks metadata to: {output_path}")
 
+# ---------------- STREAMING PIPELINE ----------------
+def write_chunks_jsonl(chunks, output_path=OUTPUT_JSONL_PATH):
+    """
+    Append each chunk to a JSON-lines file as it passes through (one line per
+    chunk, nothing buffered), then yield it on. The file is written as
+    <output_path>.tmp and renamed once the last chunk is through.
+    """
+    tmp_path = output_path + ".tmp"
+    n_chunks = 0
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for chunk in chunks:
+            f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+            n_chunks += 1
+            yield chunk
+    os.replace(tmp_path, output_path)
+    print(f"Saved {n_chunks} chunks to: {output_path}")
+
+
+def iter_pipeline_chunks(pdf_path, chunk_size=600, overlap=50, mode="sentence", summary=None,
+                         prerender_snapshots=False):
+    """
+    Pages -> cleaned text -> chunks, as a generator. Text is extracted and
+    cleaned on the process pool a few page ranges ahead; each page's images
+    and their captions (and, with `prerender_snapshots`, its snapshot) are
+    written when the page comes through, and its chunks are yielded right
+    away. Extraction and chunking hold only the pages in flight, not the book.
+    """
+    doc = fitz.open(pdf_path)
+    pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
+    os.makedirs(IMAGE_PATH, exist_ok=True)
+    os.makedirs(PAGE_IMAGES_DIR, exist_ok=True)
+    seen, manifest = {}, ImageManifest(IMAGE_PATH)
+
+    def page_chunks():
+        for page in summarize_changes(iter_text_with_tables(pdf_path), {} if summary is None else summary):
+            page_num = page["page_num"]
+            pdf_page = doc.load_page(page_num - 1)
+            captions = extract_page_captions(doc, pdf_page, page_num, pdf_path, IMAGE_PATH, seen, manifest)
+            image_map = {page_num: [c["image_path"] for c in captions]}
+            caption_map = {page_num: captions}
+            page_snapshot_map = ({page_num: render_page_snapshot(pdf_page, page_num, pdf_name, PAGE_IMAGES_DIR)}
+                                 if prerender_snapshots else {})
+            for chunk in iter_page_chunks([page], pdf_path, chunk_size, overlap, mode):
+                yield attach_images(chunk, image_map, page_snapshot_map, caption_map)
+
+    # Sections carry over from page to page, so tagging runs over the whole stream
+    yield from iter_tagged_sections(page_chunks())
+    manifest.save()
+
+
+def run_streaming_pipeline(pdf_path, output_path=OUTPUT_JSONL_PATH, build_index=True, workers=None,
+                           **chunk_args):
+    """
+    End-to-end streaming ingestion: chunks from iter_pipeline_chunks are appended
+    to `output_path` (JSON lines) and, with `build_index`, fed straight into
+    embed_store.create_faiss_index, so embedding starts with the first pages
+    while later ones are still being extracted. Extraction and chunking hold
+    only the pages in flight; the index build spools chunks and vectors to
+    disk and writes the chunk store, BM25 index and chunk vectors row by row.
+    """
+    chunks = write_chunks_jsonl(iter_pipeline_chunks(pdf_path, **chunk_args), output_path)
+    if not build_index:
+        return {"n_chunks": sum(1 for _ in chunks)}
+
+    # Run as a script (Src/rag on sys.path): make the Src package importable too
+    if BASE_DIR not in sys.path:
+        sys.path.insert(0, BASE_DIR)
+    from Src.rag.embed_store import create_faiss_index
+    return create_faiss_index(chunks=chunks, chunks_path=output_path, workers=workers)
+
+
+# ---------------- INCREMENTAL PIPELINE ----------------
+def chunk_stage_version(chunk_size, overlap, mode):
+    return json_digest(chunk_size, overlap, mode, inspect.getsource(iter_page_chunks))
+
+
+def run_incremental_pipeline(pdf_path, output_path=OUTPUT_JSON_PATH, chunk_size=600, overlap=50, mode="sentence",
+                             prerender_snapshots=False, workers=PREPROCESS_WORKERS, manifest=None):
+    """
+    The default pipeline (same chunks_metadata.json), but each stage only runs
+    on pages whose inputs or stage version changed since the last run, per the
+    page manifest (pdf_utils.PageManifest):
+
+        text, tables, images, snapshot   input: page fingerprint (content + image streams)
+        clean                            input: text + tables outputs; version: cleaning code, heading_map
+        chunks                           input: clean output; version: chunk_size / overlap / mode, chunker code
+
+    Editing a cleaning rule re-cleans and re-chunks every page but reuses the
+    extracted text, tables and images; a changed page redoes its own stages only.
+    Section tagging and image attachment are cheap and run over all chunks.
+    """
+    start = time.perf_counter()
+    pdf_file = os.path.basename(pdf_path)
+    pdf_name = os.path.splitext(pdf_file)[0]
+    manifest = manifest or PageManifest()
+    fingerprints = page_fingerprints(pdf_path)
+    manifest.set_fingerprints(pdf_file, fingerprints)
+    pages = sorted(fingerprints)
+
+    texts = manifest.run_stage(pdf_file, "text", text_stage_version(), fingerprints,
+                               lambda todo: extract_raw_texts(pdf_path, todo, workers))
+
+    def read_tables(todo):
+        prepass_start = time.perf_counter()
+        candidates = detect_table_pages(pdf_path, todo)
+        tables_by_page = read_candidate_tables(pdf_path, candidates, len(todo),
+                                               time.perf_counter() - prepass_start, workers)
+        return {page_num: tables_by_page.get(page_num, []) for page_num in todo}
+
+    tables = manifest.run_stage(pdf_file, "tables", table_stage_version(), fingerprints, read_tables)
+
+    summary = {}
+
+    def clean(todo):
+        cleaned = clean_pages([(page_num, texts[page_num], tables[page_num]) for page_num in todo], workers)
+        return {page["page_num"]: page["content"] for page in summarize_changes(cleaned, summary)}
+
+    clean_inputs = {page_num: json_digest(manifest.output_hash(pdf_file, page_num, "text"),
+                                          manifest.output_hash(pdf_file, page_num, "tables"))
+                    for page_num in pages}
+    contents = manifest.run_stage(pdf_file, "clean", clean_stage_version(), clean_inputs, clean)
+    logged = summary.pop("logged_pages", 0)
+    if logged:
+        print(f"[preprocess] pages changed per cleaning step ({logged} logged pages): {summary}")
+
+    def chunk(todo):
+        page_chunks = {page_num: [] for page_num in todo}
+        page_data = ({"page_num": page_num, "content": contents[page_num]} for page_num in todo)
+        for c in iter_page_chunks(page_data, pdf_path, chunk_size, overlap, mode):
+            page_chunks[c["page_num"]].append(c)
+        return page_chunks
+
+    chunk_inputs = {page_num: manifest.output_hash(pdf_file, page_num, "clean") for page_num in pages}
+    chunks_by_page = manifest.run_stage(pdf_file, "chunks", chunk_stage_version(chunk_size, overlap, mode),
+                                        chunk_inputs, chunk)
+
+    doc = fitz.open(pdf_path)
+    os.makedirs(IMAGE_PATH, exist_ok=True)
+    image_manifest = ImageManifest(IMAGE_PATH)
+
+    def extract_images(todo):
+        seen = {}
+        return {page_num: extract_page_captions(doc, doc.load_page(page_num - 1), page_num, pdf_path, IMAGE_PATH,
+                                                seen, image_manifest)
+                for page_num in todo}
+
+    # Stage output per page: [{image_path, caption_text}] (the page's images, in order)
+    caption_map = manifest.run_stage(pdf_file, "images", image_stage_version(), fingerprints, extract_images,
+                                     valid=lambda captions: all(os.path.exists(c["image_path"]) for c in captions))
+    image_map = {page_num: [c["image_path"] for c in captions] for page_num, captions in caption_map.items()}
+    image_manifest.save()
+
+    page_snapshot_map = {}
+    if prerender_snapshots:
+        os.makedirs(PAGE_IMAGES_DIR, exist_ok=True)
+        page_snapshot_map = manifest.run_stage(
+            pdf_file, "snapshot", SNAPSHOT_STAGE_VERSION, fingerprints,
+            lambda todo: {page_num: render_page_snapshot(doc.load_page(page_num - 1), page_num, pdf_name,
+                                                         PAGE_IMAGES_DIR)
+                          for page_num in todo},
+            valid=os.path.exists)
+
+    text_chunks = tag_chunk_sections([c for page_num in pages for c in chunks_by_page[page_num]])
+    final_data = merge_text_and_images_with_captions(text_chunks, image_map, page_snapshot_map, caption_map)
+    save_chunks_to_json(final_data, output_path)
+    manifest.save()
+    print(f"[preprocess] incremental run: {len(pages)} pages, {len(final_data)} chunks in "
+          f"{time.perf_counter() - start:.1f}s")
+    return final_data
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract, clean and chunk the PDF")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream pages -> chunks -> chunks_metadata.jsonl -> FAISS index")
+    parser.add_argument("--no-index", action="store_true", help="with --stream: only write the chunk file")
+    parser.add_argument("--workers", type=int, default=None, help="with --stream: encoder processes")
+    parser.add_argument("--single-pass", action="store_true",
+                        help="one PyMuPDF walk per page for text, images, captions and snapshots")
+    parser.add_argument("--prerender-snapshots", action="store_true",
+                        help="render every page to Artifacts/page_images (default: the API renders snapshots "
+                             "on demand, see Src/rag/snapshots.py)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="recompute only pages whose inputs or stage versions changed "
+                             "(Artifacts/processed_text/page_manifest.json)")
+    parser.add_argument("--remove-legacy-images", action="store_true",
+                        help="only delete old <pdf>_page<N>_img<M> files in Artifacts/images that no chunk "
+                             "file, chunk store, metadata.pkl or shard references any more")
+    args = parser.parse_args()
     pdf_path = "Artifacts/raw_pdf/medical_book.pdf"
 
+    if args.remove_legacy_images:
+        # Chunk stores are read through the Src package
+        if BASE_DIR not in sys.path:
+            sys.path.insert(0, BASE_DIR)
+        chunk_files = [OUTPUT_JSON_PATH, OUTPUT_JSONL_PATH, os.path.join(EMBEDDINGS_DIR, "metadata.pkl"),
+                       os.path.join(EMBEDDINGS_DIR, "chunk_store"),
+                       *glob.glob(os.path.join(CORPUS_DIR, "shards", "*", "metadata.pkl")),
+                       *glob.glob(os.path.join(CORPUS_DIR, "shards", "*", "chunk_store"))]
+        remove_legacy_images(IMAGE_PATH, chunk_files)
+        sys.exit(0)
+
+    if args.incremental:
+        run_incremental_pipeline(pdf_path, chunk_size=600, mode="sentence",
+                                 prerender_snapshots=args.prerender_snapshots)
+        sys.exit(0)
+
+    if args.stream:
+        run_streaming_pipeline(pdf_path, build_index=not args.no_index, workers=args.workers,
+                               chunk_size=600, mode="sentence", prerender_snapshots=args.prerender_snapshots)
+        sys.exit(0)
+
+    if args.single_pass:
+        outputs = extract_pdf_single_pass(pdf_path, IMAGE_PATH,
+                                          PAGE_IMAGES_DIR if args.prerender_snapshots else None)
+        text_chunks = chunk_combined_content(outputs["pages"], pdf_path, chunk_size=600, mode="sentence")
+        final_data = merge_text_and_images_with_captions(text_chunks, outputs["image_map"],
+                                                         outputs["page_snapshot_map"], outputs["caption_map"])
+        save_chunks_to_json(final_data, OUTPUT_JSON_PATH)
+        sys.exit(0)
+
     combined_pages, logs = extract_text_with_tables(pdf_path)
     text_chunks = chunk_combined_content(combined_pages, pdf_path, chunk_size=600, mode="sentence")
-    image_map = extract_images_pymupdf(pdf_path, IMAGE_PATH)
-    # caption_map = extract_images_with_captions(pdf_path)
-    page_snapshot_map = extract_full_page_images(pdf_path)
+    # Images and their captions in one walk, stored with the other extracted images
+    caption_map = extract_images_with_captions(pdf_path, IMAGE_PATH)
+    image_map = {page_num: [c["image_path"] for c in captions] for page_num, captions in caption_map.items()}
+    page_snapshot_map = extract_full_page_images(pdf_path) if args.prerender_snapshots else {}
 
-    final_data = merge_text_and_images_with_captions(text_chunks, image_map, page_snapshot_map, 
-                                                    #  caption_map
-                                                     )
+    final_data = merge_text_and_images_with_captions(text_chunks, image_map, page_snapshot_map, caption_map)
     save_chunks_to_json(final_data, OUTPUT_JSON_PATH)
@@ -1,8 +1,12 @@
 # Src/rag/rag_pipeline.py
 
 from huggingface_hub import InferenceClient
-from Src.rag.retriever import retrieve_top_k
+from Src.rag.retriever import (retrieve_top_k, encode_queries, relevant_images_for_results,
+                               corpus_fingerprint, CACHE_DIR)
+from Src.rag.answer_cache import SemanticAnswerCache, chunk_set_key
+from Src.rag.snapshots import get_snapshot_cache, snapshot_url
 import os
+import threading
 
 # Get project root dynamically (3 levels up from current file)
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
@@ -12,8 +16,38 @@ RAW_PDF_DIR = os.path.join(DATA_DIR, "raw_pdf")
 PROCESSED_TEXT_DIR = os.path.join(DATA_DIR, "processed_text")
 EMBEDDINGS_DIR = os.path.join(DATA_DIR, "embeddings")
 PAGE_IMAGES_DIR = os.path.join(DATA_DIR, "page_images")
-
-def generate_answer_multimodal(query, retrieved_chunks, model="google/gemma-3-27b-it", hf_token=None):
+ANSWER_CACHE_PATH = os.path.join(CACHE_DIR, "answer_cache.db")
+
+LLM_MODEL = "google/gemma-3-27b-it"
+
+# Semantic answer cache (same retrieved chunks + similar query -> reuse the LLM answer)
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", str(7 * 24 * 3600)))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "5000"))
+# Count referenced pages for `python -m Src.rag.snapshots prewarm`
+SNAPSHOT_REFERENCE_COUNTS = os.getenv("SNAPSHOT_REFERENCE_COUNTS", "1") == "1"
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """Lazily open the shared SQLite-backed answer cache."""
+    global _answer_cache
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = SemanticAnswerCache(
+                    ANSWER_CACHE_PATH,
+                    threshold=ANSWER_CACHE_THRESHOLD,
+                    ttl_seconds=ANSWER_CACHE_TTL,
+                    max_entries=ANSWER_CACHE_SIZE,
+                )
+    return _answer_cache
+
+
+def generate_answer_multimodal(query, retrieved_chunks, model=LLM_MODEL, hf_token=None):
     context_text = "\n\n".join([
         f"--- Page {c['page_num']} ---\nText:\n{c['content']}" for c in retrieved_chunks
     ])
@@ -100,9 +134,39 @@ User Question:
 
     return response.choices[0].message["content"]
 
-def rag_query_multimodal(query, k=5, hf_token=None):
-    retrieved = retrieve_top_k(query, k=k)
+def _cached_answer(query, retrieved, hf_token=None):
+    """Return (answer, "hit"|"miss") using the semantic answer cache around the LLM call."""
+    cache = get_answer_cache()
+    query_vec = encode_queries([query])[0]  # served from the query-embedding cache
+    chunk_ids = [cid for r in retrieved for cid in r.get("chunk_ids", [])]
+    key = chunk_set_key(chunk_ids, namespace=f"{LLM_MODEL}|{corpus_fingerprint()}")
+
+    answer = cache.lookup(query_vec, key)
+    if answer is not None:
+        return answer, "hit"
+
     answer = generate_answer_multimodal(query, retrieved, hf_token=hf_token)
+    if answer and answer.strip():
+        cache.store(query, query_vec, key, answer)
+    return answer, "miss"
+
+def rag_query_multimodal(query, k=5, hf_token=None, mode=None, return_meta=False,
+                         section=None, pages=None, document=None):
+    """
+    Retrieve + answer. Returns (answer, references), or (answer, references, meta)
+    with meta = {"cache": "hit" | "miss" | "off"} when return_meta=True.
+    section/pages/document restrict retrieval (and so the prompt) to matching chunks.
+    """
+    retrieved = retrieve_top_k(query, k=k, mode=mode, section=section, pages=pages, document=document)
+    if ANSWER_CACHE_ENABLED and retrieved:
+        answer, cache_status = _cached_answer(query, retrieved, hf_token=hf_token)
+    else:
+        answer, cache_status = generate_answer_multimodal(query, retrieved, hf_token=hf_token), "off"
+
+    # One caption-index search over the retrieved chunks (query vector comes from the cache)
+    caption_images = {}
+    if retrieved:
+        caption_images = relevant_images_for_results(encode_queries([query])[0], retrieved)
 
     references = []
     for r in retrieved:
@@ -112,7 +176,15 @@ def rag_query_multimodal(query, k=5, hf_token=None):
             "link": r["link"],
             "snippet": r["snippet"],
             "page_snapshot": r.get("page_snapshot"),
-            "images": relevant_images
+            # Rendered on first request, see Src/rag/snapshots.py
+            "snapshot_url": snapshot_url(r["pdf_file"], r["page_num"]) if r.get("pdf_file") else None,
+            "images": relevant_images,
+            "caption_images": caption_images.get(r["page_num"], [])
         })
 
+    if SNAPSHOT_REFERENCE_COUNTS and retrieved:
+        get_snapshot_cache().record_references((r.get("pdf_file"), r["page_num"]) for r in retrieved)
+
+    if return_meta:
+        return answer, references, {"cache": cache_status}
     return answer, references
@@ -0,0 +1,140 @@
+# Src/rag/rerank.py
+"""
+Two-stage retrieval helpers: a cheap binary first stage and a latency-budgeted re-rank.
+
+Stage 1 over-fetches candidates from a binary index (sign bit per dimension,
+384 bits = 48 bytes per chunk, Hamming distance), which is 32x smaller than
+float32 and very fast to scan.
+Stage 2 re-scores candidates in first-stage order, one batch at a time, with
+either the exact cosine (float16 chunk vectors) or a cross-encoder. It stops
+before a batch that would exceed the per-request budget; unscored candidates
+keep their first-stage order behind the scored ones.
+"""
+import time
+import faiss
+import numpy as np
+
+RERANK_SCORERS = ("exact", "cross_encoder")
+
+
+def binarize(embeddings):
+    """float vectors -> packed sign bits (uint8, dim / 8 bytes per row)."""
+    return np.packbits(np.asarray(embeddings) > 0, axis=1)
+
+
+def build_binary_index(embeddings, index_path, ids=None, batch_size=65536):
+    """
+    Write an IndexBinaryFlat over the sign bits of `embeddings` (row id = chunk row).
+    With `ids` (stable chunk rows of an incremental build) it is wrapped in an IndexBinaryIDMap.
+    `embeddings` may be a memmap: it is binarized `batch_size` rows at a time.
+    """
+    n, dimension = embeddings.shape
+    index = faiss.IndexBinaryFlat((dimension + 7) // 8 * 8)
+    if ids is not None:
+        index = faiss.IndexBinaryIDMap(index)
+        ids = np.asarray(ids, dtype=np.int64)
+    for start in range(0, n, batch_size):
+        codes = binarize(embeddings[start:start + batch_size])
+        if ids is None:
+            index.add(codes)
+        else:
+            index.add_with_ids(codes, ids[start:start + batch_size])
+    faiss.write_index_binary(index, index_path)
+    return index
+
+
+def read_binary_index(index_path):
+    try:
+        return faiss.read_index_binary(index_path, faiss.IO_FLAG_MMAP)
+    except RuntimeError:
+        return faiss.read_index_binary(index_path)
+
+
+def binary_search(index, query_vecs, k, bitmap=None):
+    """Hamming top-k rows per query (-1 padded), restricted to `bitmap` rows when given."""
+    codes = binarize(query_vecs)
+    if bitmap is None:
+        return index.search(codes, k)[1]
+    # n is the bitmap length in bytes; ids past the end are treated as not set
+    selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+    try:
+        return index.search(codes, k, params=faiss.SearchParameters(sel=selector))[1]
+    except RuntimeError:
+        pass
+
+    # Binary index without search params in this FAISS release: rank all rows, keep allowed ones
+    indices = index.search(codes, max(index.ntotal, k))[1]
+    allowed = np.unpackbits(bitmap, bitorder="little").astype(bool)
+    out = np.full((len(codes), k), -1, dtype=np.int64)
+    for row, row_i in enumerate(indices):
+        keep = (row_i >= 0) & (row_i < len(allowed))
+        keep[keep] = allowed[row_i[keep]]
+        row_i = row_i[keep][:k]
+        out[row, :len(row_i)] = row_i
+    return out
+
+
+# ---------------- SCORERS ----------------
+class ExactScorer:
+    """Cosine against stored (unit-normalized) chunk vectors."""
+    name = "exact"
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def score(self, query, query_vec, rows):
+        return np.asarray(self.vectors[rows], dtype=np.float32) @ np.asarray(query_vec, dtype=np.float32)
+
+
+class CrossEncoderScorer:
+    """Cross-encoder relevance of (query, chunk text); `text_fn(row)` returns the chunk text."""
+    name = "cross_encoder"
+
+    def __init__(self, model_path, text_fn):
+        # Imported here: torch + sentence_transformers dominate import time
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_path)
+        self.text_fn = text_fn
+
+    def score(self, query, query_vec, rows):
+        pairs = [(query, self.text_fn(int(row))) for row in rows]
+        return np.asarray(self.model.predict(pairs, convert_to_numpy=True), dtype=np.float32)
+
+
+# ---------------- RE-RANK ----------------
+def budgeted_rerank(query, query_vec, rows, scorer, budget_ms, batch_size=16):
+    """
+    Score `rows` (first-stage order) with `scorer` until the budget runs out.
+
+    The first batch is always scored; after that a batch is only started when
+    the time spent so far plus the slowest batch so far fits in the budget.
+
+    Returns:
+        (order, scores, info): rows re-ordered (scored by score desc, then the
+        unscored rest in first-stage order), their scores (NaN = unscored) and
+        {"scored", "candidates", "elapsed_ms", "budget_exhausted"}.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    scores = np.full(len(rows), np.nan, dtype=np.float32)
+    start = time.perf_counter()
+    slowest = 0.0
+    scored = 0
+    while scored < len(rows):
+        elapsed = (time.perf_counter() - start) * 1000
+        if scored and elapsed + slowest > budget_ms:
+            break
+        batch_start = time.perf_counter()
+        batch = rows[scored:scored + batch_size]
+        scores[scored:scored + len(batch)] = scorer.score(query, query_vec, batch)
+        slowest = max(slowest, (time.perf_counter() - batch_start) * 1000)
+        scored += len(batch)
+
+    ranked = np.argsort(-scores[:scored], kind="stable")
+    order = np.concatenate([ranked, np.arange(scored, len(rows))]).astype(np.int64)
+    info = {
+        "scored": int(scored),
+        "candidates": int(len(rows)),
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+        "budget_exhausted": bool(scored < len(rows)),
+    }
+    return rows[order], scores[order], info
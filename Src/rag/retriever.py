@@ -1,10 +1,23 @@
 import faiss
+import heapq
+import hashlib
 import pickle
+import threading
+import time
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from numpy.linalg import norm
 
 import os
+from Src.rag.chunk_store import ChunkStore, chunk_store_exists, pack_mask, unpack_bitmap
+from Src.rag.index_factory import load_index_config, apply_search_params, search_parameters
+from Src.rag.embedding_cache import EmbeddingCache, model_fingerprint
+from Src.rag.lexical_index import BM25Index, bm25_index_exists
+from Src.rag.caption_index import CaptionIndex, caption_index_exists
+from Src.rag.shards import ShardRegistry, ShardSet, REGISTRY_PATH
+from Src.rag.encoders import EMBED_BACKEND, load_encoder
+from Src.rag.embedding_service import EMBED_SERVICE_SOCKET, EmbeddingServiceClient, service_available
+from Src.rag.rerank import (RERANK_SCORERS, ExactScorer, CrossEncoderScorer, budgeted_rerank,
+                            binary_search, read_binary_index)
 
 # Get project root dynamically (3 levels up from current file)
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
@@ -16,82 +29,725 @@ EMBEDDINGS_DIR = os.path.join(DATA_DIR, "embeddings")
 PAGE_IMAGES_DIR = os.path.join(DATA_DIR, "page_images")
 FAISS_INDEX_PATH = os.path.join(EMBEDDINGS_DIR, "faiss_index.bin")
 METADATA_PATH = os.path.join(EMBEDDINGS_DIR, "metadata.pkl")
+CACHE_DIR = os.path.join(DATA_DIR, "cache")
+CHUNK_STORE_DIR = os.path.join(EMBEDDINGS_DIR, "chunk_store")
+BM25_INDEX_DIR = os.path.join(EMBEDDINGS_DIR, "bm25")
+CAPTION_INDEX_DIR = os.path.join(EMBEDDINGS_DIR, "captions")
+CHUNK_VECTORS_PATH = os.path.join(EMBEDDINGS_DIR, "chunk_vectors.npy")
+BINARY_INDEX_PATH = os.path.join(EMBEDDINGS_DIR, "binary_index.bin")
+EMBED_MODEL_PATH = os.getenv("EMBED_MODEL_PATH", "/app/models/all-MiniLM-L6-v2")
+# EMBED_MODEL_PATH = "models/all-MiniLM-L6-v2"
 PDF_DIR = RAW_PDF_DIR
 
-# Load index & metadata
-index = faiss.read_index(FAISS_INDEX_PATH)
-with open(METADATA_PATH, "rb") as f:
-    metadata = pickle.load(f)
+# Optional search-time overrides of the nprobe/efSearch persisted with the index
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "0")) or None
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "0")) or None
 
-embed_model = SentenceTransformer("/app/models/all-MiniLM-L6-v2")
-# embed_model = SentenceTransformer("models/all-MiniLM-L6-v2")
+# Query-embedding cache (normalized query -> vector), persisted per model version
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "10000"))
+QUERY_CACHE_MAX_MB = float(os.getenv("QUERY_CACHE_MAX_MB", "64"))
+QUERY_CACHE_PERSIST = os.getenv("QUERY_CACHE_PERSIST", "1") == "1"
 
-def retrieve_top_k(query, k=5, similarity_threshold=0):
-    query_vec = embed_model.encode([query], convert_to_numpy=True)
-    distances, indices = index.search(query_vec, k)
+# Retrieval mode: "dense" (FAISS only), "hybrid" (BM25 + FAISS score fusion), "lexical" (BM25 only)
+# or "rerank" (binary over-fetch + latency-budgeted re-rank, returns only the best few chunks)
+RETRIEVAL_MODES = ("dense", "hybrid", "lexical", "rerank")
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense")
+HYBRID_ALPHA = float(os.getenv("HYBRID_ALPHA", "0.5"))       # weight of the dense score
+HYBRID_DENSE_K = int(os.getenv("HYBRID_DENSE_K", "0")) or None  # dense candidates in hybrid mode (default k)
 
-    max_dist = np.max(distances)
-    similarities = 1 - (distances / max_dist)
+# Caption index: images whose caption has cosine >= threshold to the query are "relevant"
+CAPTION_SIMILARITY_THRESHOLD = float(os.getenv("CAPTION_SIMILARITY_THRESHOLD", "0.4"))
+
+# Two-stage retrieval ("rerank" mode)
+RERANK_FETCH_K = int(os.getenv("RERANK_FETCH_K", "100"))      # first-stage candidates
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "4"))            # chunks handed to the LLM (at most k)
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "30"))  # per-query re-scoring budget
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+RERANK_SCORER = os.getenv("RERANK_SCORER", "exact")           # exact | cross_encoder
+RERANK_CROSS_ENCODER_PATH = os.getenv("RERANK_CROSS_ENCODER_PATH", "/app/models/ms-marco-MiniLM-L-6-v2")
+
+# Sharded corpus: enabled when Artifacts/corpus/registry.json exists at startup
+SHARD_SEARCH_THREADS = int(os.getenv("SHARD_SEARCH_THREADS", str(min(8, os.cpu_count() or 1))))
+
+
+class UnsupportedModeError(ValueError):
+    """Retrieval mode that the loaded corpus cannot serve (the request is fine otherwise)."""
+
+
+# ---------------- LAZY RETRIEVER ----------------
+class Retriever:
+    """
+    Holds the FAISS index, chunk metadata and embedding model, loading each
+    component on first use (or from a background warm-up thread).
+    Every component has its own lock, so concurrent requests load it once.
+    """
+
+    COMPONENTS = ("index", "metadata", "embed_model", "query_cache", "lexical_index", "caption_index",
+                  "binary_index", "chunk_vectors", "reranker")
+
+    def __init__(self, index_path=FAISS_INDEX_PATH, metadata_path=METADATA_PATH,
+                 model_path=EMBED_MODEL_PATH, chunk_store_dir=CHUNK_STORE_DIR,
+                 bm25_index_dir=BM25_INDEX_DIR, caption_index_dir=CAPTION_INDEX_DIR,
+                 binary_index_path=BINARY_INDEX_PATH, chunk_vectors_path=CHUNK_VECTORS_PATH,
+                 warm_components=None):
+        self.index_path = index_path
+        self.metadata_path = metadata_path
+        self.chunk_store_dir = chunk_store_dir
+        self.bm25_index_dir = bm25_index_dir
+        self.caption_index_dir = caption_index_dir
+        self.binary_index_path = binary_index_path
+        self.chunk_vectors_path = chunk_vectors_path
+        self.model_path = model_path
+        # Components loaded by warm-up and required for readiness (default: all)
+        self.warm_components = tuple(warm_components or self.COMPONENTS)
+
+        self._components = {}
+        self._locks = {name: threading.Lock() for name in self.COMPONENTS}
+        self._warmup_thread = None
+        self.index_config = None
+        self.load_times = {}
+        self.load_errors = {}
+        self.rerank_counters = {"queries": 0, "budget_exhausted": 0, "scored": 0, "candidates": 0}
+
+    @classmethod
+    def for_directory(cls, directory, warm_components=("index", "metadata")):
+        """Retriever over a build directory laid out like Artifacts/embeddings (e.g. a corpus shard)."""
+        return cls(
+            index_path=os.path.join(directory, os.path.basename(FAISS_INDEX_PATH)),
+            metadata_path=os.path.join(directory, os.path.basename(METADATA_PATH)),
+            chunk_store_dir=os.path.join(directory, os.path.basename(CHUNK_STORE_DIR)),
+            bm25_index_dir=os.path.join(directory, os.path.basename(BM25_INDEX_DIR)),
+            caption_index_dir=os.path.join(directory, os.path.basename(CAPTION_INDEX_DIR)),
+            binary_index_path=os.path.join(directory, os.path.basename(BINARY_INDEX_PATH)),
+            chunk_vectors_path=os.path.join(directory, os.path.basename(CHUNK_VECTORS_PATH)),
+            warm_components=warm_components,
+        )
+
+    # ---- loaders ----
+    def _read_index(self):
+        # mmap the stored vectors so all workers share the same page-cache pages
+        mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+        if mmap_flag is not None:
+            try:
+                return faiss.read_index(self.index_path, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError as e:
+                print(f"[retriever] mmap read not supported for this index, loading into RAM: {e}")
+        return faiss.read_index(self.index_path)
+
+    def _load_index(self):
+        index = self._read_index()
+        self.index_config = load_index_config(self.index_path)
+        return apply_search_params(index, self.index_config,
+                                   nprobe=FAISS_NPROBE, efSearch=FAISS_EF_SEARCH)
+
+    def _load_metadata(self):
+        # Columnar mmap store (rows decoded on access); pickle kept as a fallback for old builds
+        if chunk_store_exists(self.chunk_store_dir):
+            return ChunkStore(self.chunk_store_dir)
+        with open(self.metadata_path, "rb") as f:
+            return pickle.load(f)
+
+    def _load_embed_model(self):
+        built_with = (load_index_config(self.index_path) or {}).get("encoder", "torch")
+        if built_with != EMBED_BACKEND:
+            print(f"[retriever] index was built with the '{built_with}' encoder, "
+                  f"querying with '{EMBED_BACKEND}' (rebuild for best agreement)")
+        if EMBED_SERVICE_SOCKET:
+            # Shared micro-batching service: no model copy in this worker
+            if service_available(EMBED_SERVICE_SOCKET):
+                return EmbeddingServiceClient(EMBED_SERVICE_SOCKET)
+            print(f"[retriever] embedding service socket {EMBED_SERVICE_SOCKET} not found, loading the model locally")
+        return load_encoder(EMBED_BACKEND, self.model_path)
+
+    def _load_query_cache(self):
+        persist_path = None
+        if QUERY_CACHE_PERSIST:
+            persist_path = os.path.join(
+                CACHE_DIR, f"query_embeddings_{model_fingerprint(self.model_path, EMBED_BACKEND)}.npz"
+            )
+        return EmbeddingCache(max_entries=QUERY_CACHE_SIZE,
+                              max_bytes=int(QUERY_CACHE_MAX_MB * 1024 * 1024),
+                              persist_path=persist_path)
+
+    def _load_lexical_index(self):
+        # None for builds made before the BM25 index existed (hybrid/lexical modes then fail loudly)
+        if not bm25_index_exists(self.bm25_index_dir):
+            return None
+        return BM25Index(self.bm25_index_dir)
+
+    def _load_caption_index(self):
+        # None when the corpus has no captions (or for older builds)
+        if not caption_index_exists(self.caption_index_dir):
+            return None
+        return CaptionIndex(self.caption_index_dir)
+
+    def _load_binary_index(self):
+        # None for older builds: "rerank" mode then over-fetches from the main index
+        if not os.path.exists(self.binary_index_path):
+            return None
+        return read_binary_index(self.binary_index_path)
+
+    def _load_chunk_vectors(self):
+        # float16 (n_chunks, dim) copy of the chunk embeddings for exact re-scoring
+        if not os.path.exists(self.chunk_vectors_path):
+            return None
+        return np.load(self.chunk_vectors_path, mmap_mode="r")
+
+    def _load_reranker(self):
+        if RERANK_SCORER not in RERANK_SCORERS:
+            raise ValueError(f"Invalid RERANK_SCORER '{RERANK_SCORER}'. Use one of {RERANK_SCORERS}.")
+        if RERANK_SCORER == "cross_encoder":
+            return CrossEncoderScorer(RERANK_CROSS_ENCODER_PATH, lambda row: self.metadata[row]["content"])
+        # None for builds without chunk vectors ("rerank" mode then fails loudly)
+        if self.chunk_vectors is None:
+            return None
+        return ExactScorer(self.chunk_vectors)
+
+    def _get(self, name):
+        if name in self._components:
+            return self._components[name]
+
+        with self._locks[name]:
+            # Another thread may have finished loading while we waited
+            if name in self._components:
+                return self._components[name]
+
+            start = time.perf_counter()
+            try:
+                component = getattr(self, f"_load_{name}")()
+            except Exception as e:
+                self.load_errors[name] = f"{type(e).__name__}: {e}"
+                raise
+            self.load_times[name] = round(time.perf_counter() - start, 3)
+            self.load_errors.pop(name, None)
+            self._components[name] = component
+            return component
+
+    @property
+    def index(self):
+        return self._get("index")
+
+    @property
+    def metadata(self):
+        return self._get("metadata")
+
+    @property
+    def embed_model(self):
+        return self._get("embed_model")
+
+    @property
+    def query_cache(self):
+        return self._get("query_cache")
+
+    @property
+    def caption_index(self):
+        return self._get("caption_index")
+
+    @property
+    def binary_index(self):
+        return self._get("binary_index")
+
+    @property
+    def chunk_vectors(self):
+        return self._get("chunk_vectors")
+
+    @property
+    def reranker(self):
+        reranker = self._get("reranker")
+        if reranker is None:
+            raise RuntimeError(
+                f"Chunk vectors not found at {self.chunk_vectors_path}; rebuild with `python -m Src.rag.embed_store`"
+            )
+        return reranker
+
+    @property
+    def lexical_index(self):
+        lexical_index = self._get("lexical_index")
+        if lexical_index is None:
+            raise RuntimeError(
+                f"BM25 index not found at {self.bm25_index_dir}; rebuild with `python -m Src.rag.embed_store`"
+            )
+        return lexical_index
+
+    def corpus_fingerprint(self):
+        """Changes whenever the index is rebuilt (row ids are only stable within one build)."""
+        st = os.stat(self.index_path)
+        return f"{int(st.st_mtime)}-{st.st_size}"
+
+    def save_caches(self):
+        if "query_cache" in self._components:
+            self.query_cache.save()
+
+    def cache_stats(self):
+        return {
+            "query_embedding_cache": self.query_cache.stats() if "query_cache" in self._components else None,
+            "embedding_service": self._embedding_service_stats(),
+            "rerank": dict(self.rerank_counters),
+        }
+
+    def _embedding_service_stats(self):
+        model = self._components.get("embed_model")
+        if not isinstance(model, EmbeddingServiceClient):
+            return None
+        try:
+            return model.stats()
+        except (OSError, ConnectionError) as e:
+            return {"error": str(e)}
+
+    # ---- warm-up / health ----
+    def load_all(self):
+        """Load every warm-up component (errors are recorded in `load_errors`)."""
+        for name in self.warm_components:
+            try:
+                self._get(name)
+            except Exception as e:
+                print(f"[retriever] failed to load {name}: {e}")
+
+    def warm_up(self, background=True):
+        """Start loading all components; returns immediately when background=True."""
+        if not background:
+            self.load_all()
+            return None
+        if self._warmup_thread is None or not self._warmup_thread.is_alive():
+            self._warmup_thread = threading.Thread(
+                target=self.load_all, name="retriever-warmup", daemon=True
+            )
+            self._warmup_thread.start()
+        return self._warmup_thread
+
+    def is_ready(self):
+        return all(name in self._components for name in self.warm_components)
+
+    def status(self):
+        return {
+            "ready": self.is_ready(),
+            "index_type": (self.index_config or {}).get("index_type", "flat"),
+            "encoder_backend": EMBED_BACKEND,
+            "warming_up": bool(self._warmup_thread and self._warmup_thread.is_alive()),
+            "components": {
+                name: {
+                    "loaded": name in self._components,
+                    "load_seconds": self.load_times.get(name),
+                    "error": self.load_errors.get(name),
+                }
+                for name in self.warm_components
+            },
+        }
+
+
+# In sharded mode the global retriever only holds the encoder; each shard has its own Retriever
+shard_registry = ShardRegistry(REGISTRY_PATH)
+SHARDED = shard_registry.exists()
+shard_set = ShardSet(shard_registry, Retriever.for_directory)
+retriever = Retriever(warm_components=("embed_model", "query_cache") if SHARDED else None)
+_shard_executor = None
+
+
+def corpus_fingerprint():
+    """
+    Namespace for caches keyed on chunk ids: the global index build, or in
+    sharded mode the registry version plus each shard's build.
+    """
+    if not SHARDED:
+        return retriever.corpus_fingerprint()
+    shards = shard_registry.shards()
+    parts = [f"registry@{shard_registry.version}"]
+    for name in sorted(shards):
+        shard = Retriever.for_directory(shard_registry.shard_dir(name))
+        try:
+            build = shard.corpus_fingerprint()
+        except FileNotFoundError:
+            build = "missing"
+        parts.append(f"{name}@{shards[name].get('added_at')}/{build}")
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def __getattr__(name):
+    # Backwards compatibility: `from Src.rag.retriever import index, metadata, embed_model`
+    if name in Retriever.COMPONENTS:
+        return getattr(retriever, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _encode_uncached(queries):
+    return retriever.embed_model.encode(list(queries), convert_to_numpy=True,
+                                        batch_size=max(1, min(len(queries), 256)))
+
+
+def encode_queries(queries):
+    """
+    Embed queries (float32, one row per query). Cached queries skip the encoder;
+    the rest are encoded together in a single forward pass.
+    """
+    return retriever.query_cache.encode(list(queries), _encode_uncached)
+
+
+def filter_bitmap(section=None, pages=None, document=None, source=None):
+    """
+    Packed row bitmap for metadata filters (None when no filter is set).
+    Uses the chunk store's precomputed per-section/per-document bitmaps;
+    old pickled metadata is scanned instead. `source` is the Retriever to
+    filter (default: the global one; a shard in sharded mode).
+    """
+    if section is None and pages is None and document is None:
+        return None
+    metadata = (source or retriever).metadata
+    if isinstance(metadata, ChunkStore):
+        return metadata.filter_bitmap(section=section, pages=pages, document=document)
+    return pack_mask([
+        (section is None or m.get("section") == section)
+        and (document is None or m.get("pdf_file") == document)
+        and (pages is None or pages[0] <= (m.get("page_num") or 0) <= pages[1])
+        for m in metadata
+    ])
+
+
+def _dense_search(query_vecs, k, bitmap=None, source=None):
+    """index.search, restricted to the rows set in `bitmap` via an IDSelector when given."""
+    index = (source or retriever).index
+    if bitmap is None:
+        return index.search(query_vecs, k)
+    # n is the bitmap length in bytes; ids past the end are treated as not set
+    selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+    params = search_parameters(index, selector)
+    if params is not None:
+        return index.search(query_vecs, k, params=params)
+
+    # Index can't filter in-search (flat PQ scans everything anyway): rank all rows, keep allowed ones.
+    # Row ids can exceed ntotal after incremental updates (tombstones), so size the mask by the bitmap
+    distances, indices = index.search(query_vecs, index.ntotal)
+    allowed = unpack_bitmap(bitmap, len(bitmap) * 8)
+    out_d = np.full((len(query_vecs), k), np.finfo(np.float32).max, dtype=np.float32)
+    out_i = np.full((len(query_vecs), k), -1, dtype=np.int64)
+    for row, (row_d, row_i) in enumerate(zip(distances, indices)):
+        keep = (row_i >= 0) & (row_i < len(allowed))
+        keep[keep] = allowed[row_i[keep]]
+        row_d, row_i = row_d[keep][:k], row_i[keep][:k]
+        out_d[row, :len(row_d)], out_i[row, :len(row_i)] = row_d, row_i
+    return out_d, out_i
+
+
+def _chunk_hit(idx, dist, sim, source=None):
+    chunk_meta = (source or retriever).metadata[idx]
+    return {
+        "content": chunk_meta["content"],
+        "page_num": chunk_meta["page_num"],
+        "pdf_file": chunk_meta["pdf_file"],
+        "page_snapshot": chunk_meta.get("page_snapshot"),
+        "images": chunk_meta.get("images", []),
+        # "captions": chunk_meta.get("captions", []),
+        "distance": None if dist is None else float(dist),
+        "similarity": float(sim),
+        "row": int(idx),
+        "link": f"{PDF_DIR}/{chunk_meta['pdf_file']}#page={chunk_meta['page_num']}"
+    }
+
+
+def _raw_results(indices, distances, similarity_threshold=0):
+    """Per-chunk hits for one query row of an index.search result."""
+    # Filtered searches pad missing hits with idx -1 / FLT_MAX; keep those out of the scale
+    valid = indices >= 0
+    max_dist = np.max(distances[valid]) if valid.any() else 1.0
+    similarities = 1 - (distances / (max_dist or 1.0))
 
     raw_results = []
-    for idx, dist, sim in zip(indices[0], distances[0], similarities[0]):
+    for idx, dist, sim in zip(indices, distances, similarities):
         if idx == -1: continue
         if sim < similarity_threshold: continue
+        raw_results.append(_chunk_hit(idx, dist, sim))
+    return raw_results
+
+
+def _exact_cosines(query_vec, rows):
+    """
+    Cosine of the (normalized) query against stored vectors: the float16 chunk
+    vectors written by the build (IVF indexes cannot reconstruct by row), else
+    index.reconstruct; 0 when neither is available.
+    """
+    chunk_vectors = retriever.chunk_vectors
+    if chunk_vectors is not None:
+        rows = [int(row) for row in rows]
+        sims = np.asarray(chunk_vectors[rows], dtype=np.float32) @ np.asarray(query_vec, dtype=np.float32)
+        return dict(zip(rows, sims.tolist()))
+
+    cosines = {}
+    for row in rows:
+        try:
+            cosines[row] = float(np.dot(query_vec, retriever.index.reconstruct(int(row))))
+        except RuntimeError:
+            cosines[row] = 0.0
+    return cosines
+
+
+def _hybrid_results(query, query_vec, dense_indices, dense_distances, k,
+                    similarity_threshold=0, alpha=HYBRID_ALPHA, mask=None):
+    """
+    Fuse dense and BM25 candidates: score = alpha * cosine + (1 - alpha) * bm25 / max_bm25.
+    Embeddings are unit-normalized, so cosine = 1 - squared_l2 / 2.
+    """
+    lexical = retriever.lexical_index
+    bm25 = lexical.scores(query)
+    lex_rows, lex_scores = lexical.top_k(bm25, k, mask)
+    lex_max = float(lex_scores[0]) if len(lex_scores) else 0.0
+
+    dense = {int(r): 1 - float(d) / 2 for r, d in zip(dense_indices, dense_distances) if r != -1}
+    missing = [int(r) for r in lex_rows if int(r) not in dense]
+    if query_vec is not None and missing:
+        dense.update(_exact_cosines(query_vec, missing))
+
+    fused = []
+    for row in set(dense) | {int(r) for r in lex_rows}:
+        lex = float(bm25[row]) / lex_max if lex_max else 0.0
+        cos = dense.get(row, 0.0)
+        fused.append((alpha * cos + (1 - alpha) * lex, row, cos))
+    fused.sort(key=lambda x: (-x[0], x[1]))
+
+    raw_results = []
+    for score, row, cos in fused[:k]:
+        if score < similarity_threshold: continue
+        distance = 2 * (1 - cos) if query_vec is not None else None
+        raw_results.append(_chunk_hit(row, distance, score))
+    return raw_results
+
+
+def _rerank_results(query, query_vec, candidates, k, similarity_threshold=0):
+    """Re-score first-stage `candidates` within RERANK_BUDGET_MS and keep the best min(k, RERANK_TOP_N)."""
+    candidates = [int(r) for r in candidates if r != -1]
+    reranker = retriever.reranker
+    rows, scores, info = budgeted_rerank(query, query_vec, candidates, reranker,
+                                         RERANK_BUDGET_MS, batch_size=RERANK_BATCH_SIZE)
+    counters = retriever.rerank_counters
+    counters["queries"] += 1
+    counters["budget_exhausted"] += info["budget_exhausted"]
+    counters["scored"] += info["scored"]
+    counters["candidates"] += info["candidates"]
+
+    exact = reranker.name == "exact"
+    raw_results = []
+    for row, score in zip(rows[:min(k, RERANK_TOP_N)], scores):
+        if np.isnan(score):
+            break  # budget ran out before this candidate was scored
+        if score < similarity_threshold: continue
+        raw_results.append(_chunk_hit(row, 2 * (1 - score) if exact else None, score))
+    return raw_results
+
+
+def _first_stage(query_vecs, fetch_k, bitmap=None):
+    """Cheap candidate rows per query: binary (Hamming) index when built, else the main index."""
+    binary_index = retriever.binary_index
+    if binary_index is None:
+        return _dense_search(query_vecs, fetch_k, bitmap)[1]
+    return binary_search(binary_index, query_vecs, fetch_k, bitmap)
 
-        chunk_meta = metadata[idx]
-        raw_results.append({
-            "content": chunk_meta["content"],
-            "page_num": chunk_meta["page_num"],
-            "pdf_file": chunk_meta["pdf_file"],
-            "page_snapshot": chunk_meta.get("page_snapshot"),
-            "images": chunk_meta.get("images", []),
-            # "captions": chunk_meta.get("captions", []),
-            "distance": float(dist),
-            "similarity": float(sim),
-            "link": f"{PDF_DIR}/{chunk_meta['pdf_file']}#page={chunk_meta['page_num']}"
-        })
 
-    # Group by page
+def _get_shard_executor():
+    global _shard_executor
+    if _shard_executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _shard_executor = ThreadPoolExecutor(max_workers=SHARD_SEARCH_THREADS, thread_name_prefix="shard-search")
+    return _shard_executor
+
+
+def _sharded_results(queries, k, similarity_threshold=0, section=None, pages=None, document=None):
+    """
+    Dense search fanned out to every shard (only shards holding `document` when
+    it is set) on a thread pool; FAISS releases the GIL during search. Per query,
+    the global top-k is taken with a heap over all shards' (distance, shard, row).
+    Chunk ids become "<shard>:<row>".
+    """
+    shard_set.sync()
+    names = shard_registry.shards_for_document(document)
+    if not names:
+        return [[] for _ in queries]
+    query_vecs = encode_queries(queries)
+
+    def search_shard(name):
+        shard = shard_set.get(name)
+        bitmap = filter_bitmap(section=section, pages=pages, document=document, source=shard)
+        distances, indices = _dense_search(query_vecs, k, bitmap, source=shard)
+        return name, shard, distances, indices
+
+    shard_hits = list(_get_shard_executor().map(search_shard, names))
+    shards = {name: shard for name, shard, _, _ in shard_hits}
+
+    results = []
+    for q in range(len(queries)):
+        best = heapq.nsmallest(k, (
+            (float(dist), name, int(row))
+            for name, _, distances, indices in shard_hits
+            for dist, row in zip(distances[q], indices[q]) if row != -1
+        ))
+        max_dist = max((d for d, _, _ in best), default=1.0) or 1.0
+
+        raw_results = []
+        for dist, name, row in best:
+            sim = 1 - dist / max_dist
+            if sim < similarity_threshold: continue
+            hit = _chunk_hit(row, dist, sim, source=shards[name])
+            hit["row"] = f"{name}:{row}"
+            hit["shard"] = name
+            raw_results.append(hit)
+        results.append(_group_by_page(raw_results))
+    return results
+
+
+def _group_by_page(raw_results):
+    """Merge chunk hits that land on the same page (of the same document) into one result, sorted by page."""
     grouped = {}
-    for r in raw_results:
-        page = r["page_num"]
+    for rank, r in enumerate(raw_results, start=1):
+        page = (r["page_num"], r["pdf_file"])
         if page not in grouped:
             grouped[page] = {
-                "page_num": page,
+                "rank": rank,
+                "page_num": r["page_num"],
                 "pdf_file": r["pdf_file"],
                 "content": [],
                 "images": [],
                 # "captions": r.get("captions", []),
                 "page_snapshot": r["page_snapshot"],
-                "link": r["link"]
+                "link": r["link"],
+                "chunk_ids": []
             }
         grouped[page]["content"].append(r["content"])
         grouped[page]["images"].extend(r["images"])
+        grouped[page]["chunk_ids"].append(r["row"])
 
     results = []
-    for page, data in grouped.items():
+    for data in grouped.values():
         merged_text = " ".join(data["content"])
         snippet = merged_text[:150] + "..." if len(merged_text) > 150 else merged_text
         results.append({
-            "page_num": page,
+            "page_num": data["page_num"],
             "pdf_file": data["pdf_file"],
             "content": merged_text,
             "page_snapshot": data["page_snapshot"],
             "images": list(set(data["images"])),
             # "captions": data.get("captions", []),
             "link": data["link"],
-            "snippet": snippet
+            "snippet": snippet,
+            "chunk_ids": sorted(data["chunk_ids"]),
+            # Rank of the page's best chunk among the hits (results themselves are in page order)
+            "rank": data["rank"]
         })
 
-    return sorted(results, key=lambda x: x["page_num"])
-
-def filter_images_by_caption_similarity(query, captions, threshold=0.4):
-    query_emb = embed_model.encode([query], convert_to_numpy=True)[0]
-    relevant_images = []
-    for cap in captions:
-        if cap.get("embedding") is not None:
-            cap_emb = np.array(cap["embedding"])
-            sim = np.dot(query_emb, cap_emb) / (norm(query_emb) * norm(cap_emb))
-            if sim >= threshold:
-                relevant_images.append(cap["image_path"])
-    return relevant_images
+    return sorted(results, key=lambda x: (x["page_num"], x["pdf_file"] or ""))
+
+
+def retrieve_top_k(query, k=5, similarity_threshold=0, mode=None,
+                   section=None, pages=None, document=None):
+    return retrieve_top_k_batch([query], k=k, similarity_threshold=similarity_threshold, mode=mode,
+                                section=section, pages=pages, document=document)[0]
+
+
+def retrieve_top_k_batch(queries, k=5, similarity_threshold=0, mode=None,
+                         section=None, pages=None, document=None):
+    """
+    Retrieve for many queries at once: one encoder forward pass and one
+    matrix index.search. Returns one page-grouped result list per query,
+    identical to calling retrieve_top_k on each query.
+
+    mode: "dense" (default, RETRIEVAL_MODE env), "hybrid" (BM25 + dense fusion),
+    "lexical" (BM25 only, no encoder call) or "rerank" (binary over-fetch of
+    RERANK_FETCH_K rows, re-scored within RERANK_BUDGET_MS, best RERANK_TOP_N kept).
+    Filters (applied inside the index search, not afterwards):
+        section="Treatment", pages=(100, 200) (inclusive), document="medical_book.pdf"
+    """
+    mode = mode or RETRIEVAL_MODE
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Invalid retrieval mode '{mode}'. Use one of {RETRIEVAL_MODES}.")
+    if not queries:
+        return []
+    if SHARDED:
+        if mode != "dense":
+            raise UnsupportedModeError(f"Retrieval mode '{mode}' is not supported on a sharded corpus; use 'dense'.")
+        return _sharded_results(queries, k, similarity_threshold,
+                                section=section, pages=pages, document=document)
+
+    bitmap = filter_bitmap(section=section, pages=pages, document=document)
+    mask = None
+    if bitmap is not None and mode in ("hybrid", "lexical"):
+        mask = unpack_bitmap(bitmap, retriever.lexical_index.n_docs)
+
+    if mode == "lexical":
+        return [
+            _group_by_page(_hybrid_results(q, None, [], [], k, similarity_threshold, alpha=0.0, mask=mask))
+            for q in queries
+        ]
+
+    query_vecs = encode_queries(queries)
+    if mode == "rerank":
+        candidates = _first_stage(query_vecs, max(RERANK_FETCH_K, k), bitmap)
+        return [
+            _group_by_page(_rerank_results(q, vec, row_candidates, k, similarity_threshold))
+            for q, vec, row_candidates in zip(queries, query_vecs, candidates)
+        ]
+
+    dense_k = (HYBRID_DENSE_K or k) if mode == "hybrid" else k
+    distances, indices = _dense_search(query_vecs, dense_k, bitmap)
+
+    if mode == "hybrid":
+        return [
+            _group_by_page(_hybrid_results(q, vec, row_indices, row_distances, k,
+                                           similarity_threshold, mask=mask))
+            for q, vec, row_indices, row_distances in zip(queries, query_vecs, indices, distances)
+        ]
+    return [
+        _group_by_page(_raw_results(row_indices, row_distances, similarity_threshold))
+        for row_indices, row_distances in zip(indices, distances)
+    ]
+
+def filter_images_by_caption_similarity(query, captions=None, threshold=CAPTION_SIMILARITY_THRESHOLD,
+                                        query_vec=None):
+    """
+    Image paths whose caption is similar to `query`, best first. With the caption
+    index this is one vectorized range search; `captions` (caption dicts with a
+    caption_id) restricts it to those captions, None searches all of them.
+    """
+    if query_vec is None:
+        query_vec = encode_queries([query])[0]
+    caption_index = retriever.caption_index
+    if caption_index is not None and (captions is None or any("caption_id" in c for c in captions)):
+        caption_ids = None
+        if captions is not None:
+            caption_ids = [c["caption_id"] for c in captions if c.get("caption_id") is not None]
+        return [path for path, _ in caption_index.search(query_vec, threshold, caption_ids)[0]]
+
+    # Metadata built before the caption index: embeddings stored per caption
+    legacy = [c for c in captions or [] if c.get("embedding") is not None]
+    if not legacy:
+        return []
+    cap_embs = np.asarray([c["embedding"] for c in legacy], dtype=np.float32)
+    sims = cap_embs @ query_vec / (norm(cap_embs, axis=1) * norm(query_vec))
+    order = np.argsort(-sims, kind="stable")
+    return [legacy[i]["image_path"] for i in order if sims[i] >= threshold]
+
+
+def relevant_images_for_results(query_vec, results, threshold=CAPTION_SIMILARITY_THRESHOLD):
+    """
+    {page_num: [image_path, ...]} of caption-matched images among the chunks of
+    page-grouped `results`, from one caption-index search (one per shard hit in
+    sharded mode, where chunk ids are "<shard>:<row>"). Empty without captions.
+    """
+    rows_by_shard = {}
+    for r in results:
+        for chunk_id in r.get("chunk_ids", []):
+            if SHARDED:
+                name, _, row = str(chunk_id).rpartition(":")
+                rows_by_shard.setdefault(name, []).append(int(row))
+            else:
+                rows_by_shard.setdefault(None, []).append(chunk_id)
+
+    pages = {}
+    for name, rows in rows_by_shard.items():
+        if name is None:
+            caption_index = retriever.caption_index
+        elif name in shard_registry.shards():
+            caption_index = shard_set.get(name).caption_index
+        else:
+            continue  # shard removed since retrieval
+        if caption_index is None:
+            continue
+        matches = caption_index.search(query_vec, threshold, caption_index.caption_ids_for_rows(rows))[0]
+        for path, _ in matches:
+            pages.setdefault(caption_index.image_pages[path], []).append(path)
+    return pages
@@ -0,0 +1,170 @@
+# Src/rag/shards.py
+"""
+Sharded multi-document corpus.
+
+Each shard is a directory with the same artifacts as Artifacts/embeddings
+(faiss_index.bin, chunk_store/, bm25/, ...) built from one document or a
+group of documents. A JSON registry lists the shards:
+
+    Artifacts/corpus/registry.json
+        {"shards": {"<name>": {"dir": "shards/<name>", "documents": [...],
+                               "n_chunks": 1234, "index_type": "flat",
+                               "encoder": "torch", "added_at": 1700000000.0}}}
+
+Adding or removing a book only rewrites its shard and the registry; running
+API workers notice the registry change on the next query and load/unload
+just that shard.
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import threading
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+DATA_DIR = os.path.join(BASE_DIR, "Artifacts")
+CORPUS_DIR = os.getenv("CORPUS_DIR", os.path.join(DATA_DIR, "corpus"))
+SHARDS_DIR = os.path.join(CORPUS_DIR, "shards")
+REGISTRY_PATH = os.path.join(CORPUS_DIR, "registry.json")
+
+
+# ---------------- REGISTRY ----------------
+class ShardRegistry:
+    """JSON registry of corpus shards (atomic writes, re-read when the file changes)."""
+
+    def __init__(self, path=REGISTRY_PATH):
+        self.path = path
+        self.root = os.path.dirname(path)
+        self._mtime = None
+        self._shards = {}
+
+    @property
+    def version(self):
+        """Changes whenever a different registry file has been read."""
+        return self._mtime
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def refresh(self):
+        """Re-read the registry if it changed on disk. Returns True when it did."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            changed = bool(self._shards)
+            self._shards, self._mtime = {}, None
+            return changed
+        if mtime == self._mtime:
+            return False
+        with open(self.path, "r", encoding="utf-8") as f:
+            self._shards = json.load(f).get("shards", {})
+        self._mtime = mtime
+        return True
+
+    def shards(self):
+        self.refresh()
+        return dict(self._shards)
+
+    def shard_dir(self, name):
+        return os.path.join(self.root, self.shards()[name]["dir"])
+
+    def _write(self, shards):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"shards": shards}, f, indent=2)
+        os.replace(tmp_path, self.path)
+        self.refresh()
+
+    def add(self, name, summary):
+        """Register (or replace) shard `name`, whose artifacts live in SHARDS_DIR/<name>."""
+        shards = self.shards()
+        shards[name] = {"dir": os.path.join("shards", name), "added_at": time.time(), **summary}
+        self._write(shards)
+
+    def remove(self, name, delete_files=False):
+        shards = self.shards()
+        entry = shards.pop(name)
+        self._write(shards)
+        if delete_files:
+            shutil.rmtree(os.path.join(self.root, entry["dir"]), ignore_errors=True)
+
+    def shards_for_document(self, document):
+        """Names of shards containing `document` (all shards when document is None)."""
+        return [name for name, entry in self.shards().items()
+                if document is None or document in entry.get("documents", [])]
+
+
+# ---------------- LOADED SHARDS ----------------
+class ShardSet:
+    """
+    Shards loaded in this process, kept in sync with the registry.
+    `factory(shard_dir)` builds the per-shard searcher (a Retriever over that dir);
+    each searcher loads its own components lazily and independently.
+    """
+
+    def __init__(self, registry, factory):
+        self.registry = registry
+        self.factory = factory
+        self._loaded = {}
+        self._lock = threading.Lock()
+        self._synced_version = None
+
+    def sync(self):
+        """Drop shards removed from (or replaced in) the registry; new ones load on first use."""
+        shards = self.registry.shards()
+        if self.registry.version == self._synced_version:
+            return
+        with self._lock:
+            self._synced_version = self.registry.version
+            for name in list(self._loaded):
+                entry = shards.get(name)
+                if entry is None or entry.get("added_at") != self._loaded[name][0]:
+                    self._loaded.pop(name)
+                    print(f"[shards] unloaded shard {name}")
+
+    def get(self, name):
+        with self._lock:
+            loaded = self._loaded.get(name)
+            if loaded is None:
+                entry = self.registry.shards()[name]
+                loaded = (entry.get("added_at"), self.factory(self.registry.shard_dir(name)))
+                self._loaded[name] = loaded
+        return loaded[1]
+
+    def unload(self, name):
+        with self._lock:
+            return self._loaded.pop(name, None) is not None
+
+    def loaded(self):
+        with self._lock:
+            return list(self._loaded)
+
+    def status(self):
+        shards = self.registry.shards()
+        loaded = set(self.loaded())
+        return {
+            name: {"loaded": name in loaded, "documents": entry.get("documents", []),
+                   "n_chunks": entry.get("n_chunks")}
+            for name, entry in shards.items()
+        }
+
+
+if __name__ == "__main__":
+    # Shards are built with: python -m Src.rag.embed_store --shard NAME --chunks path/to/chunks.json
+    parser = argparse.ArgumentParser(description="Inspect / edit the corpus shard registry")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list")
+    remove_parser = sub.add_parser("remove")
+    remove_parser.add_argument("name")
+    remove_parser.add_argument("--delete-files", action="store_true")
+    args = parser.parse_args()
+
+    registry = ShardRegistry()
+    if args.command == "list":
+        for name, entry in registry.shards().items():
+            print(f"{name}: {entry.get('n_chunks')} chunks, {entry.get('documents')}, {entry.get('index_type')}")
+    else:
+        registry.remove(args.name, delete_files=args.delete_files)
+        print(f"Shard '{args.name}' removed")
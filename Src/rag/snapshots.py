@@ -0,0 +1,303 @@
+# Src/rag/snapshots.py
+"""
+On-demand page snapshots with a tiered, size-bounded disk cache.
+
+Instead of pre-rendering every page of every book, a page is rendered from
+the PDF the first time it is requested, at one of SNAPSHOT_TIERS (thumbnail,
+preview, full), encoded as WebP (JPEG when Pillow is missing or
+SNAPSHOT_FORMAT=jpeg), and kept in the cache directory:
+
+    Artifacts/cache/snapshots/<pdf stem>_page<N>_<tier>.<ext>
+    Artifacts/cache/snapshots/snapshots.db   (SQLite, WAL)
+        snapshots   key -> path, bytes, last_used      (LRU eviction by total bytes)
+        page_refs   (pdf_file, page_num) -> count      (how often a page was referenced)
+
+Every uvicorn worker shares the files and the database. Rendering is capped
+at SNAPSHOT_RENDER_CONCURRENCY pages at a time per worker, and concurrent
+requests for the same snapshot wait for one render. `prewarm` renders the
+most-referenced pages ahead of time.
+
+    python -m Src.rag.snapshots prewarm --top 50 --tiers thumbnail preview
+"""
+import os
+import time
+import sqlite3
+import argparse
+import threading
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+DATA_DIR = os.path.join(BASE_DIR, "Artifacts")
+RAW_PDF_DIR = os.path.join(DATA_DIR, "raw_pdf")
+PAGE_IMAGES_DIR = os.path.join(DATA_DIR, "page_images")
+SNAPSHOT_CACHE_DIR = os.getenv("SNAPSHOT_CACHE_DIR", os.path.join(DATA_DIR, "cache", "snapshots"))
+SNAPSHOT_CACHE_MAX_MB = int(os.getenv("SNAPSHOT_CACHE_MAX_MB", "256"))
+SNAPSHOT_RENDER_CONCURRENCY = int(os.getenv("SNAPSHOT_RENDER_CONCURRENCY", "2"))
+SNAPSHOT_FORMAT = os.getenv("SNAPSHOT_FORMAT", "webp")  # webp | jpeg
+
+# tier -> (zoom, quality); PDF pages are ~612 pt wide, so thumbnail ~200 px, preview ~610 px,
+# full ~1220 px (the old pre-rendered 2x PNGs)
+SNAPSHOT_TIERS = {
+    "thumbnail": (0.33, 60),
+    "preview": (1.0, 75),
+    "full": (2.0, 85),
+}
+MEDIA_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_snapshots_last_used ON snapshots (last_used);
+CREATE TABLE IF NOT EXISTS page_refs (
+    pdf_file TEXT NOT NULL,
+    page_num INTEGER NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (pdf_file, page_num)
+);
+"""
+
+
+# ---------------- RENDERING ----------------
+def _encode(pix, fmt, quality):
+    """Pixmap -> (bytes, ext). WebP goes through Pillow; JPEG is native to PyMuPDF."""
+    if fmt == "webp":
+        try:
+            from PIL import Image
+            import io
+            image = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+            buffer = io.BytesIO()
+            image.save(buffer, format="WEBP", quality=quality, method=4)
+            return buffer.getvalue(), "webp"
+        except ImportError:
+            pass
+    return pix.tobytes("jpeg", jpg_quality=quality), "jpeg"
+
+
+def render_snapshot(pdf_path, page_num, tier="preview", fmt=SNAPSHOT_FORMAT):
+    """Render page `page_num` (1-based) of `pdf_path` at `tier`. Returns (image bytes, ext)."""
+    # Imported here: the API only needs PyMuPDF once a snapshot is actually rendered
+    import fitz
+    zoom, quality = SNAPSHOT_TIERS[tier]
+    with fitz.open(pdf_path) as doc:
+        # load_page accepts negative indexes (counted from the end); only real pages render
+        if not 1 <= page_num <= doc.page_count:
+            raise IndexError(f"page {page_num} outside 1..{doc.page_count}")
+        pix = doc.load_page(page_num - 1).get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    return _encode(pix, fmt, quality)
+
+
+# ---------------- CACHE ----------------
+class SnapshotCache:
+    """Disk LRU of rendered snapshots (bounded by `max_bytes`) plus page reference counts."""
+
+    def __init__(self, cache_dir=SNAPSHOT_CACHE_DIR, max_bytes=SNAPSHOT_CACHE_MAX_MB * 1024 * 1024,
+                 concurrency=SNAPSHOT_RENDER_CONCURRENCY, pdf_dir=RAW_PDF_DIR, fmt=SNAPSHOT_FORMAT):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.pdf_dir = pdf_dir
+        self.fmt = fmt
+        self.hits = 0
+        self.misses = 0
+        self.renders = 0
+        self.evictions = 0
+        self._documents = None
+        self._documents_mtime = None
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._render_slots = threading.BoundedSemaphore(max(1, concurrency))
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "snapshots.db"), check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    @staticmethod
+    def _key(pdf_file, page_num, tier):
+        return f"{os.path.splitext(os.path.basename(pdf_file))[0]}_page{int(page_num)}_{tier}"
+
+    def _lookup(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT path FROM snapshots WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if not os.path.exists(row[0]):
+                # Deleted behind our back (another worker's eviction, manual cleanup)
+                self._conn.execute("DELETE FROM snapshots WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE snapshots SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def known_documents(self):
+        """PDF file names in the raw PDF directory, re-listed only when the directory changes."""
+        try:
+            mtime = os.stat(self.pdf_dir).st_mtime_ns
+        except FileNotFoundError:
+            return set()
+        if mtime != self._documents_mtime:
+            self._documents = {name for name in os.listdir(self.pdf_dir) if name.lower().endswith(".pdf")}
+            self._documents_mtime = mtime
+        return self._documents
+
+    def get(self, pdf_file, page_num, tier="preview"):
+        """
+        Path of the `tier` snapshot of page `page_num` of `pdf_file` (a file name
+        in the raw PDF directory), rendering it on a miss. Falls back to a
+        pre-rendered PNG in Artifacts/page_images when the PDF is not available;
+        None when neither exists, `pdf_file` is not a known document, the page is
+        outside the document or the PDF cannot be read.
+        """
+        if tier not in SNAPSHOT_TIERS:
+            raise ValueError(f"Unknown snapshot tier {tier!r}; use one of {sorted(SNAPSHOT_TIERS)}")
+        if int(page_num) < 1 or not pdf_file or os.path.basename(pdf_file) != pdf_file:
+            return None
+        if pdf_file not in self.known_documents():
+            # Never open arbitrary names; only pre-rendered snapshots of removed PDFs are served
+            return self._legacy_snapshot(pdf_file, page_num)
+        key = self._key(pdf_file, page_num, tier)
+        path = self._lookup(key)
+        if path is not None:
+            self.hits += 1
+            return path
+
+        # One render per key: later requests wait for the first one
+        with self._inflight_lock:
+            event = self._inflight.get(key)
+            owner = event is None
+            if owner:
+                event = self._inflight[key] = threading.Event()
+        if not owner:
+            event.wait()
+            return self._lookup(key) or self._legacy_snapshot(pdf_file, page_num)
+
+        try:
+            self.misses += 1
+            pdf_path = os.path.join(self.pdf_dir, os.path.basename(pdf_file))
+            if not os.path.exists(pdf_path):
+                return self._legacy_snapshot(pdf_file, page_num)
+            with self._render_slots:
+                try:
+                    data, ext = render_snapshot(pdf_path, int(page_num), tier, self.fmt)
+                except (ValueError, IndexError):
+                    return None  # page number outside the document
+                except RuntimeError as e:
+                    # PyMuPDF raises FileDataError (a RuntimeError) for corrupt or truncated PDFs
+                    print(f"[snapshots] cannot render {pdf_file} page {page_num}: {e}")
+                    return None
+                self.renders += 1
+            return self._store(key, data, ext)
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def _legacy_snapshot(self, pdf_file, page_num):
+        stem = os.path.splitext(os.path.basename(pdf_file))[0]
+        path = os.path.join(PAGE_IMAGES_DIR, f"{stem}_page{int(page_num)}_snapshot.png")
+        return path if os.path.exists(path) else None
+
+    def _store(self, key, data, ext):
+        path = os.path.join(self.cache_dir, f"{key}.{ext}")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO snapshots (key, path, bytes, last_used) VALUES (?, ?, ?, ?)",
+                               (key, path, len(data), time.time()))
+            self._evict_locked(keep=key)
+            self._conn.commit()
+        return path
+
+    def _evict_locked(self, keep):
+        total = self._conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM snapshots").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, path, size in self._conn.execute(
+                "SELECT key, path, bytes FROM snapshots ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._conn.execute("DELETE FROM snapshots WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    # ---------------- REFERENCES / PRE-WARM ----------------
+    def record_references(self, pages):
+        """Count one reference for each (pdf_file, page_num) in `pages`."""
+        pages = [(os.path.basename(pdf_file), int(page_num)) for pdf_file, page_num in pages if pdf_file]
+        if not pages:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO page_refs (pdf_file, page_num, count) VALUES (?, ?, 1) "
+                "ON CONFLICT (pdf_file, page_num) DO UPDATE SET count = count + 1", pages)
+            self._conn.commit()
+
+    def most_referenced(self, top=50):
+        with self._lock:
+            return self._conn.execute("SELECT pdf_file, page_num, count FROM page_refs "
+                                      "ORDER BY count DESC, pdf_file, page_num LIMIT ?", (top,)).fetchall()
+
+    def prewarm(self, top=50, tiers=("thumbnail", "preview")):
+        """Render the `tiers` of the `top` most-referenced pages. Returns the number of snapshots rendered."""
+        renders_before = self.renders
+        pages = self.most_referenced(top)
+        for pdf_file, page_num, _ in pages:
+            for tier in tiers:
+                self.get(pdf_file, page_num, tier)
+        rendered = self.renders - renders_before
+        print(f"[snapshots] pre-warmed {len(pages)} pages x {list(tiers)}: {rendered} rendered, "
+              f"{len(pages) * len(tiers) - rendered} already cached")
+        return rendered
+
+    def stats(self):
+        with self._lock:
+            n, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM snapshots").fetchone()
+        return {"entries": n, "bytes": total, "max_bytes": self.max_bytes, "hits": self.hits,
+                "misses": self.misses, "renders": self.renders, "evictions": self.evictions}
+
+
+_snapshot_cache = None
+_snapshot_cache_lock = threading.Lock()
+
+
+def get_snapshot_cache():
+    """Lazily open the shared snapshot cache."""
+    global _snapshot_cache
+    if _snapshot_cache is None:
+        with _snapshot_cache_lock:
+            if _snapshot_cache is None:
+                _snapshot_cache = SnapshotCache()
+    return _snapshot_cache
+
+
+def snapshot_url(pdf_file, page_num, tier="preview"):
+    """API path that serves (and renders on first use) a page snapshot."""
+    return f"/snapshot/{os.path.basename(pdf_file)}/{int(page_num)}?tier={tier}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Page snapshot cache")
+    sub = parser.add_subparsers(dest="command", required=True)
+    prewarm_parser = sub.add_parser("prewarm", help="render the most-referenced pages ahead of time")
+    prewarm_parser.add_argument("--top", type=int, default=50)
+    prewarm_parser.add_argument("--tiers", nargs="+", default=["thumbnail", "preview"], choices=sorted(SNAPSHOT_TIERS))
+    sub.add_parser("stats")
+    args = parser.parse_args()
+
+    cache = get_snapshot_cache()
+    if args.command == "prewarm":
+        cache.prewarm(top=args.top, tiers=args.tiers)
+    print(cache.stats())
@@ -0,0 +1,210 @@
+# Src/rag/vector_store.py
+"""
+Persistent content-hash -> embedding store used by the index builder.
+
+Every chunk (and caption) text is hashed; its embedding is stored under that
+hash, so a rebuild only encodes texts whose hash has not been seen. The store
+is keyed by the encoder fingerprint: a different model or backend starts from
+an empty store instead of mixing vector spaces.
+
+Layout of the store directory:
+    meta.json      encoder fingerprint, dimension, entry count
+    hashes.json    list of hashes (row i of vectors.npy)
+    vectors.npy    float32 (n, dim)
+    segments/      checkpoints written during a build (segment-NNNNN.json with
+                   fingerprint and hashes + segment-NNNNN.npy vectors); folded
+                   into vectors.npy by save()
+
+Segments make a long embedding run resumable: an interrupted build reloads
+them and only encodes what is still missing. vectors.npy and the segments are
+memory-mapped, so only the vectors encoded since the last checkpoint are held
+in memory.
+"""
+import os
+import glob
+import json
+import bisect
+import shutil
+import hashlib
+import numpy as np
+
+SEGMENTS_DIR = "segments"
+
+
+def content_hash(text):
+    return hashlib.sha1((text or "").encode("utf-8")).hexdigest()
+
+
+class HashVectorStore:
+    """
+    hash -> float32 vector, loaded from / saved to `store_dir`. Saved vectors and
+    checkpoints are read through mmap; new vectors stay in memory until the next checkpoint.
+    """
+
+    def __init__(self, store_dir, fingerprint):
+        self.store_dir = store_dir
+        self.fingerprint = fingerprint
+        self.loaded = 0
+        self.added = 0
+        self.resumed = 0
+        self._reset()
+        self.load()
+
+    def _reset(self):
+        self._rows = {}
+        self._hashes = []
+        # Memory-mapped blocks of rows: _parts[i] holds rows _part_starts[i] ..
+        self._parts = []
+        self._part_starts = []
+        # Rows _checkpointed .. len(_hashes), not on disk yet
+        self._pending = []
+        self._checkpointed = 0
+        self._dimension = None
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def _add_part(self, hashes, vectors):
+        """Append an on-disk block of vectors; duplicated hashes are copied into memory instead."""
+        if not hashes:
+            return 0
+        if any(h in self._rows for h in hashes) or self._pending:
+            before = len(self._rows)
+            self.put_many(hashes, vectors)
+            return len(self._rows) - before
+        self._part_starts.append(len(self._hashes))
+        self._parts.append(vectors)
+        for h in hashes:
+            self._rows[h] = len(self._hashes)
+            self._hashes.append(h)
+        self._checkpointed = len(self._hashes)
+        self._dimension = vectors.shape[1]
+        return len(hashes)
+
+    def load(self):
+        meta_path = os.path.join(self.store_dir, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("fingerprint") != self.fingerprint:
+                print(f"[vector_store] encoder changed ({meta.get('fingerprint')} -> {self.fingerprint}), "
+                      f"ignoring {meta.get('n_entries', 0)} stored embeddings")
+            else:
+                with open(os.path.join(self.store_dir, "hashes.json"), "r", encoding="utf-8") as f:
+                    hashes = json.load(f)
+                if hashes:
+                    self._add_part(hashes, np.load(os.path.join(self.store_dir, "vectors.npy"), mmap_mode="r"))
+                self.loaded = len(hashes)
+
+        # Checkpoints of an interrupted build (.npz: written by older versions)
+        for path in sorted(glob.glob(os.path.join(self.store_dir, SEGMENTS_DIR, "segment-*.json"))):
+            with open(path, "r", encoding="utf-8") as f:
+                segment = json.load(f)
+            if segment.get("fingerprint") != self.fingerprint or not segment["hashes"]:
+                continue
+            vectors = np.load(os.path.splitext(path)[0] + ".npy", mmap_mode="r")
+            self.resumed += self._add_part(segment["hashes"], vectors)
+        for path in sorted(glob.glob(os.path.join(self.store_dir, SEGMENTS_DIR, "segment-*.npz"))):
+            with np.load(path) as segment:
+                if str(segment["fingerprint"]) != self.fingerprint:
+                    continue
+                before = len(self._rows)
+                self.put_many(segment["hashes"].tolist(), segment["vectors"])
+                self.resumed += len(self._rows) - before
+        if self.resumed:
+            print(f"[vector_store] resuming with {self.resumed} embeddings from checkpoints")
+        self.added = 0
+        return self.loaded + self.resumed
+
+    def missing(self, hashes):
+        """Hashes (deduplicated, in first-seen order) that have no stored embedding."""
+        return [h for h in dict.fromkeys(hashes) if h not in self._rows]
+
+    def put_many(self, hashes, vectors):
+        for h, vector in zip(hashes, np.asarray(vectors, dtype=np.float32)):
+            if h not in self._rows:
+                self._rows[h] = len(self._hashes)
+                self._hashes.append(h)
+                self._pending.append(vector)
+                self._dimension = len(vector)
+                self.added += 1
+
+    def _vector(self, row):
+        if row >= self._checkpointed:
+            return self._pending[row - self._checkpointed]
+        part = bisect.bisect_right(self._part_starts, row) - 1
+        return self._parts[part][row - self._part_starts[part]]
+
+    def get_many(self, hashes):
+        vectors = np.empty((len(hashes), self.dimension or 0), dtype=np.float32)
+        for i, h in enumerate(hashes):
+            vectors[i] = self._vector(self._rows[h])
+        return vectors
+
+    @property
+    def dimension(self):
+        return self._dimension
+
+    def checkpoint(self):
+        """Write the entries added since the last checkpoint as a new segment and mmap it."""
+        if not self._pending:
+            return 0
+        segments_dir = os.path.join(self.store_dir, SEGMENTS_DIR)
+        os.makedirs(segments_dir, exist_ok=True)
+        path = os.path.join(segments_dir, f"segment-{len(os.listdir(segments_dir)):05d}")
+        hashes = self._hashes[self._checkpointed:]
+        with open(path + ".npy.tmp", "wb") as f:
+            np.save(f, np.vstack(self._pending).astype(np.float32))
+        os.replace(path + ".npy.tmp", path + ".npy")
+        # The .json is written last: a segment without it is ignored on resume
+        with open(path + ".json.tmp", "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": self.fingerprint, "hashes": hashes}, f)
+        os.replace(path + ".json.tmp", path + ".json")
+
+        self._part_starts.append(self._checkpointed)
+        self._parts.append(np.load(path + ".npy", mmap_mode="r"))
+        self._pending = []
+        self._checkpointed = len(self._hashes)
+        return len(hashes)
+
+    def save(self, keep=None, batch_size=65536):
+        """Atomically write the store; `keep` (iterable of hashes) drops every other entry."""
+        hashes = list(self._rows)
+        if keep is not None:
+            keep = set(keep)
+            hashes = [h for h in hashes if h in keep]
+
+        tmp_dir = self.store_dir.rstrip("/\\") + ".tmp"
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        vectors_path = os.path.join(tmp_dir, "vectors.npy")
+        if hashes:
+            # Filled in batches: never more than `batch_size` vectors in memory
+            vectors = np.lib.format.open_memmap(vectors_path, mode="w+", dtype=np.float32,
+                                                shape=(len(hashes), self.dimension))
+            for start in range(0, len(hashes), batch_size):
+                vectors[start:start + batch_size] = self.get_many(hashes[start:start + batch_size])
+            vectors.flush()
+            del vectors
+        else:
+            np.save(vectors_path, np.zeros((0, self.dimension or 0), dtype=np.float32))
+        with open(os.path.join(tmp_dir, "hashes.json"), "w", encoding="utf-8") as f:
+            json.dump(hashes, f)
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": self.fingerprint, "dimension": self.dimension,
+                       "n_entries": len(hashes)}, f)
+
+        # Replaces the segments too: everything they held is in vectors.npy now.
+        # Drop the mmaps of the old files first, then map the new ones
+        counters = (self.loaded, self.added, self.resumed)
+        self._reset()
+        if os.path.exists(self.store_dir):
+            shutil.rmtree(self.store_dir)
+        os.replace(tmp_dir, self.store_dir)
+        self.load()
+        self.loaded, self.added, self.resumed = counters
+        return len(hashes)